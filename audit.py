@@ -0,0 +1,291 @@
+"""Журнал аудита: кто создал, перевыпустил или удалил какую конфигурацию.
+
+События пишутся только дозаписью в сегменты (audit-000001.log, одна строка
+JSON на событие). Обработчики бота лишь кладут событие в буфер, а фоновый
+поток раз в FLUSH_INTERVAL секунд дописывает накопленное одной записью и
+одним fsync. При достижении SEGMENT_BYTES начинается следующий сегмент;
+закрытые сегменты не меняются.
+
+Небольшой индекс в базе состояния хранит интервал времени событий каждого
+сегмента, а для пары (пользователь, сегмент) — интервал времени и смещение
+первого события пользователя. Запрос /audit читает с конца только сегменты,
+где по индексу есть события нужного пользователя за нужный период, и
+останавливается, набрав нужное число событий.
+
+Значение PIN в журнал не попадает: неверная попытка записывается только
+событием pin_failed.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit_segments (
+    segment INTEGER PRIMARY KEY,
+    size INTEGER NOT NULL,
+    first_at REAL NOT NULL,
+    last_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS audit_users (
+    user_id INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    first_at REAL NOT NULL,
+    last_at REAL NOT NULL,
+    first_offset INTEGER NOT NULL,
+    PRIMARY KEY (user_id, segment)
+) WITHOUT ROWID;
+"""
+
+# Размер сегмента, после которого начинается следующий
+SEGMENT_BYTES = 4 * 2**20
+# Как часто фоновый поток дописывает буфер, сек
+FLUSH_INTERVAL = 1.0
+# Буфер такого размера дописывается, не дожидаясь FLUSH_INTERVAL
+FLUSH_RECORDS = 500
+# Сколько событий держать в буфере, если запись не удается (старые отбрасываются)
+MAX_BUFFER = 100000
+
+_SEGMENT_RE = re.compile(r'^audit-(\d{6})\.log$')
+
+# Названия событий для /audit
+EVENTS = {
+    'create': 'создание',
+    'create_failed': 'отказ в создании',
+    'deploy': 'развернут на сервере',
+    'deploy_failed': 'развертывание не удалось',
+    'get': 'повторная выдача',
+    'rotate': 'перевыпуск ключей',
+    'denied': 'отказ в доступе',
+    'expire': 'истек срок',
+    'rollback': 'откат сервера',
+    'assign': 'назначение владельца',
+    'repair': 'исправление сверкой',
+    'pin_failed': 'неверный PIN',
+}
+
+
+def describe(entry):
+    """Событие одной строкой без времени: название, клиент, пользователь и подробности"""
+    parts = [EVENTS.get(entry['event'], entry['event'])]
+    if 'client' in entry:
+        parts.append(entry['client'])
+    if 'user' in entry:
+        parts.append(f"(пользователь {entry['user']})")
+    details = {key: value for key, value in entry.items() if key not in ('at', 'event', 'client', 'user')}
+    if details:
+        parts.append(', '.join(f"{key}={value}" for key, value in details.items()))
+    return ' '.join(parts)
+
+
+class AuditLog:
+    def __init__(self, db_path, directory, segment_bytes=SEGMENT_BYTES, flush_interval=FLUSH_INTERVAL):
+        self.db = storage.open_db(db_path)
+        self.db.executescript(SCHEMA)
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        # Запись сегментов и индекса выполняется по одному (поток записи, запросы, остановка)
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._segment, self._size = self._recover()
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        """Останавливает поток записи, дописав буфер"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def record(self, event, user_id=None, client=None, **details):
+        """Кладет событие в буфер; запись в файл выполняет фоновый поток"""
+        entry = {'at': round(time.time(), 3), 'event': event}
+        if user_id is not None:
+            entry['user'] = user_id
+        if client is not None:
+            entry['client'] = client
+        entry.update(details)
+        with self._buffer_lock:
+            self._buffer.append(entry)
+            if len(self._buffer) >= FLUSH_RECORDS:
+                self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи журнала аудита: {e}")
+
+    # --- сегменты ---
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"audit-{segment:06d}.log")
+
+    def flush(self):
+        """Дописывает буфер в сегменты; недописанные события возвращаются в буфер"""
+        with self._write_lock:
+            with self._buffer_lock:
+                entries, self._buffer = self._buffer, []
+            if not entries:
+                return
+            lines = [(entry, (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode())
+                     for entry in entries]
+            written = 0
+            try:
+                chunk, size = [], self._size
+                for line in lines:
+                    if size and size + len(line[1]) > self.segment_bytes:
+                        if chunk:
+                            self._append(chunk)
+                            written += len(chunk)
+                            chunk = []
+                        self._segment, self._size, size = self._segment + 1, 0, 0
+                    chunk.append(line)
+                    size += len(line[1])
+                self._append(chunk)
+            except Exception:
+                with self._buffer_lock:
+                    self._buffer[:0] = entries[written:]
+                    if len(self._buffer) > MAX_BUFFER:
+                        logger.error(f"Журнал аудита: отброшено событий {len(self._buffer) - MAX_BUFFER}")
+                        del self._buffer[:len(self._buffer) - MAX_BUFFER]
+                raise
+
+    def _append(self, lines):
+        """Дописывает строки [(событие, байты)] в текущий сегмент и индексирует их"""
+        path = self._segment_path(self._segment)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            with os.fdopen(fd, 'ab') as f:
+                f.write(b''.join(data for _, data in lines))
+                f.flush()
+                os.fsync(f.fileno())
+            self._size = self._index(self._segment, self._size, lines)
+        except Exception:
+            # Недописанные или непроиндексированные строки не должны остаться в сегменте
+            if os.path.exists(path):
+                os.truncate(path, self._size)
+            raise
+
+    def _index(self, segment, offset, lines):
+        """Добавляет строки сегмента, начинающиеся со смещения offset, в индекс; возвращает новый размер"""
+        users = {}
+        for entry, data in lines:
+            user = entry.get('user')
+            if user is not None:
+                if user in users:
+                    first_at, last_at, first_offset = users[user]
+                    users[user] = (min(first_at, entry['at']), max(last_at, entry['at']), first_offset)
+                else:
+                    users[user] = (entry['at'], entry['at'], offset)
+            offset += len(data)
+        times = [entry['at'] for entry, _ in lines]
+        with storage.transaction(self.db):
+            self.db.execute(
+                "INSERT INTO audit_segments (segment, size, first_at, last_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(segment) DO UPDATE SET size = excluded.size,"
+                " first_at = min(first_at, excluded.first_at), last_at = max(last_at, excluded.last_at)",
+                (segment, offset, min(times), max(times)),
+            )
+            self.db.executemany(
+                "INSERT INTO audit_users (user_id, segment, first_at, last_at, first_offset) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(user_id, segment) DO UPDATE SET"
+                " first_at = min(first_at, excluded.first_at), last_at = max(last_at, excluded.last_at)",
+                [(user, segment, *values) for user, values in users.items()],
+            )
+        return offset
+
+    def _recover(self):
+        """Дописывает в индекс события, записанные до падения процесса; возвращает (сегмент, размер)"""
+        indexed = {row['segment']: row['size'] for row in self.db.execute("SELECT segment, size FROM audit_segments")}
+        segments = sorted(int(match.group(1)) for match in map(_SEGMENT_RE.match, os.listdir(self.directory)) if match)
+        size = 0
+        for segment in segments:
+            path = self._segment_path(segment)
+            start = indexed.get(segment, 0)
+            size = os.path.getsize(path)
+            if size <= start:
+                continue
+            with open(path, 'rb') as f:
+                f.seek(start)
+                data = f.read()
+            complete = data[:data.rfind(b'\n') + 1]
+            if len(complete) < len(data):
+                # Строка, недописанная при падении
+                os.truncate(path, start + len(complete))
+                size = start + len(complete)
+            lines = []
+            for raw in complete.splitlines(keepends=True):
+                try:
+                    lines.append((json.loads(raw), raw))
+                except ValueError:
+                    logger.warning(f"Журнал аудита: пропущена поврежденная строка в {path}")
+                    lines.append(({'at': 0, 'event': 'corrupted'}, raw))
+            if lines:
+                self._index(segment, start, lines)
+                logger.info(f"Журнал аудита: проиндексировано событий после перезапуска: {len(lines)}")
+        return (segments[-1] if segments else 1), size
+
+    # --- запросы ---
+
+    def query(self, user_id=None, since=0, limit=20):
+        """Последние события (новые первыми), при user_id — только этого пользователя, не старше since"""
+        self.flush()
+        with self._write_lock:
+            if user_id is None:
+                rows = self.db.execute(
+                    "SELECT segment, 0 AS first_offset, size FROM audit_segments"
+                    " WHERE last_at >= ? ORDER BY segment DESC", (since,)
+                ).fetchall()
+            else:
+                rows = self.db.execute(
+                    "SELECT u.segment, u.first_offset, s.size FROM audit_users u JOIN audit_segments s USING (segment)"
+                    " WHERE u.user_id = ? AND u.last_at >= ? ORDER BY u.segment DESC", (user_id, since)
+                ).fetchall()
+        events = []
+        for row in rows:
+            try:
+                with open(self._segment_path(row['segment']), 'rb') as f:
+                    # Читается только проиндексированная часть: хвост может дописываться прямо сейчас
+                    f.seek(row['first_offset'])
+                    data = f.read(row['size'] - row['first_offset'])
+            except FileNotFoundError:
+                # Старые сегменты можно переносить в архив
+                continue
+            matched = []
+            for raw in data.splitlines():
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    continue
+                if entry['at'] >= since and (user_id is None or entry.get('user') == user_id):
+                    matched.append(entry)
+            # Новые первыми; события с одинаковым временем — в обратном порядке записи
+            matched.reverse()
+            matched.sort(key=lambda entry: entry['at'], reverse=True)
+            events.extend(matched)
+            if len(events) >= limit:
+                break
+        return events[:limit]
@@ -0,0 +1,358 @@
+"""Бенчмарк полного пути создания клиента.
+
+Прогоняет WireGuardManagerLocal и WireGuardManager (через локальный
+SSH/SFTP сервер на paramiko) во временных WG_CLIENTS_DIR/WG_CONFIG_PATH
+с заглушками wg/wg-quick, для разного числа уже существующих пиров.
+Путь queue — тот, которым создает клиентов бот: DeployQueue.submit (ответ
+пользователю) и развертывание фоновым обработчиком со снимком перед пачкой,
+до wait_idle. Путь direct — прежний create_and_deploy_config.
+Печатает тайминги по стадиям, пишет JSON с результатами и завершается
+с кодом 1, если медиана какой-либо стадии выросла сильнее порога
+относительно базового прогона.
+
+Примеры:
+    python benchmarks/bench_create.py --output bench.json
+    python benchmarks/bench_create.py --modes local --peers 10 100 \\
+        --baseline bench.json --max-regression 0.2 --stage-threshold total=0.1
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FAKE_BIN = os.path.join(BENCH_DIR, 'fake_bin')
+sys.path.insert(0, REPO_DIR)
+
+# Стадии, которые замеряются обёртками вокруг методов менеджера
+STAGES = (
+    'check_client_name_exists',
+    'generate_key_pair',
+    'get_next_client_ip',
+    'create_client_config',
+    'add_client_to_server',
+)
+# То же для пути через очередь развертывания
+QUEUE_STAGES = (
+    'generate_key_pair',
+    'get_next_client_ip',
+    'create_client_config',
+    'write_client_config',
+    'append_peers',
+    'sync_interface',
+)
+
+API_TOKEN_TEMPLATE = """token = 000000:BENCHMARK
+ACCESS_PIN = 123456
+WG_SERVER_IP = 203.0.113.1
+WG_SERVER_PORT = 51820
+SERVER_PUB_KEY = {pub}
+SERVER_PRIV_KEY = {priv}
+SSH_HOST = 127.0.0.1
+SSH_PORT = 22
+SSH_USERNAME = bench
+SSH_PASSWORD = bench
+WG_INTERFACE = wg0
+"""
+
+
+def random_key():
+    return base64.b64encode(os.urandom(32)).decode()
+
+
+def seed_workspace(root, peers, iterations):
+    """Создает серверный конфиг и peers клиентских файлов.
+
+    Пул адресов 10.66.66.0/24 вмещает только 253 клиента, поэтому при
+    большом числе пиров октеты повторяются: измеряется стоимость
+    сканирования файлов, а под новые клиенты остается iterations адресов.
+    """
+    clients_dir = os.path.join(root, 'clients')
+    os.makedirs(clients_dir)
+    server_config = os.path.join(root, 'wg0.conf')
+    pool = max(1, 254 - 2 - iterations)
+    blocks = [f"[Interface]\nAddress = 10.66.66.1/24\nListenPort = 51820\nPrivateKey = {random_key()}\n"]
+    for i in range(peers):
+        octet = 2 + i % pool
+        name = f"seed-{i:05d}"
+        with open(os.path.join(clients_dir, f"{name}.conf"), 'w') as f:
+            f.write(
+                f"[Interface]\nPrivateKey = {random_key()}\n"
+                f"Address = 10.66.66.{octet}/32,fd42:42:42:1::{octet}/64\nDNS = 1.1.1.1\n\n"
+                f"[Peer]\nPublicKey = {random_key()}\nEndpoint = 203.0.113.1:51820\nAllowedIPs = 0.0.0.0/0\n"
+            )
+        blocks.append(f"\n# Client: {name}\n[Peer]\nPublicKey = {random_key()}\nAllowedIPs = 10.66.66.{octet}/32\n")
+    with open(server_config, 'w') as f:
+        f.write(''.join(blocks))
+    return clients_dir, server_config
+
+
+def make_settings(clients_dir, server_config, ssh_port=None):
+    """Параметры бота, направленные во временное окружение"""
+    import dataclasses
+    import config
+
+    overrides = {'wg_clients_dir': clients_dir, 'wg_config_path': server_config}
+    if ssh_port is not None:
+        overrides.update(ssh_host='127.0.0.1', ssh_port=ssh_port, ssh_username='bench',
+                         ssh_password='bench', ssh_key_path=None)
+    return dataclasses.replace(config.get_settings(), **overrides)
+
+
+def instrument(manager, timings, stages=STAGES):
+    """Оборачивает методы менеджера, записывая длительность каждого вызова"""
+    for stage in stages:
+        original = getattr(manager, stage)
+
+        def timed(*args, _original=original, _stage=stage, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _original(*args, **kwargs)
+            finally:
+                timings[_stage].append(time.perf_counter() - start)
+
+        setattr(manager, stage, timed)
+
+
+def summarize(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        'count': len(samples),
+        'median_ms': statistics.median(samples) * 1000,
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p95_ms': p95 * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def run_scenario(mode, peers, iterations, ssh_server=None, path='direct'):
+    import wireguard_manager
+
+    root = tempfile.mkdtemp(prefix=f'wg-bench-{mode}-{peers}-')
+    try:
+        clients_dir, server_config = seed_workspace(root, peers, iterations)
+        os.environ['FAKE_WG_CONFIG'] = server_config
+        if ssh_server is not None:
+            ssh_server.env['FAKE_WG_CONFIG'] = server_config
+        settings = make_settings(clients_dir, server_config,
+                                 ssh_port=ssh_server.port if ssh_server is not None else None)
+        if mode == 'local':
+            manager = wireguard_manager.WireGuardManagerLocal(settings)
+        else:
+            manager = wireguard_manager.WireGuardManager(settings)
+
+        if path == 'queue':
+            timings, wall = run_queue(manager, root, iterations)
+        else:
+            timings = {stage: [] for stage in STAGES}
+            timings['total'] = []
+            instrument(manager, timings)
+
+            wall_start = time.perf_counter()
+            for i in range(iterations):
+                name = f"bench-{i:05d}"
+                start = time.perf_counter()
+                manager.check_client_name_exists(name)
+                config, error = manager.create_and_deploy_config(name)
+                timings['total'].append(time.perf_counter() - start)
+                if error:
+                    raise RuntimeError(f"{mode}/{peers}: {error}")
+            wall = time.perf_counter() - wall_start
+
+        return {
+            'mode': mode,
+            'peers': peers,
+            'path': path,
+            'iterations': iterations,
+            'throughput_per_s': iterations / wall if wall else None,
+            'stages': {stage: summarize(samples) for stage, samples in timings.items() if samples},
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def run_queue(manager, root, iterations):
+    """Создание через DeployQueue, как в боте: submit, затем развертывание фоновым обработчиком"""
+    from deploy_queue import DeployQueue
+    from snapshots import SnapshotStore
+
+    timings = {stage: [] for stage in QUEUE_STAGES + ('submit', 'snapshot', 'total')}
+    instrument(manager, timings, QUEUE_STAGES)
+    db_path = os.path.join(root, 'state.db')
+    snapshots = SnapshotStore(manager, db_path, os.path.join(root, 'snapshots'))
+    take = snapshots.take
+
+    def timed_take(reason):
+        start = time.perf_counter()
+        try:
+            return take(reason)
+        finally:
+            timings['snapshot'].append(time.perf_counter() - start)
+
+    snapshots.take = timed_take
+    queue = DeployQueue(manager, db_path, snapshots=snapshots).start()
+    try:
+        # Первый снимок читает все файлы клиентов: это стоимость запуска, а не создания
+        take('прогрев')
+        wall_start = time.perf_counter()
+        for i in range(iterations):
+            name = f"bench-{i:05d}"
+            start = time.perf_counter()
+            config, error = queue.submit(name, user_id=1)
+            timings['submit'].append(time.perf_counter() - start)
+            if error:
+                raise RuntimeError(error)
+            if not queue.wait_idle(timeout=60, interval=0.001) or queue.failed_jobs():
+                raise RuntimeError(f"Клиент {name} не развернут")
+            timings['total'].append(time.perf_counter() - start)
+        wall = time.perf_counter() - wall_start
+    finally:
+        queue.stop()
+    return timings, wall
+
+
+def scenario_key(result):
+    # Ключ пути direct прежний, чтобы старые базовые прогоны оставались сравнимыми
+    suffix = '' if result.get('path', 'direct') == 'direct' else f"/{result['path']}"
+    return f"{result['mode']}/{result['peers']}{suffix}"
+
+
+def compare(results, baseline, max_regression, stage_thresholds, min_delta_ms):
+    """Возвращает список регрессий относительно базового прогона"""
+    base = {scenario_key(r): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        previous = base.get(scenario_key(result))
+        if not previous:
+            continue
+        for stage, stats in result['stages'].items():
+            old = (previous['stages'].get(stage) or {}).get('median_ms')
+            if not old:
+                continue
+            new = stats['median_ms']
+            limit = stage_thresholds.get(stage, max_regression)
+            if new - old > min_delta_ms and new > old * (1 + limit):
+                regressions.append({
+                    'scenario': scenario_key(result),
+                    'stage': stage,
+                    'baseline_ms': old,
+                    'current_ms': new,
+                    'ratio': new / old,
+                    'threshold': limit,
+                })
+    return regressions
+
+
+def parse_stage_thresholds(values):
+    thresholds = {}
+    for value in values or []:
+        stage, _, limit = value.partition('=')
+        if not limit:
+            raise argparse.ArgumentTypeError(f"Ожидается stage=ratio, получено: {value}")
+        thresholds[stage] = float(limit)
+    return thresholds
+
+
+def print_table(results):
+    for result in results:
+        print(f"\n== {scenario_key(result)}: {result['iterations']} создано, "
+              f"{result['throughput_per_s']:.2f} клиентов/с")
+        for stage, stats in result['stages'].items():
+            print(f"  {stage:<26} median {stats['median_ms']:9.2f} ms  "
+                  f"p95 {stats['p95_ms']:9.2f} ms  n={stats['count']}")
+
+
+def prepare_environment(workdir):
+    """Готовит api_token.txt, загружает config и PATH с заглушками"""
+    import config
+
+    config_file = os.path.join(workdir, 'api_token.txt')
+    with open(config_file, 'w') as f:
+        f.write(API_TOKEN_TEMPLATE.format(pub=random_key(), priv=random_key()))
+    config.load_settings(config_file)
+    os.chdir(workdir)
+    os.environ['PATH'] = FAKE_BIN + os.pathsep + os.environ.get('PATH', '')
+    os.environ['FAKE_WG_LOG'] = os.path.join(workdir, 'wg-calls.log')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', choices=('local', 'ssh'), default=['local', 'ssh'])
+    parser.add_argument('--peers', nargs='+', type=int, default=[10, 100, 250, 10000],
+                        help='Число уже существующих пиров в каждом сценарии')
+    parser.add_argument('--iterations', type=int, default=20, help='Сколько клиентов создавать в сценарии')
+    parser.add_argument('--paths', nargs='+', choices=('queue', 'direct'), default=['queue', 'direct'],
+                        help='queue — через DeployQueue, как в боте; direct — create_and_deploy_config')
+    parser.add_argument('--output', help='Куда записать результаты в JSON')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='Допустимый относительный рост медианы стадии (0.25 = +25%%)')
+    parser.add_argument('--stage-threshold', action='append', metavar='STAGE=RATIO',
+                        help='Отдельный порог для стадии, можно указывать несколько раз')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='Рост медианы меньше этого значения не считается регрессией')
+    args = parser.parse_args(argv)
+    stage_thresholds = parse_stage_thresholds(args.stage_threshold)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.baseline:
+        args.baseline = os.path.abspath(args.baseline)
+
+    workdir = tempfile.mkdtemp(prefix='wg-bench-')
+    cwd = os.getcwd()
+    ssh_server = None
+    try:
+        prepare_environment(workdir)
+        if 'ssh' in args.modes:
+            from ssh_server import LocalSSHServer
+            ssh_server = LocalSSHServer(env=dict(os.environ)).start()
+
+        results = []
+        for mode in args.modes:
+            for peers in args.peers:
+                for path in args.paths:
+                    results.append(run_scenario(mode, peers, args.iterations,
+                                                ssh_server if mode == 'ssh' else None, path))
+    finally:
+        if ssh_server is not None:
+            ssh_server.stop()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression,
+                                  stage_thresholds, args.min_delta_ms)
+        report['regressions'] = regressions
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    for r in regressions:
+        print(f"РЕГРЕССИЯ {r['scenario']} {r['stage']}: {r['baseline_ms']:.2f} -> "
+              f"{r['current_ms']:.2f} ms (x{r['ratio']:.2f}, порог +{r['threshold']:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
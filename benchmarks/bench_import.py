@@ -0,0 +1,109 @@
+"""Профиль времени импорта модулей бота (python -X importtime).
+
+Импортирует каждый модуль в отдельном чистом интерпретаторе из пустой
+директории (без api_token.txt) и проверяет, что:
+  * импорт не читает файл конфигурации;
+  * в локальном режиме не загружаются paramiko и cryptography;
+  * суммарное время импорта укладывается в лимит.
+Завершается с кодом 1, если какая-либо проверка не прошла.
+
+Пример:
+    python benchmarks/bench_import.py --max-ms wireguard_manager=30 --output import.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модуль -> лимит по умолчанию на суммарное время импорта (мс)
+TARGETS = {
+    'config': 20.0,
+    'wireguard_manager': 40.0,
+    'bot': 1500.0,
+}
+
+# Тяжелые транспортные зависимости, которые не должны грузиться при импорте.
+# python-telegram-bot сам подгружает cryptography (Telegram Passport),
+# поэтому для bot проверяется только paramiko.
+FORBIDDEN = {
+    'config': ('paramiko', 'cryptography'),
+    'wireguard_manager': ('paramiko', 'cryptography'),
+    'bot': ('paramiko',),
+}
+
+
+def profile_import(module, runs):
+    """Возвращает (лучшее время в мс, список загруженных модулей верхнего уровня)"""
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, PYTHONDONTWRITEBYTECODE='1')
+    env.pop('WG_BOT_CONFIG', None)
+    best = None
+    loaded = set()
+    with tempfile.TemporaryDirectory() as empty_dir:
+        for _ in range(runs):
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                cwd=empty_dir, env=env, capture_output=True, text=True,
+            )
+            if result.returncode != 0:
+                raise RuntimeError(f"import {module} завершился с ошибкой:\n{result.stderr}")
+            cumulative = None
+            for line in result.stderr.splitlines():
+                if not line.startswith('import time:') or '|' not in line:
+                    continue
+                _, cumul, name = (part.strip() for part in line[len('import time:'):].split('|'))
+                if not cumul.isdigit():
+                    continue
+                loaded.add(name.split('.')[0])
+                if name == module:
+                    cumulative = int(cumul) / 1000
+            if cumulative is not None and (best is None or cumulative < best):
+                best = cumulative
+    return best, loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', default=list(TARGETS))
+    parser.add_argument('--runs', type=int, default=5, help='Берется лучшее из N запусков')
+    parser.add_argument('--max-ms', action='append', metavar='MODULE=MS',
+                        help='Лимит времени импорта модуля, можно указывать несколько раз')
+    parser.add_argument('--output', help='Куда записать результаты в JSON')
+    args = parser.parse_args(argv)
+
+    limits = dict(TARGETS)
+    for value in args.max_ms or []:
+        module, _, limit = value.partition('=')
+        limits[module] = float(limit)
+
+    failures = []
+    results = []
+    for module in args.modules:
+        try:
+            elapsed, loaded = profile_import(module, args.runs)
+        except RuntimeError as e:
+            failures.append(str(e))
+            continue
+        forbidden = sorted(name for name in FORBIDDEN.get(module, ('paramiko', 'cryptography')) if name in loaded)
+        limit = limits.get(module)
+        results.append({'module': module, 'import_ms': elapsed, 'limit_ms': limit, 'forbidden_loaded': forbidden})
+        print(f"{module:<20} {elapsed:8.2f} ms (лимит {limit} ms)")
+        if forbidden:
+            failures.append(f"{module}: при импорте загружены {', '.join(forbidden)}")
+        if limit is not None and elapsed is not None and elapsed > limit:
+            failures.append(f"{module}: импорт {elapsed:.2f} ms превышает лимит {limit} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results, 'failures': failures}, f, indent=2, ensure_ascii=False)
+
+    for failure in failures:
+        print(f"ОШИБКА {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
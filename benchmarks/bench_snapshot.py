@@ -0,0 +1,168 @@
+"""Бенчмарк снимков состояния WireGuard (snapshots.SnapshotStore).
+
+Во временных WG_CLIENTS_DIR/WG_CONFIG_PATH с заданным числом клиентов
+замеряет первый снимок (читаются все файлы), снимок без изменений и снимок
+после пачки новых клиентов (как перед очередным развертыванием), затем
+откатывается к первому снимку и проверяет, что файлы и конфиг сервера
+совпали с исходными. Выводит размер хранилища объектов.
+
+Код возврата 1, если откат восстановил не то состояние или p95 снимка после
+пачки больше --max-ms (--max-ms-ssh для SSH режима).
+
+Пример:
+    python benchmarks/bench_snapshot.py --modes local ssh --peers 10000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from bench_create import make_settings, prepare_environment, random_key, seed_workspace, summarize  # noqa: E402
+
+
+def read_state(clients_dir, server_config):
+    files = {}
+    for name in os.listdir(clients_dir):
+        if name.endswith('.conf'):
+            with open(os.path.join(clients_dir, name)) as f:
+                files[name] = f.read()
+    with open(server_config) as f:
+        return f.read(), files
+
+
+def add_batch(clients_dir, server_config, prefix, size):
+    """Пачка новых клиентов: файлы и пиры, как после развертывания"""
+    blocks = []
+    for i in range(size):
+        name = f"{prefix}-{i:03d}"
+        with open(os.path.join(clients_dir, f"{name}.conf"), 'w') as f:
+            f.write(f"[Interface]\nPrivateKey = {random_key()}\nAddress = 10.66.66.250/32\n")
+        blocks.append(f"\n# Client: {name}\n[Peer]\nPublicKey = {random_key()}\nAllowedIPs = 10.66.66.250/32\n")
+    with open(server_config, 'a') as f:
+        f.write(''.join(blocks))
+
+
+def directory_size(path):
+    total = count = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            total += os.path.getsize(os.path.join(root, name))
+            count += 1
+    return total, count
+
+
+def run_scenario(mode, peers, batches, batch_size, ssh_server=None):
+    import wireguard_manager
+    from snapshots import SnapshotStore
+
+    root = tempfile.mkdtemp(prefix=f'wg-snap-{mode}-{peers}-')
+    try:
+        clients_dir, server_config = seed_workspace(root, peers, 0)
+        # Файлы «старше» окна недавних изменений, как на давно работающем сервере
+        old = time.time() - 3600
+        for name in os.listdir(clients_dir):
+            os.utime(os.path.join(clients_dir, name), (old, old))
+        settings = make_settings(clients_dir, server_config,
+                                 ssh_port=ssh_server.port if ssh_server is not None else None)
+        if mode == 'local':
+            manager = wireguard_manager.WireGuardManagerLocal(settings)
+        else:
+            manager = wireguard_manager.WireGuardManager(settings)
+        store = SnapshotStore(manager, os.path.join(root, 'state.db'), os.path.join(root, 'snapshots'))
+        original = read_state(clients_dir, server_config)
+
+        start = time.perf_counter()
+        first_id = store.take('первый')
+        cold = time.perf_counter() - start
+
+        idle = []
+        for _ in range(5):
+            start = time.perf_counter()
+            store.take('без изменений')
+            idle.append(time.perf_counter() - start)
+
+        batch = []
+        for i in range(batches):
+            add_batch(clients_dir, server_config, f"batch{i}", batch_size)
+            start = time.perf_counter()
+            store.take('пачка')
+            batch.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        store.restore(first_id)
+        restore_time = time.perf_counter() - start
+        restored = read_state(clients_dir, server_config) == original
+        size, objects = directory_size(os.path.join(root, 'snapshots'))
+        return {
+            'mode': mode,
+            'peers': peers,
+            'cold_ms': cold * 1000,
+            'idle': summarize(idle),
+            'batch': summarize(batch),
+            'restore_ms': restore_time * 1000,
+            'restored': restored,
+            'snapshots': len(store.history(limit=1000)),
+            'objects': objects,
+            'store_mb': size / 2**20,
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', choices=('local', 'ssh'), default=['local'])
+    parser.add_argument('--peers', nargs='+', type=int, default=[10000])
+    parser.add_argument('--batches', type=int, default=20, help='Сколько пачек клиентов добавить')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--max-ms', type=float, default=250.0, help='Допустимый p95 снимка после пачки, мс')
+    parser.add_argument('--max-ms-ssh', type=float, default=3000.0,
+                        help='То же для SSH режима (тестовый SFTP сервер на paramiko заметно медленнее OpenSSH)')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='wg-bench-')
+    cwd = os.getcwd()
+    ssh_server = None
+    results = []
+    try:
+        prepare_environment(workdir)
+        if 'ssh' in args.modes:
+            from ssh_server import LocalSSHServer
+            ssh_server = LocalSSHServer(env=dict(os.environ)).start()
+        for mode in args.modes:
+            for peers in args.peers:
+                results.append(run_scenario(mode, peers, args.batches, args.batch_size,
+                                            ssh_server if mode == 'ssh' else None))
+    finally:
+        if ssh_server is not None:
+            ssh_server.stop()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    failures = []
+    for r in results:
+        print(f"\n== {r['mode']}/{r['peers']}: снимков {r['snapshots']}, объектов {r['objects']}, "
+              f"хранилище {r['store_mb']:.1f} МБ")
+        print(f"  первый снимок        {r['cold_ms']:9.1f} ms")
+        print(f"  без изменений        median {r['idle']['median_ms']:9.1f} ms  p95 {r['idle']['p95_ms']:9.1f} ms")
+        print(f"  после пачки          median {r['batch']['median_ms']:9.1f} ms  p95 {r['batch']['p95_ms']:9.1f} ms")
+        print(f"  откат к первому      {r['restore_ms']:9.1f} ms, состояние {'совпало' if r['restored'] else 'НЕ совпало'}")
+        if not r['restored']:
+            failures.append(f"{r['mode']}/{r['peers']}: откат восстановил не то состояние")
+        if r['batch']['p95_ms'] > (args.max_ms_ssh if r['mode'] == 'ssh' else args.max_ms):
+            failures.append(f"{r['mode']}/{r['peers']}: снимок после пачки {r['batch']['p95_ms']:.0f} мс")
+    if failures:
+        print("❌ " + "; ".join(failures))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
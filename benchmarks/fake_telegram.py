@@ -0,0 +1,251 @@
+"""Заглушка Telegram Bot API для сценариев с запущенным ботом.
+
+Сервер принимает запросы PTB по адресу BOT_API_URL (/bot<token>/<method>),
+отдает getUpdates из очереди, которую наполняет сценарий, и запоминает все
+исходящие вызовы бота (sendMessage, sendDocument, editMessageText, ...).
+Хранит только то, что нужно боту: ответы похожи на настоящие настолько,
+чтобы PTB смог их разобрать.
+"""
+import email.parser
+import itertools
+from collections import defaultdict, deque
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+BOT_USER = {
+    'id': 1000000, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_wg_bot',
+    'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False,
+}
+
+
+def user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"}
+
+
+class FakeTelegramServer:
+    def __init__(self, host='127.0.0.1', port=0, max_poll_timeout=1.0, record_calls=True):
+        self.max_poll_timeout = max_poll_timeout
+        # В долгих прогонах общий журнал не ведется, вызовы идут только в ящики чатов
+        self.record_calls = record_calls
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._updates = []
+        self._confirmed = 0
+        # Все вызовы бота: {'method', 'params', 'time', 'result'}
+        self.calls = []
+        # Непрочитанные вызовы по чатам для next_call()
+        self._mailboxes = defaultdict(deque)
+        self.call_count = 0
+        # Задержка ответа по методам: {'method': секунд}
+        self.latency = {}
+        # Принудительные 429: {'method': (retry_after, сколько раз)}
+        self._flood = {}
+        self._condition = threading.Condition()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        # Обрывы соединений убитыми процессами бота — ожидаемая часть сценариев
+        self._server.handle_error = lambda request, client_address: None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-telegram', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # --- сторона сценария ---
+
+    def push_update(self, update):
+        with self._condition:
+            update = dict(update, update_id=next(self._update_ids))
+            self._updates.append(update)
+            self._condition.notify_all()
+        return update['update_id']
+
+    def send_text(self, user_id, text, reply_to=None):
+        """Сообщение пользователя боту (reply_to — сообщение бота из calls)"""
+        message = {
+            'message_id': next(self._message_ids), 'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'}, 'from': user(user_id), 'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        if reply_to is not None:
+            message['reply_to_message'] = reply_to
+        return self.push_update({'message': message})
+
+    def press_button(self, user_id, data, message):
+        return self.push_update({'callback_query': {
+            'id': str(next(self._message_ids)), 'from': user(user_id), 'chat_instance': str(user_id),
+            'data': data, 'message': message,
+        }})
+
+    def flood(self, method, retry_after, count=1):
+        """Следующие count вызовов method получат 429 Too Many Requests"""
+        with self._condition:
+            self._flood[method] = (retry_after, count)
+
+    def pending_updates(self):
+        with self._condition:
+            return sum(1 for u in self._updates if u['update_id'] > self._confirmed)
+
+    def wait_for(self, predicate, timeout=10.0, start=0):
+        """Ждет вызов бота, для которого predicate(call) истинно; возвращает его или None"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            index = start
+            while True:
+                while index < len(self.calls):
+                    if predicate(self.calls[index]):
+                        return self.calls[index]
+                    index += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def next_call(self, chat_id, predicate, timeout=10.0):
+        """Следующий вызов бота в чате chat_id, для которого predicate(call) истинно.
+
+        Предшествующие ему вызовы в этом чате отбрасываются; None по таймауту.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            mailbox = self._mailboxes[chat_id]
+            while True:
+                while mailbox:
+                    call = mailbox.popleft()
+                    if predicate(call):
+                        return call
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def forget_chat(self, chat_id):
+        with self._condition:
+            self._mailboxes.pop(chat_id, None)
+
+    # --- сторона бота ---
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset', 0) or 0)
+        timeout = min(float(params.get('timeout', 0) or 0), self.max_poll_timeout)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            # offset подтверждает все предыдущие обновления
+            if offset:
+                self._confirmed = max(self._confirmed, offset - 1)
+                self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            limit = int(params.get('limit', 100) or 100)
+            return self._updates[:limit]
+
+    def _message(self, params, **fields):
+        return dict({
+            'message_id': next(self._message_ids), 'date': int(time.time()),
+            'chat': {'id': int(params['chat_id']), 'type': 'private'}, 'from': BOT_USER,
+        }, **fields)
+
+    def _call(self, method, params, files):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method in ('deleteWebhook', 'setMyCommands', 'answerCallbackQuery', 'deleteMessage', 'close', 'logOut'):
+            return True
+        if method == 'sendMessage':
+            return self._message(params, text=params.get('text', ''))
+        if method == 'sendDocument':
+            name, content = files.get('document', ('document', b''))
+            return self._message(params, caption=params.get('caption', ''), document={
+                'file_id': f"file{len(self.calls)}", 'file_unique_id': f"u{len(self.calls)}",
+                'file_name': name, 'file_size': len(content),
+            })
+        if method == 'editMessageText':
+            return dict(self._message(params, text=params.get('text', '')), message_id=int(params['message_id']))
+        return True
+
+    def _handle(self, method, params, files):
+        delay = self.latency.get(method)
+        if delay:
+            time.sleep(delay)
+        with self._condition:
+            retry_after, count = self._flood.get(method, (0, 0))
+            if count:
+                self._flood[method] = (retry_after, count - 1)
+        if count:
+            return 429, {'ok': False, 'error_code': 429, 'description': f"Too Many Requests: retry after {retry_after}",
+                         'parameters': {'retry_after': retry_after}}
+        result = self._call(method, params, files)
+        if method != 'getUpdates':
+            call = {'method': method, 'params': params, 'files': files, 'time': time.monotonic(), 'result': result}
+            with self._condition:
+                self.call_count += 1
+                if self.record_calls:
+                    self.calls.append(call)
+                if 'chat_id' in params:
+                    self._mailboxes[int(params['chat_id'])].append(call)
+                self._condition.notify_all()
+        return 200, {'ok': True, 'result': result}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.rstrip('/').rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                params, files = parse_body(self.headers.get('Content-Type', ''), body)
+                status, payload = fake._handle(method, params, files)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def parse_body(content_type, body):
+    """Параметры запроса PTB: form-urlencoded или multipart (с файлами)"""
+    params, files = {}, {}
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            filename = part.get_filename()
+            payload = part.get_payload(decode=True)
+            if filename:
+                files[name] = (filename, payload)
+            else:
+                params[name] = payload.decode()
+    elif body:
+        params = dict(parse_qsl(body.decode()))
+    for key, value in params.items():
+        if isinstance(value, str) and value[:1] in '[{':
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                pass
+    return params, files
@@ -0,0 +1,190 @@
+"""Сценарий active/standby: два процесса бота, общая база и заглушка Bot API.
+
+Запускает два экземпляра bot.py с LEADER_LEASE_TTL и общим STATE_DB_PATH,
+проводит пользователя через кнопку и PIN на лидере, убивает лидера (SIGKILL)
+и заканчивает диалог вводом имени на резервном экземпляре. Проверяет, что
+резервный экземпляр подхватил опрос за время аренды, диалог не потерялся, а
+адреса клиентов, созданных до и после переключения, не пересекаются.
+
+Код возврата 1, если переключение не удалось или заняло больше --max-takeover.
+
+Пример:
+    python benchmarks/ha_failover.py --lease-ttl 3
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from bench_create import API_TOKEN_TEMPLATE, FAKE_BIN, random_key  # noqa: E402
+from fake_telegram import FakeTelegramServer  # noqa: E402
+
+USER_ID = 424242
+
+
+class BotProcess:
+    """bot.py в отдельном процессе; строки вывода собираются для ожидания событий"""
+
+    def __init__(self, name, workdir, env):
+        self.name = name
+        self.lines = []
+        self._event = threading.Condition()
+        self.process = subprocess.Popen(
+            [sys.executable, '-u', os.path.join(REPO_DIR, 'bot.py')], cwd=workdir, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        )
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            with self._event:
+                self.lines.append(line.rstrip())
+                self._event.notify_all()
+
+    def wait_line(self, text, timeout):
+        deadline = time.monotonic() + timeout
+        with self._event:
+            while not any(text in line for line in self.lines):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.process.poll() is not None:
+                    return False
+                self._event.wait(min(remaining, 0.2))
+        return True
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGKILL)
+            self.process.wait()
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.kill()
+
+
+def prepare(workdir, api_url, lease_ttl):
+    clients_dir = os.path.join(workdir, 'clients')
+    os.makedirs(clients_dir)
+    with open(os.path.join(workdir, 'wg0.conf'), 'w') as f:
+        f.write("[Interface]\nAddress = 10.66.66.1/24\nListenPort = 51820\n")
+    with open(os.path.join(workdir, 'api_token.txt'), 'w') as f:
+        f.write(API_TOKEN_TEMPLATE.format(pub=random_key(), priv=random_key()))
+        f.write(f"WG_CONFIG_PATH = {workdir}/wg0.conf\nWG_CLIENTS_DIR = {clients_dir}\n"
+                f"STATE_DB_PATH = {workdir}/state.db\nLEADER_LEASE_TTL = {lease_ttl}\n"
+                f"BOT_API_URL = {api_url}\nRECONCILE_INTERVAL = 0\n")
+    env = dict(os.environ, WG_BOT_CONFIG=os.path.join(workdir, 'api_token.txt'),
+               PATH=FAKE_BIN + os.pathsep + os.environ.get('PATH', ''),
+               FAKE_WG_LOG=os.path.join(workdir, 'wg-calls.log'))
+    return env
+
+
+def create_config(telegram, name, start=0, timeout=15, before_name=None):
+    """Проходит диалог создания; before_name вызывается между PIN и вводом имени"""
+    telegram.send_text(USER_ID, '/start')
+    menu = telegram.wait_for(lambda c: c['method'] == 'sendMessage' and 'reply_markup' in c['params'],
+                             timeout, start)
+    assert menu, "бот не ответил на /start"
+    telegram.press_button(USER_ID, 'create_config', menu['result'])
+    prompt = telegram.wait_for(lambda c: 'Введите PIN-код' in c['params'].get('text', ''), timeout, start)
+    assert prompt, "нет запроса PIN"
+    telegram.send_text(USER_ID, '123456', reply_to=prompt['result'])
+    name_prompt = telegram.wait_for(lambda c: 'PIN-код верный' in c['params'].get('text', ''), timeout, start)
+    assert name_prompt, "нет запроса имени"
+    if before_name:
+        before_name()
+    sent_at = time.monotonic()
+    telegram.send_text(USER_ID, name, reply_to=name_prompt['result'])
+    document = telegram.wait_for(
+        lambda c: c['method'] == 'sendDocument' and c['files']['document'][0] == f"{name}.conf",
+        timeout + 30, start,
+    )
+    assert document, f"конфигурация {name} не выдана"
+    return document, time.monotonic() - sent_at
+
+
+def client_address(document):
+    for line in document['files']['document'][1].decode().splitlines():
+        if line.startswith('Address'):
+            return line.split('=', 1)[1].split(',')[0].strip()
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lease-ttl', type=int, default=3)
+    parser.add_argument('--max-takeover', type=float, default=None,
+                        help='Допустимое время переключения, сек (по умолчанию 2 * срок аренды)')
+    args = parser.parse_args(argv)
+    max_takeover = args.max_takeover or 2 * args.lease_ttl
+
+    workdir = tempfile.mkdtemp(prefix='wg-ha-')
+    telegram = FakeTelegramServer().start()
+    env = prepare(workdir, telegram.url, args.lease_ttl)
+    leader = BotProcess('A', workdir, env)
+    standby = None
+    try:
+        assert leader.wait_line('WireGuard Bot запущен', 30), "лидер не запустился:\n" + "\n".join(leader.lines)
+        standby = BotProcess('B', workdir, env)
+        assert standby.wait_line('Резервный экземпляр', 30), "резервный экземпляр не ждет аренду"
+
+        first, _ = create_config(telegram, 'before')
+        print(f"До переключения: before -> {client_address(first)}")
+
+        takeover = {}
+
+        def crash_leader():
+            # Даем persistence сохранить состояние диалога, затем роняем лидера
+            time.sleep(1.5)
+            takeover['killed'] = time.monotonic()
+            leader.kill()
+            assert standby.wait_line('WireGuard Bot запущен', max_takeover + 30), "резервный экземпляр не стал лидером"
+            takeover['started'] = time.monotonic()
+
+        second, reply_time = create_config(telegram, 'after', start=len(telegram.calls), before_name=crash_leader)
+        takeover_time = takeover['started'] - takeover['killed']
+        addresses = {client_address(first), client_address(second)}
+        print(f"После переключения: after -> {client_address(second)}")
+        print(f"Переключение: {takeover_time:.2f} с (аренда {args.lease_ttl} с), "
+              f"ответ на имя после падения лидера: {reply_time:.2f} с")
+
+        failures = []
+        if takeover_time > max_takeover:
+            failures.append(f"переключение дольше {max_takeover:.1f} с")
+        if len(addresses) != 2:
+            failures.append(f"адреса клиентов совпали: {addresses}")
+        with open(os.path.join(workdir, 'wg0.conf')) as f:
+            server_config = f.read()
+        for name in ('before', 'after'):
+            deadline = time.monotonic() + 10
+            while f"# Client: {name}" not in server_config and time.monotonic() < deadline:
+                time.sleep(0.2)
+                with open(os.path.join(workdir, 'wg0.conf')) as f:
+                    server_config = f.read()
+            if f"# Client: {name}" not in server_config:
+                failures.append(f"пир {name} не развернут")
+        if failures:
+            print("❌ " + "; ".join(failures))
+            return 1
+        print("✅ Резервный экземпляр продолжил диалог и развертывание")
+        return 0
+    finally:
+        leader.kill()
+        if standby:
+            standby.stop()
+        telegram.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
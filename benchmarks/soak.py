@@ -0,0 +1,480 @@
+"""Долгий прогон бота под нагрузкой с заглушкой Bot API и профилированием памяти.
+
+Бот (WireGuardBot с обработчиками из bot.build_application, очередью
+развертывания и планировщиком сроков) работает в этом процессе против
+заглушки Bot API (benchmarks/fake_telegram.py). Генератор обновлений в
+--workers потоках проигрывает сценарии тысяч синтетических пользователей:
+меню, справку, /my, неверный PIN, недопустимое и занятое имя и создание
+временной конфигурации (срок 1m, чтобы адреса пула освобождались).
+
+Во время прогона снимаются RSS, память tracemalloc и число открытых
+дескрипторов; после прогрева и в конце — снимки tracemalloc, по разнице
+которых выводятся места наибольшего роста. Для обработчиков и шагов сценариев
+выводятся перцентили задержек, для прогона — пропускная способность.
+
+Код возврата 1, если:
+  * память (tracemalloc или RSS) после прогрева растет быстрее --max-growth МБ/ч
+    и выросла больше чем на --min-growth МБ;
+  * растет число дескрипторов или остаются временные файлы;
+  * доля ошибок сценариев больше --max-error-rate;
+  * пропускная способность упала больше чем на --max-throughput-drop
+    относительно --baseline.
+
+Пример:
+    python benchmarks/soak.py --users 5000 --duration 1800 --output soak.json
+    python benchmarks/soak.py --duration 600 --baseline soak.json
+"""
+import argparse
+import asyncio
+import dataclasses
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from bench_create import API_TOKEN_TEMPLATE, FAKE_BIN, random_key  # noqa: E402
+from fake_telegram import FakeTelegramServer  # noqa: E402
+
+PIN = '123456'
+FIRST_USER_ID = 500000
+
+# Обработчики WireGuardBot, задержка которых замеряется
+HANDLERS = ('start', 'menu', 'help_command', 'button_handler', 'handle_message', 'my_command', 'get_command')
+
+# Сценарии и их доли в нагрузке
+SCENARIOS = {
+    'menu': 20,
+    'help': 10,
+    'my': 10,
+    'stray_text': 5,
+    'wrong_pin': 15,
+    'invalid_name': 15,
+    'duplicate_name': 10,
+    'create': 15,
+}
+
+# Одновременно живущих временных клиентов (пул 10.66.66.0/24 вмещает 253, 10 заняты постоянными)
+MAX_LIVE_CLIENTS = 200
+CLIENT_TTL = 60
+
+
+class ScenarioError(Exception):
+    pass
+
+
+class LoadGenerator:
+    def __init__(self, telegram, users, timeout):
+        self.telegram = telegram
+        self.timeout = timeout
+        self._free_users = queue.Queue()
+        for i in range(users):
+            self._free_users.put(FIRST_USER_ID + i)
+        self._lock = threading.Lock()
+        self._names = itertools.count(1)
+        # Время истечения созданных клиентов, для лимита пула адресов
+        self._live = deque()
+        # Постоянные клиенты, на которых проверяется отказ для занятого имени
+        self.existing_names = []
+        self.step_latency = defaultdict(list)
+        self.completed = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.error_samples = []
+
+    # --- шаги ---
+
+    def _expect(self, user_id, step, predicate):
+        call = self.telegram.next_call(user_id, predicate, self.timeout)
+        if call is None:
+            raise ScenarioError(f"{step}: нет ответа за {self.timeout} с")
+        return call
+
+    def _step(self, user_id, step, push, predicate):
+        started = time.monotonic()
+        push()
+        call = self._expect(user_id, step, predicate)
+        with self._lock:
+            self.step_latency[step].append(time.monotonic() - started)
+        return call['result']
+
+    def send(self, user_id, step, text, predicate, reply_to=None):
+        return self._step(user_id, step, lambda: self.telegram.send_text(user_id, text, reply_to=reply_to), predicate)
+
+    def press(self, user_id, step, data, message, predicate):
+        return self._step(user_id, step, lambda: self.telegram.press_button(user_id, data, message), predicate)
+
+    # --- сценарии ---
+
+    def open_menu(self, user_id):
+        return self.send(user_id, 'start', '/start', has_markup)
+
+    def ask_name(self, user_id):
+        menu = self.open_menu(user_id)
+        prompt = self.press(user_id, 'button', 'create_config', menu, text_contains('Введите PIN-код'))
+        return self.send(user_id, 'pin', PIN, text_contains('PIN-код верный'), reply_to=prompt)
+
+    def scenario_menu(self, user_id):
+        menu = self.send(user_id, 'menu', '/menu', has_markup)
+        self.press(user_id, 'menu_button', 'menu', menu, has_markup)
+
+    def scenario_help(self, user_id):
+        self.send(user_id, 'help', '/help', text_contains('Справка'))
+
+    def scenario_my(self, user_id):
+        self.send(user_id, 'my', '/my', text_contains('конфигурац'))
+
+    def scenario_stray_text(self, user_id):
+        self.send(user_id, 'stray_text', 'привет', lambda c: c['method'] == 'sendMessage')
+
+    def scenario_wrong_pin(self, user_id):
+        menu = self.open_menu(user_id)
+        prompt = self.press(user_id, 'button', 'create_config', menu, text_contains('Введите PIN-код'))
+        self.send(user_id, 'wrong_pin', '000000', text_contains('Неверный PIN-код'), reply_to=prompt)
+
+    def scenario_invalid_name(self, user_id):
+        prompt = self.ask_name(user_id)
+        self.send(user_id, 'invalid_name', 'bad!name', text_contains('Недопустим'), reply_to=prompt)
+
+    def scenario_duplicate_name(self, user_id):
+        name = random.choice(self.existing_names)
+        prompt = self.ask_name(user_id)
+        self.send(user_id, 'duplicate_name', name, text_contains('уже существует'), reply_to=prompt)
+
+    def scenario_create(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            while self._live and self._live[0] < now:
+                self._live.popleft()
+            if len(self._live) >= MAX_LIVE_CLIENTS:
+                full = True
+            else:
+                full = False
+                # С запасом на окно планировщика сроков
+                self._live.append(now + CLIENT_TTL + 30)
+        if full:
+            return self.scenario_invalid_name(user_id)
+        name = f"s{next(self._names)}"
+        prompt = self.ask_name(user_id)
+        result = self.send(user_id, 'create_document', f"{name} {CLIENT_TTL // 60}m",
+                           lambda c: c['method'] in ('sendDocument', 'editMessageText'), reply_to=prompt)
+        if 'document' not in result:
+            raise ScenarioError(f"конфигурация {name} не создана: {result.get('text', '')[:100]}")
+        self._expect(user_id, 'create_done', lambda c: c['method'] == 'editMessageText')
+
+    def run_one(self, scenario):
+        user_id = self._free_users.get()
+        try:
+            getattr(self, f"scenario_{scenario}")(user_id)
+            with self._lock:
+                self.completed[scenario] += 1
+        except ScenarioError as e:
+            with self._lock:
+                self.errors[scenario] += 1
+                if len(self.error_samples) < 20:
+                    self.error_samples.append(f"{scenario} (user {user_id}): {e}")
+        finally:
+            # Лишние ответы этого пользователя больше не нужны
+            self.telegram.forget_chat(user_id)
+            self._free_users.put(user_id)
+
+    def worker(self, stop_at):
+        names, weights = zip(*SCENARIOS.items())
+        while time.monotonic() < stop_at:
+            self.run_one(random.choices(names, weights)[0])
+
+
+def has_markup(call):
+    return call['method'] == 'sendMessage' and 'reply_markup' in call['params']
+
+
+def text_contains(text):
+    return lambda call: text in call['params'].get('text', '')
+
+
+def timed_handlers(bot, latency):
+    """Оборачивает обработчики бота замером времени (до build_application)"""
+    for name in HANDLERS:
+        handler = getattr(bot, name)
+
+        async def wrapper(update, context, _handler=handler, _name=name):
+            started = time.perf_counter()
+            try:
+                return await _handler(update, context)
+            finally:
+                latency[_name].append(time.perf_counter() - started)
+
+        setattr(bot, name, wrapper)
+
+
+def rss_bytes():
+    """RSS процесса без памяти, которую занимает сам tracemalloc"""
+    with open('/proc/self/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return rss - tracemalloc.get_tracemalloc_memory()
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def slope_per_hour(samples):
+    """Наклон линейной регрессии (значение за час) по [(время, значение)]"""
+    if len(samples) < 3:
+        return 0.0
+    times = [t for t, _ in samples]
+    values = [v for _, v in samples]
+    mean_t, mean_v = statistics.fmean(times), statistics.fmean(values)
+    var = sum((t - mean_t) ** 2 for t in times)
+    if not var:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in samples) / var * 3600
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def summarize(values):
+    ordered = sorted(values)
+    return {
+        'count': len(ordered),
+        'p50_ms': percentile(ordered, 50) * 1000,
+        'p95_ms': percentile(ordered, 95) * 1000,
+        'p99_ms': percentile(ordered, 99) * 1000,
+    }
+
+
+def prepare(workdir, api_url):
+    import config
+
+    clients_dir = os.path.join(workdir, 'clients')
+    os.makedirs(clients_dir)
+    with open(os.path.join(workdir, 'wg0.conf'), 'w') as f:
+        f.write("[Interface]\nAddress = 10.66.66.1/24\nListenPort = 51820\n")
+    config_file = os.path.join(workdir, 'api_token.txt')
+    with open(config_file, 'w') as f:
+        f.write(API_TOKEN_TEMPLATE.format(pub=random_key(), priv=random_key()))
+        f.write(f"WG_CONFIG_PATH = {workdir}/wg0.conf\nWG_CLIENTS_DIR = {clients_dir}\n"
+                f"STATE_DB_PATH = {workdir}/state.db\nBOT_API_URL = {api_url}\nRECONCILE_INTERVAL = 0\n"
+                f"EXPIRY_WINDOW = 5\n")
+    os.environ['PATH'] = FAKE_BIN + os.pathsep + os.environ.get('PATH', '')
+    os.environ['FAKE_WG_LOG'] = os.devnull
+    # Временные файлы бота (send_config_document) попадают в отдельный каталог
+    tempfile.tempdir = os.path.join(workdir, 'tmp')
+    os.makedirs(tempfile.tempdir)
+    return config.load_settings(config_file)
+
+
+async def serve(application, stop_event):
+    async with application:
+        await application.updater.start_polling(poll_interval=0, timeout=1)
+        await application.start()
+        await asyncio.get_running_loop().run_in_executor(None, stop_event.wait)
+        await application.updater.stop()
+        await application.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000, help='Число синтетических пользователей')
+    parser.add_argument('--workers', type=int, default=32, help='Одновременно идущих сценариев')
+    parser.add_argument('--duration', type=float, default=600, help='Длительность нагрузки, сек')
+    parser.add_argument('--warmup', type=float, default=None, help='Прогрев, сек (по умолчанию 20%% длительности)')
+    parser.add_argument('--sample-interval', type=float, default=2.0)
+    parser.add_argument('--timeout', type=float, default=30.0, help='Ожидание ответа бота на шаг сценария')
+    parser.add_argument('--real-limits', action='store_true',
+                        help='Оставить лимиты отправки из настроек (по умолчанию сняты, чтобы мерить сам бот)')
+    parser.add_argument('--no-tracemalloc', action='store_true')
+    parser.add_argument('--max-growth', type=float, default=20.0, help='Допустимый рост памяти после прогрева, МБ/ч')
+    parser.add_argument('--min-growth', type=float, default=5.0,
+                        help='Рост памяти за прогон, МБ, ниже которого наклон считается шумом')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--output', help='Куда записать результаты в JSON')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения пропускной способности')
+    parser.add_argument('--max-throughput-drop', type=float, default=0.2,
+                        help='Допустимое падение пропускной способности (0.2 = -20%%)')
+    args = parser.parse_args(argv)
+    warmup = args.duration * 0.2 if args.warmup is None else args.warmup
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if not args.no_tracemalloc:
+        tracemalloc.start(10)
+
+    import bot as bot_module
+    # Журнал бота на каждое сообщение исказил бы замеры и засорил вывод
+    logging.disable(logging.INFO)
+    from audit import AuditLog
+    from deploy_queue import DeployQueue
+    from expiry import ExpiryScheduler
+    from wireguard_manager import WireGuardManagerLocal
+
+    workdir = tempfile.mkdtemp(prefix='wg-soak-')
+    telegram = FakeTelegramServer(record_calls=False).start()
+    settings = prepare(workdir, telegram.url)
+    if not args.real_limits:
+        settings = dataclasses.replace(settings, send_rate_global=100000, send_rate_chat=1000)
+
+    wg_manager = WireGuardManagerLocal(settings)
+    audit_log = AuditLog(settings.state_db_path, settings.audit_path).start()
+    deploy_queue = DeployQueue(wg_manager, settings.state_db_path, workers=settings.deploy_workers,
+                               audit_log=audit_log).start()
+    expiry = ExpiryScheduler(wg_manager, deploy_queue, window=settings.expiry_window).start()
+    bot = bot_module.WireGuardBot(settings, wg_manager, deploy_queue, expiry)
+    handler_latency = defaultdict(list)
+    timed_handlers(bot, handler_latency)
+    application = bot_module.build_application(settings, bot)
+
+    stop_event = threading.Event()
+    bot_thread = threading.Thread(target=lambda: asyncio.run(serve(application, stop_event)), name='bot')
+    bot_thread.start()
+
+    generator = LoadGenerator(telegram, args.users, args.timeout)
+    for i in range(10):
+        _, error = deploy_queue.submit(f"taken{i}", FIRST_USER_ID - 1)
+        assert not error, error
+        generator.existing_names.append(f"taken{i}")
+    started = time.monotonic()
+    stop_at = started + args.duration
+    workers = [threading.Thread(target=generator.worker, args=(stop_at,), daemon=True) for _ in range(args.workers)]
+    for thread in workers:
+        thread.start()
+
+    samples = []
+    warm_snapshot = None
+    measured_from = None
+    print(f"Нагрузка: {args.users} пользователей, {args.workers} потоков, {args.duration:.0f} с (прогрев {warmup:.0f} с)")
+    while time.monotonic() < stop_at:
+        time.sleep(args.sample_interval)
+        elapsed = time.monotonic() - started
+        traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        samples.append({'t': elapsed, 'rss': rss_bytes(), 'traced': traced, 'fds': open_fds(),
+                        'completed': sum(generator.completed.values())})
+        if warm_snapshot is None and elapsed >= warmup:
+            warm_snapshot = os.path.join(workdir, 'warm.snapshot')
+            if tracemalloc.is_tracing():
+                # Снимок держится на диске, а не в памяти: иначе он сам выглядел бы как рост RSS
+                tracemalloc.take_snapshot().dump(warm_snapshot)
+            # Замеры роста начинаются после снимка
+            measured_from = len(samples)
+        if len(samples) % 15 == 0:
+            s = samples[-1]
+            print(f"  {elapsed:6.0f} с: сценариев {s['completed']}, RSS {s['rss'] / 2**20:.1f} МБ, "
+                  f"traced {s['traced'] / 2**20:.1f} МБ, дескрипторов {s['fds']}")
+    for thread in workers:
+        thread.join(args.timeout + 5)
+    final_snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+    elapsed_total = time.monotonic() - started
+
+    stop_event.set()
+    bot_thread.join(30)
+    expiry.stop()
+    deploy_queue.stop()
+    audit_log.stop()
+    telegram.stop()
+
+    measured = samples[measured_from:] if measured_from is not None else []
+    completed = sum(generator.completed.values())
+    errors = sum(generator.errors.values())
+    measured_time = (measured[-1]['t'] - measured[0]['t']) if len(measured) > 1 else elapsed_total
+    throughput = ((measured[-1]['completed'] - measured[0]['completed']) / measured_time) if len(measured) > 1 else 0.0
+    leftover_temp = os.listdir(tempfile.tempdir)
+    result = {
+        'tracemalloc': not args.no_tracemalloc,
+        'users': args.users,
+        'workers': args.workers,
+        'duration': elapsed_total,
+        'completed': dict(generator.completed),
+        'errors': dict(generator.errors),
+        'error_rate': errors / max(completed + errors, 1),
+        'throughput': throughput,
+        'steps': {step: summarize(values) for step, values in generator.step_latency.items()},
+        'handlers': {name: summarize(values) for name, values in handler_latency.items()},
+        'rss_growth_mb_per_hour': slope_per_hour([(s['t'], s['rss']) for s in measured]) / 2**20,
+        'traced_growth_mb_per_hour': slope_per_hour([(s['t'], s['traced']) for s in measured]) / 2**20,
+        'rss_growth_mb': (measured[-1]['rss'] - measured[0]['rss']) / 2**20 if measured else 0.0,
+        'traced_growth_mb': (measured[-1]['traced'] - measured[0]['traced']) / 2**20 if measured else 0.0,
+        'fds': [samples[0]['fds'], samples[-1]['fds']] if samples else [],
+        'fd_growth_per_hour': slope_per_hour([(s['t'], s['fds']) for s in measured]),
+        'leftover_temp_files': len(leftover_temp),
+        'user_data_entries': len(application.user_data),
+        'samples': samples,
+    }
+
+    print(f"\nСценариев: {completed}, ошибок: {errors} ({result['error_rate']:.2%}), "
+          f"пропускная способность {throughput:.1f} сценариев/с")
+    print(f"{'шаг':<18}{'n':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for title, table in (('Шаги сценариев', result['steps']), ('Обработчики', result['handlers'])):
+        print(f"-- {title}")
+        for name, stats in sorted(table.items()):
+            print(f"{name:<18}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    print(f"Рост памяти после прогрева: RSS {result['rss_growth_mb']:+.1f} МБ ({result['rss_growth_mb_per_hour']:+.1f} МБ/ч), "
+          f"tracemalloc {result['traced_growth_mb']:+.1f} МБ ({result['traced_growth_mb_per_hour']:+.1f} МБ/ч); "
+          f"дескрипторы {result['fds']}, user_data {result['user_data_entries']}")
+    if generator.error_samples:
+        print("Примеры ошибок:\n  " + "\n  ".join(generator.error_samples[:5]))
+    if final_snapshot is not None and warm_snapshot and os.path.exists(warm_snapshot):
+        print("Наибольший рост памяти после прогрева:")
+        snapshot_filter = [tracemalloc.Filter(False, tracemalloc.__file__),
+                           tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                           tracemalloc.Filter(False, os.path.join(BENCH_DIR, '*'))]
+        stats = final_snapshot.filter_traces(snapshot_filter).compare_to(
+            tracemalloc.Snapshot.load(warm_snapshot).filter_traces(snapshot_filter), 'lineno')
+        for stat in stats[:10]:
+            frame = stat.traceback[0]
+            print(f"  {stat.size_diff / 1024:+9.1f} КБ  {stat.count_diff:+6d}  {frame.filename}:{frame.lineno}")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    failures = []
+    # Короткий прогон дает большой наклон от шума: нужен и наклон, и заметный рост
+    for kind, title in (('traced', 'память tracemalloc'), ('rss', 'RSS')):
+        if result[f'{kind}_growth_mb_per_hour'] > args.max_growth and result[f'{kind}_growth_mb'] > args.min_growth:
+            failures.append(f"{title} растет на {result[f'{kind}_growth_mb_per_hour']:.1f} МБ/ч "
+                            f"(+{result[f'{kind}_growth_mb']:.1f} МБ за прогон)")
+    if result['fd_growth_per_hour'] > 60 and result['fds'] and result['fds'][1] > result['fds'][0] + 10:
+        failures.append(f"растет число дескрипторов: {result['fds'][0]} -> {result['fds'][1]}")
+    if leftover_temp:
+        failures.append(f"остались временные файлы: {len(leftover_temp)}")
+    if result['error_rate'] > args.max_error_rate:
+        failures.append(f"доля ошибок {result['error_rate']:.2%}")
+    if args.baseline and baseline.get('tracemalloc', True) != result['tracemalloc']:
+        # tracemalloc замедляет бота в разы, такие прогоны несравнимы
+        failures.append("базовый прогон снят с другим режимом tracemalloc")
+    elif args.baseline and baseline.get('throughput'):
+        drop = 1 - throughput / baseline['throughput']
+        print(f"Пропускная способность: {throughput:.1f} против {baseline['throughput']:.1f} в базовом прогоне "
+              f"({-drop:+.0%})")
+        if drop > args.max_throughput_drop:
+            failures.append(f"пропускная способность упала на {drop:.0%}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Результаты записаны в {args.output}")
+    if failures:
+        print("❌ " + "; ".join(failures))
+        return 1
+    print("✅ Утечек и падения пропускной способности не обнаружено")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
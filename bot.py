@@ -1,10 +1,22 @@
+import asyncio
 import logging
+import signal
+import sys
 import tempfile
+import time
 import os
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 from wireguard_manager import WireGuardManagerLocal
-from config import BOT_TOKEN, ACCESS_PIN
+from deploy_queue import DeployQueue
+from reconcile import Reconciler
+from send_queue import SendScheduler, PRIORITY_INFO
+from expiry import ExpiryScheduler, parse_ttl
+from lease import LeaderLease
+from persistence import SqlitePersistence
+from snapshots import SnapshotStore
+from audit import AuditLog, describe
+import config
 
 # Настройка логирования
 logging.basicConfig(
@@ -13,12 +25,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Словарь для хранения состояний пользователей
-user_states = {}
+def is_valid_client_name(client_name):
+    """Имя клиента: 2-20 символов, латиница в нижнем регистре, цифры, дефисы и подчеркивания"""
+    return (
+        client_name.isascii()
+        and 2 <= len(client_name) <= 20
+        and all(c.islower() or c.isdigit() or c in '_-' for c in client_name)
+    )
+
+# Сколько событий показывает /audit
+AUDIT_LIMIT = 30
+
+def format_time(timestamp):
+    return time.strftime('%d.%m.%Y %H:%M', time.localtime(timestamp))
 
 class WireGuardBot:
-    def __init__(self):
-        self.wg_manager = WireGuardManagerLocal()
+    def __init__(self, settings, wg_manager=None, deploy_queue=None, expiry=None):
+        self.settings = settings
+        self.wg_manager = wg_manager or WireGuardManagerLocal(settings)
+        self.deploy_queue = deploy_queue or DeployQueue(
+            self.wg_manager, settings.state_db_path, workers=settings.deploy_workers
+        )
+        self.expiry = expiry or ExpiryScheduler(self.wg_manager, self.deploy_queue, window=settings.expiry_window)
+        self.reconciler = Reconciler(self.wg_manager, self.deploy_queue)
+        self._reconcile_task = None
         
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
@@ -84,8 +114,9 @@ class WireGuardBot:
         await query.answer()
         
         if query.data == "create_config":
-            user_id = query.from_user.id
-            user_states[user_id] = "waiting_pin"
+            # Состояние диалога хранится в user_data и сохраняется в базе (persistence)
+            context.user_data['state'] = "waiting_pin"
+            context.user_data.pop('pending_get', None)
             
             # Отправляем force_reply для PIN-кода
             sent = await query.message.reply_text(
@@ -105,10 +136,11 @@ class WireGuardBot:
         """Обработчик текстовых сообщений"""
         user_id = update.message.from_user.id
         text = update.message.text
-        logger.info(f"handle_message: user_id={user_id}, text={text}, state={user_states.get(user_id)}, reply_to={getattr(update.message.reply_to_message, 'message_id', None)}")
+        # Текст сообщения не пишется в журнал: это может быть PIN
+        logger.debug(f"handle_message: user_id={user_id}, state={context.user_data.get('state')}, reply_to={getattr(update.message.reply_to_message, 'message_id', None)}")
         
         # Проверяем, ожидается ли PIN и это reply на force_reply
-        if user_states.get(user_id) == "waiting_pin":
+        if context.user_data.get('state') == "waiting_pin":
             pin_message_id = context.user_data.get('pin_message_id')
             if update.message.reply_to_message and pin_message_id and \
                update.message.reply_to_message.message_id == pin_message_id:
@@ -117,7 +149,7 @@ class WireGuardBot:
             else:
                 await update.message.reply_text("Пожалуйста, введите PIN-код, ответив на сообщение запроса PIN.")
                 return
-        elif user_states.get(user_id) == "waiting_name":
+        elif context.user_data.get('state') == "waiting_name":
             name_message_id = context.user_data.get('name_message_id')
             if update.message.reply_to_message and name_message_id and \
                update.message.reply_to_message.message_id == name_message_id:
@@ -126,7 +158,8 @@ class WireGuardBot:
             else:
                 # Повторно отправляем force_reply для имени
                 sent = await update.message.reply_text(
-                    "Пожалуйста, введите имя для конфигурации (например: phone, laptop, tablet):",
+                    "Пожалуйста, введите имя для конфигурации (например: phone, laptop, tablet).\n"
+                    "Для временного доступа добавьте срок: `guest 7d` (m — минуты, h — часы, d — дни, w — недели).",
                     parse_mode='Markdown',
                     reply_markup=ForceReply(selective=True)
                 )
@@ -140,35 +173,58 @@ class WireGuardBot:
     
     async def handle_pin_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE, pin=None):
         """Обработчик ввода PIN-кода"""
-        user_id = update.message.from_user.id
         if pin is None:
             pin = update.message.text.strip()
         else:
             pin = pin.strip()
         
-        if pin == ACCESS_PIN:
-            user_states[user_id] = "waiting_name"
+        if pin == self.settings.access_pin:
+            # PIN запрошен командой /get: сразу выдаем конфигурацию
+            pending_get = context.user_data.pop('pending_get', None)
+            if pending_get:
+                context.user_data.pop('state', None)
+                context.user_data.pop('pin_message_id', None)
+                await self.send_existing_config(update, *pending_get)
+                return
+            context.user_data['state'] = "waiting_name"
             # Запрашиваем имя через force_reply
             sent = await update.message.reply_text(
-                "✅ **PIN-код верный!**\n\nТеперь введите имя для конфигурации (например: phone, laptop, tablet):",
+                "✅ **PIN-код верный!**\n\nТеперь введите имя для конфигурации (например: phone, laptop, tablet).\n"
+                "Для временного доступа добавьте срок: `guest 7d` (m — минуты, h — часы, d — дни, w — недели).",
                 parse_mode='Markdown',
                 reply_markup=ForceReply(selective=True)
             )
             context.user_data['name_message_id'] = sent.message_id
         else:
+            # В журнал аудита попадает только факт попытки, без введенного значения
+            self.deploy_queue.audit('pin_failed', update.message.from_user.id,
+                                    purpose='get' if context.user_data.get('pending_get') else 'create')
             await update.message.reply_text(
                 "❌ **Неверный PIN-код!**\n\n"
                 "Попробуйте еще раз: ответьте на сообщение запроса PIN или нажмите /start."
             )
-            del user_states[user_id]
+            context.user_data.pop('state', None)
             context.user_data.pop('pin_message_id', None)
+            context.user_data.pop('pending_get', None)
     
     async def handle_name_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ввода имени конфигурации"""
         user_id = update.message.from_user.id
         client_name = update.message.text.strip().lower()  # Приводим к нижнему регистру
-        logger.info(f"handle_name_input: user_id={user_id}, client_name={client_name}")
         
+        # Необязательный срок действия после имени: "guest 7d"
+        ttl = None
+        parts = client_name.split()
+        if len(parts) == 2:
+            client_name, ttl = parts[0], parse_ttl(parts[1])
+            if ttl is None:
+                sent = await update.message.reply_text(
+                    "❌ **Неверный срок действия!**\n\n"
+                    "Укажите число и единицу: 30m, 12h, 7d или 2w.",
+                    reply_markup=ForceReply(selective=True)
+                )
+                context.user_data['name_message_id'] = sent.message_id
+                return
         # Проверяем имя на допустимые символы (только латинские буквы в нижнем регистре, цифры, дефисы и подчеркивания)
         if not client_name.replace('_', '').replace('-', '').replace(' ', '').isalnum() or not client_name.isascii():
             sent = await update.message.reply_text(
@@ -199,8 +255,8 @@ class WireGuardBot:
             context.user_data['name_message_id'] = sent.message_id
             return
         
-        # Проверяем, не существует ли уже конфигурация с таким именем
-        if self.wg_manager.check_client_name_exists(client_name):
+        # Проверяем, не существует ли уже конфигурация с таким именем (по индексу владельцев)
+        if self.deploy_queue.owners.exists(client_name):
             sent = await update.message.reply_text(
                 f"❌ **Конфигурация с именем '{client_name}' уже существует!**\n\n"
                 "Пожалуйста, выберите другое имя.",
@@ -209,7 +265,8 @@ class WireGuardBot:
             context.user_data['name_message_id'] = sent.message_id
             return
         
-        await update.message.reply_text(
+        # Статус создания затем правится в итог, а не дополняется новым сообщением
+        status = await update.message.reply_text(
             "⏳ **Создание конфигурации...**\n\n"
             "Пожалуйста, подождите. Это может занять несколько секунд.",
             parse_mode='Markdown'
@@ -217,32 +274,33 @@ class WireGuardBot:
         
         try:
             # Создаем конфигурацию
-            config, error = self.wg_manager.create_and_deploy_config(client_name)
+            # Задание фиксируется в очереди, развертывание продолжается в фоне
+            quota = 0 if self.is_admin(user_id) else self.settings.user_quota
+            expires_at = time.time() + ttl if ttl else None
+            config, error = await asyncio.to_thread(
+                self.deploy_queue.submit, client_name, user_id, quota, expires_at
+            )
+            if not error and expires_at:
+                self.expiry.schedule(client_name, expires_at)
+            if error:
+                self.deploy_queue.audit('create_failed', user_id, client_name, error=error)
+            else:
+                self.deploy_queue.audit('create', user_id, client_name,
+                                        **({'expires_at': format_time(expires_at)} if expires_at else {}))
             
             if error:
-                await update.message.reply_text(
+                await status.edit_text(
                     f"❌ **Ошибка создания конфигурации:**\n\n{error}"
                 )
             else:
-                # Создаем временный файл с конфигурацией
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.conf', delete=False) as f:
-                    f.write(config)
-                    temp_file_path = f.name
-                
-                # Отправляем файл конфигурации
-                with open(temp_file_path, 'rb') as f:
-                    await update.message.reply_document(
-                        document=f,
-                        filename=f"{client_name}.conf",
-                        caption=f"✅ **Конфигурация создана!**\n\n"
-                                f"📁 Файл: `{client_name}.conf`\n"
-                                f"📱 Импортируйте этот файл в приложение WireGuard\n\n"
-                                f"🔐 Конфигурация защищена и развернута на сервере.",
-                        parse_mode='Markdown'
-                    )
-                
-                # Удаляем временный файл
-                os.unlink(temp_file_path)
+                await self.send_config_document(
+                    update, client_name, config,
+                    f"✅ **Конфигурация создана!**\n\n"
+                    f"📁 Файл: `{client_name}.conf`\n"
+                    f"📱 Импортируйте этот файл в приложение WireGuard\n\n"
+                    f"🔐 Конфигурация будет активирована на сервере в течение нескольких секунд."
+                    + (f"\n⏱ Действует до {format_time(expires_at)}" if expires_at else "")
+                )
                 
                 # Создаем кнопку для создания новой конфигурации
                 keyboard = [
@@ -250,7 +308,7 @@ class WireGuardBot:
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
                 
-                await update.message.reply_text(
+                await status.edit_text(
                     "🎉 **Готово!**\n\n"
                     "Ваша конфигурация WireGuard создана и готова к использованию.",
                     reply_markup=reply_markup,
@@ -258,17 +316,310 @@ class WireGuardBot:
                 )
         
         except Exception as e:
-            await update.message.reply_text(
+            await status.edit_text(
                 f"❌ **Произошла ошибка:**\n\n{str(e)}"
             )
         
         finally:
             # Очищаем состояние пользователя
-            if user_id in user_states:
-                del user_states[user_id]
+            context.user_data.pop('state', None)
             context.user_data.pop('name_message_id', None)
             context.user_data.pop('pin_message_id', None)
     
+    async def send_config_document(self, update: Update, client_name, config, caption):
+        """Отправляет конфигурацию клиента файлом .conf"""
+        # Создаем временный файл с конфигурацией
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.conf', delete=False) as f:
+            f.write(config)
+            temp_file_path = f.name
+        
+        try:
+            # Отправляем файл конфигурации
+            with open(temp_file_path, 'rb') as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=f"{client_name}.conf",
+                    caption=caption,
+                    parse_mode='Markdown'
+                )
+        finally:
+            # Удаляем временный файл
+            os.unlink(temp_file_path)
+    
+    async def get_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /get <имя> [rotate]: повторная выдача или перевыпуск ключей"""
+        user_id = update.message.from_user.id
+        args = [arg.strip().lower() for arg in (context.args or [])]
+        if not args or len(args) > 2 or (len(args) == 2 and args[1] != 'rotate'):
+            await update.message.reply_text(
+                "Использование: `/get <имя>` — получить конфигурацию заново,\n"
+                "`/get <имя> rotate` — перевыпустить ключи (старый файл перестанет работать).",
+                parse_mode='Markdown'
+            )
+            return
+        client_name = args[0]
+        if not is_valid_client_name(client_name):
+            await update.message.reply_text(
+                "❌ **Недопустимое имя!**\n\n"
+                "Используйте только латинские буквы в нижнем регистре, цифры, дефисы и подчеркивания."
+            )
+            return
+        
+        if not self.can_access(user_id, client_name):
+            self.deploy_queue.audit('denied', user_id, client_name)
+            await update.message.reply_text(
+                f"❌ Конфигурация '{client_name}' создана другим пользователем или не закреплена ни за кем. "
+                f"Если это ваша конфигурация, попросите администратора назначить вас владельцем."
+            )
+            return
+        
+        # Выдача конфигурации тоже защищена PIN-кодом
+        context.user_data['state'] = "waiting_pin"
+        context.user_data['pending_get'] = (client_name, len(args) == 2)
+        sent = await update.message.reply_text(
+            "🔐 **Введите PIN-код**\n\nДля получения конфигурации введите 6-значный PIN-код:",
+            parse_mode='Markdown',
+            reply_markup=ForceReply(selective=True)
+        )
+        context.user_data['pin_message_id'] = sent.message_id
+    
+    async def send_existing_config(self, update: Update, client_name, rotate):
+        """Выдает сохраненную конфигурацию клиента, при rotate — с новыми ключами"""
+        try:
+            if rotate:
+                config, error = await asyncio.to_thread(self.rotate_client_key, client_name)
+                caption = (f"🔄 **Ключи перевыпущены!**\n\n"
+                           f"📁 Файл: `{client_name}.conf`\n"
+                           f"⚠️ Старая конфигурация больше не работает, импортируйте этот файл.")
+            else:
+                config = self.deploy_queue.get_pending_config(client_name) or \
+                    await asyncio.to_thread(self.wg_manager.get_client_config, client_name)
+                error = None if config else f"Конфигурация '{client_name}' не найдена"
+                caption = (f"📁 **Конфигурация `{client_name}.conf`**\n\n"
+                           f"📱 Импортируйте этот файл в приложение WireGuard")
+            if error:
+                await update.message.reply_text(f"❌ **Ошибка:**\n\n{error}")
+                return
+            self.deploy_queue.audit('rotate' if rotate else 'get', update.message.from_user.id, client_name)
+            await self.send_config_document(update, client_name, config, caption)
+        except Exception as e:
+            await update.message.reply_text(
+                f"❌ **Произошла ошибка:**\n\n{str(e)}"
+            )
+    
+    def can_access(self, user_id, client_name):
+        """Клиента может получить его создатель или администратор; клиенты без владельца — только администратор"""
+        if self.is_admin(user_id):
+            return True
+        owner = self.deploy_queue.owners.owner_of(client_name)
+        return owner is not None and owner == user_id
+    
+    async def my_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /my: конфигурации, созданные пользователем"""
+        user_id = update.message.from_user.id
+        clients = self.deploy_queue.owners.clients_of(user_id)
+        if not clients:
+            await update.message.reply_text("У вас пока нет конфигураций. Нажмите /start, чтобы создать.")
+            return
+        lines = [f"📋 **Ваши конфигурации ({len(clients)}"
+                 + (f" из {self.settings.user_quota}" if self.settings.user_quota and not self.is_admin(user_id) else "")
+                 + "):**\n"]
+        for client_name, created_at, expires_at, job_state in clients:
+            if job_state == 'failed':
+                status = " ❌ не удалось развернуть, администраторы уведомлены"
+            else:
+                status = " ⏳ разворачивается" if job_state else ""
+            if expires_at:
+                status += f" ⏱ до {format_time(expires_at)}"
+            lines.append(f"• `{client_name}` — {time.strftime('%d.%m.%Y', time.localtime(created_at))}{status}")
+        lines.append("\nПолучить файл заново: `/get <имя>`")
+        await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+    
+    def rotate_client_key(self, client_name):
+        """Перевыпуск ключей под той же блокировкой, что и развертывание"""
+        if self.deploy_queue.is_pending(client_name):
+            return None, f"Конфигурация '{client_name}' еще разворачивается, попробуйте позже"
+        with self.deploy_queue.server_lock:
+            self.deploy_queue.snapshot("перевыпуск ключей")
+            return self.wg_manager.rotate_client_key(client_name)
+    
+    def is_admin(self, user_id):
+        return user_id in self.settings.admin_ids
+    
+    async def notify_admins(self, bot, text):
+        """Отправляет сообщение всем администраторам из ADMIN_IDS"""
+        for admin_id in self.settings.admin_ids:
+            try:
+                await bot.send_message(chat_id=admin_id, text=text, rate_limit_args=PRIORITY_INFO)
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение администратору {admin_id}: {e}")
+    
+    async def reconcile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /reconcile [repair] [prune] (только для администраторов)"""
+        if not self.is_admin(update.message.from_user.id):
+            await update.message.reply_text("❌ Команда доступна только администраторам.")
+            return
+        args = {arg.strip().lower() for arg in (context.args or [])}
+        if args - {'repair', 'prune'}:
+            await update.message.reply_text(
+                "Использование: `/reconcile` — только проверка,\n"
+                "`/reconcile repair` — исправить расхождения,\n"
+                "`/reconcile repair prune` — также удалить пиры без файла клиента.",
+                parse_mode='Markdown'
+            )
+            return
+        try:
+            report = await asyncio.to_thread(
+                self.reconciler.run, repair='repair' in args, prune='prune' in args
+            )
+            if report.repaired:
+                self.deploy_queue.audit('repair', update.message.from_user.id, prune='prune' in args)
+            await update.message.reply_text(f"🔍 Сверка WireGuard\n\n{report.summary()}")
+        except Exception as e:
+            await update.message.reply_text(f"❌ **Ошибка сверки:**\n\n{str(e)}")
+    
+    async def rollback_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /rollback [номер снимка] (только для администраторов)"""
+        if not self.is_admin(update.message.from_user.id):
+            await update.message.reply_text("❌ Команда доступна только администраторам.")
+            return
+        if self.deploy_queue.snapshots is None:
+            await update.message.reply_text("❌ Снимки отключены (SNAPSHOT_KEEP = 0).")
+            return
+        args = context.args or []
+        if not args:
+            snapshots = await asyncio.to_thread(self.deploy_queue.snapshots.history)
+            if not snapshots:
+                await update.message.reply_text("Снимков пока нет.")
+                return
+            lines = ["🗂 **Последние снимки** (делаются перед изменением сервера):\n"]
+            for snapshot_id, created_at, reason, clients in snapshots:
+                lines.append(f"• `#{snapshot_id}` {format_time(created_at)} — {reason}, клиентов {clients}")
+            lines.append("\nОткатить сервер к снимку: `/rollback <номер>`")
+            await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+            return
+        if len(args) != 1 or not args[0].lstrip('#').isdigit():
+            await update.message.reply_text(
+                "Использование: `/rollback` — список снимков,\n"
+                "`/rollback <номер>` — откатить конфиг сервера и файлы клиентов к снимку.",
+                parse_mode='Markdown'
+            )
+            return
+        snapshot_id = int(args[0].lstrip('#'))
+        try:
+            before_id, written, removed = await asyncio.to_thread(self.deploy_queue.rollback, snapshot_id)
+            # Вернувшиеся временные клиенты снова попадают в планировщик сроков (истекшие удалятся в ближайшем окне)
+            self.expiry.reload()
+        except KeyError:
+            await update.message.reply_text(f"❌ Снимок #{snapshot_id} не найден.")
+            return
+        except Exception as e:
+            await update.message.reply_text(f"❌ **Ошибка отката:**\n\n{str(e)}")
+            return
+        self.deploy_queue.audit('rollback', update.message.from_user.id, snapshot=snapshot_id,
+                                written=written, removed=removed, before=before_id)
+        await update.message.reply_text(
+            f"⏪ Сервер возвращен к снимку #{snapshot_id}: восстановлено файлов клиентов {written}, "
+            f"удалено {removed}, интерфейс синхронизирован.\n"
+            f"Состояние до отката сохранено в снимке #{before_id}."
+        )
+    
+    async def owner_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /owner <имя> [id пользователя] (только для администраторов)"""
+        admin_id = update.message.from_user.id
+        if not self.is_admin(admin_id):
+            await update.message.reply_text("❌ Команда доступна только администраторам.")
+            return
+        args = [arg.strip().lower() for arg in (context.args or [])]
+        if not args or len(args) > 2 or not is_valid_client_name(args[0]) or (len(args) == 2 and not args[1].isdigit()):
+            await update.message.reply_text(
+                "Использование: `/owner <имя>` — владелец конфигурации,\n"
+                "`/owner <имя> <id пользователя>` — назначить владельца.",
+                parse_mode='Markdown'
+            )
+            return
+        client_name = args[0]
+        owners = self.deploy_queue.owners
+        if not await asyncio.to_thread(owners.exists, client_name):
+            await update.message.reply_text(f"❌ Конфигурация '{client_name}' не найдена.")
+            return
+        if len(args) == 1:
+            owner = await asyncio.to_thread(owners.owner_of, client_name)
+            await update.message.reply_text(
+                f"Владелец '{client_name}': {owner}" if owner is not None
+                else f"У '{client_name}' нет владельца, ее выдает только администратор."
+            )
+            return
+        user_id = int(args[1])
+        if not await asyncio.to_thread(owners.assign, client_name, user_id):
+            await update.message.reply_text(f"❌ Конфигурация '{client_name}' не найдена.")
+            return
+        self.deploy_queue.audit('assign', admin_id, client_name, owner=user_id)
+        await update.message.reply_text(f"✅ Владелец '{client_name}': {user_id}")
+    
+    async def audit_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /audit [id пользователя] [период] (только для администраторов)"""
+        if not self.is_admin(update.message.from_user.id):
+            await update.message.reply_text("❌ Команда доступна только администраторам.")
+            return
+        if self.deploy_queue.audit_log is None:
+            await update.message.reply_text("❌ Журнал аудита отключен.")
+            return
+        user_id, period = None, None
+        for arg in (arg.strip().lower() for arg in (context.args or [])):
+            if arg.isdigit() and user_id is None:
+                user_id = int(arg)
+            elif parse_ttl(arg) and period is None:
+                period = parse_ttl(arg)
+            else:
+                await update.message.reply_text(
+                    "Использование: `/audit` — последние события,\n"
+                    "`/audit <id пользователя>` — события пользователя,\n"
+                    "`/audit [id пользователя] 7d` — за период (m, h, d, w).",
+                    parse_mode='Markdown'
+                )
+                return
+        since = time.time() - period if period else 0
+        events = await asyncio.to_thread(self.deploy_queue.audit_log.query, user_id, since, AUDIT_LIMIT)
+        if not events:
+            await update.message.reply_text("Событий не найдено.")
+            return
+        # Без Markdown: в именах клиентов бывают подчеркивания
+        lines = [f"📜 Журнал аудита (последние {len(events)}):\n"]
+        lines += [f"{format_time(entry['at'])} {describe(entry)}" for entry in events]
+        await update.message.reply_text("\n".join(lines))
+    
+    async def reconcile_loop(self, application):
+        """Сверка при запуске и далее каждые RECONCILE_INTERVAL секунд"""
+        while True:
+            try:
+                report = await asyncio.to_thread(self.reconciler.run, repair=self.settings.reconcile_repair)
+                if report.repaired:
+                    self.deploy_queue.audit('repair')
+                if not report.is_clean:
+                    await self.notify_admins(application.bot, f"⚠️ Сверка WireGuard\n\n{report.summary()}")
+            except Exception as e:
+                logger.error(f"Ошибка сверки WireGuard: {e}")
+            if not self.settings.reconcile_interval:
+                return
+            await asyncio.sleep(self.settings.reconcile_interval)
+    
+    async def post_init(self, application):
+        loop = asyncio.get_running_loop()
+        
+        def on_deploy_failed(names, error):
+            # Вызывается из потока очереди развертывания
+            text = (f"❌ Не удалось развернуть клиентов ({len(names)}): {', '.join(names)}\n\n"
+                    f"Ошибка: {error}\nЗадания будут повторены после перезапуска бота.")
+            asyncio.run_coroutine_threadsafe(self.notify_admins(application.bot, text), loop)
+        
+        self.deploy_queue.on_failed = on_deploy_failed
+        self._reconcile_task = asyncio.create_task(self.reconcile_loop(application))
+    
+    async def post_shutdown(self, application):
+        if self._reconcile_task:
+            self._reconcile_task.cancel()
+    
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
         help_text = """
@@ -276,6 +627,13 @@ class WireGuardBot:
 
 **Команды:**
 /start - Начать работу с ботом
+/my - Список ваших конфигураций
+/get <имя> - Получить существующую конфигурацию заново
+/get <имя> rotate - Перевыпустить ключи конфигурации
+/reconcile - Сверка состояния сервера (для администраторов)
+/rollback - Откат сервера к снимку (для администраторов)
+/owner <имя> <id> - Назначить владельца конфигурации (для администраторов)
+/audit - Журнал аудита (для администраторов)
 /help - Показать эту справку
 
 **Как использовать:**
@@ -293,23 +651,100 @@ class WireGuardBot:
         
         await update.message.reply_text(help_text, parse_mode='Markdown')
 
-def main():
+def main(manager_class=WireGuardManagerLocal, ssh=False):
     """Основная функция запуска бота"""
-    bot = WireGuardBot()
+    # Проверяем конфигурацию до запуска, чтобы ошибки не доходили до пользователей
+    try:
+        settings = config.load_settings(ssh=ssh)
+    except (config.ConfigError, FileNotFoundError) as e:
+        print(f"❌ Ошибка конфигурации:\n{e}")
+        sys.exit(1)
     
+    lease = None
+    if settings.leader_lease_ttl:
+        # Режим active/standby: работает только экземпляр, держащий аренду
+        lease = LeaderLease(settings.state_db_path, settings.leader_lease_ttl)
+        holder = lease.current_holder()
+        if holder:
+            print(f"⏸ Резервный экземпляр: лидер {holder}, ожидание аренды...")
+        lease.wait()
+        # Потеря аренды останавливает бота так же, как SIGTERM
+        lease.keep_alive(lambda: os.kill(os.getpid(), signal.SIGTERM))
+    try:
+        run(settings, manager_class)
+    finally:
+        if lease:
+            lease.release()
+    if lease and lease.lost:
+        # Код ошибки, чтобы супервизор перезапустил процесс резервным
+        sys.exit(1)
+
+def build_application(settings, bot):
+    """Приложение PTB с планировщиком отправки, persistence и обработчиками бота"""
     # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(settings.bot_token)
+        # Все исходящие запросы проходят через планировщик с учетом лимитов Telegram
+        .rate_limiter(SendScheduler(settings.send_rate_global, settings.send_rate_chat))
+        # Диалоги сохраняются в базе состояния и переживают перезапуск и смену лидера
+        .persistence(SqlitePersistence(settings.state_db_path))
+        .post_init(bot.post_init)
+        .post_shutdown(bot.post_shutdown)
+    )
+    if settings.bot_api_url:
+        # Свой сервер Bot API (локальный telegram-bot-api или заглушка для тестов)
+        builder.base_url(f"{settings.bot_api_url}/bot").base_file_url(f"{settings.bot_api_url}/file/bot")
+    application = builder.build()
     
     # Добавляем обработчики
     application.add_handler(CommandHandler("start", bot.start))
     application.add_handler(CommandHandler("help", bot.help_command))
+    application.add_handler(CommandHandler("get", bot.get_command))
+    application.add_handler(CommandHandler("my", bot.my_command))
     application.add_handler(CommandHandler("menu", bot.menu))
+    application.add_handler(CommandHandler("reconcile", bot.reconcile_command))
+    application.add_handler(CommandHandler("rollback", bot.rollback_command))
+    application.add_handler(CommandHandler("owner", bot.owner_command))
+    application.add_handler(CommandHandler("audit", bot.audit_command))
     application.add_handler(CallbackQueryHandler(bot.button_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_message))
+    return application
+
+def run(settings, manager_class):
+    wg_manager = manager_class(settings)
+    # Снимки состояния сервера перед каждым изменением (для /rollback)
+    snapshots = None
+    if settings.snapshot_keep:
+        snapshots = SnapshotStore(wg_manager, settings.state_db_path, settings.snapshot_path, keep=settings.snapshot_keep)
+    # Очередь развертывания: при запуске подхватывает задания, прерванные падением процесса
+    # Журнал аудита: события пишет фоновый поток
+    audit_log = AuditLog(settings.state_db_path, settings.audit_path).start()
+    deploy_queue = DeployQueue(wg_manager, settings.state_db_path, workers=settings.deploy_workers,
+                               snapshots=snapshots, audit_log=audit_log)
+    # Имена существующих клиентов попадают в индекс до приема новых (до запуска обработчиков)
+    try:
+        added, _ = deploy_queue.owners.sync(wg_manager.list_client_names())
+    except Exception as e:
+        print(f"❌ Не удалось прочитать список клиентов: {e}")
+        sys.exit(1)
+    if added:
+        logger.info(f"В индекс владельцев добавлено клиентов без владельца: {added}")
+    deploy_queue.start()
+    # Планировщик сроков: восстанавливает сроки из базы, просроченные за время простоя удаляет сразу
+    expiry = ExpiryScheduler(wg_manager, deploy_queue, window=settings.expiry_window).start()
+    bot = WireGuardBot(settings, wg_manager, deploy_queue, expiry)
+    
+    application = build_application(settings, bot)
     
     # Запускаем бота
     print("🤖 WireGuard Bot запущен...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        expiry.stop()
+        deploy_queue.stop()
+        audit_log.stop()
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
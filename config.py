@@ -1,10 +1,257 @@
+import base64
+import binascii
+import ipaddress
 import os
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+# Файл с параметрами (можно переопределить переменной окружения)
+CONFIG_FILE = os.environ.get('WG_BOT_CONFIG', 'api_token.txt')
+
+PLACEHOLDER_HOST = 'YOUR_SERVER_IP'
+
+_INTERFACE_RE = re.compile(r'^[A-Za-z0-9_=+.-]{1,15}$')
+_HOSTNAME_RE = re.compile(r'^(?=.{1,253}$)([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?)(\.[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?)*$')
+
+_current = None
+
+
+class ConfigError(ValueError):
+    """Ошибка в параметрах конфигурации"""
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Проверенные параметры бота"""
+    bot_token: str
+    access_pin: str
+    wg_server_ip: str
+    wg_server_port: int
+    wg_server_public_key: str
+    wg_server_private_key: str
+    ssh_host: str
+    ssh_port: int
+    ssh_username: str
+    ssh_password: str
+    ssh_key_path: Optional[str]
+    wg_interface: str
+    wg_config_path: str
+    wg_clients_dir: str
+    client_dns: str
+    client_allowed_ips: str
+    state_db_path: str = 'wg_bot_state.db'
+    deploy_workers: int = 1
+    admin_ids: tuple = ()
+    reconcile_interval: int = 3600
+    reconcile_repair: bool = False
+    send_rate_global: int = 25
+    send_rate_chat: int = 1
+    user_quota: int = 0
+    expiry_window: int = 60
+    leader_lease_ttl: int = 0
+    bot_api_url: str = ''
+    snapshot_dir: str = ''
+    snapshot_keep: int = 50
+    audit_dir: str = ''
+
+    @classmethod
+    def from_dict(cls, config_data):
+        """Собирает параметры из словаря api_token.txt (значения по умолчанию как раньше)"""
+        errors = []
+
+        def number(key, default):
+            value = config_data.get(key, default)
+            try:
+                return int(value)
+            except ValueError:
+                errors.append(f"{key}: ожидается число, получено '{value}'")
+                return 0
+
+        def flag(key, default):
+            value = config_data.get(key, default).lower()
+            if value not in ('yes', 'no', 'true', 'false', '1', '0'):
+                errors.append(f"{key}: ожидается yes или no, получено '{value}'")
+            return value in ('yes', 'true', '1')
+
+        def id_list(key):
+            ids = []
+            for item in _split_list(config_data.get(key, '')):
+                try:
+                    ids.append(int(item))
+                except ValueError:
+                    errors.append(f"{key}: ожидается список числовых id Telegram, получено '{item}'")
+            return tuple(ids)
+
+        settings = cls(
+            # Telegram Bot настройки
+            bot_token=config_data.get('token', '').replace('token = ', ''),
+            # PIN код для доступа (6 цифр)
+            access_pin=config_data.get('ACCESS_PIN', '123456'),
+            # WireGuard сервер настройки
+            wg_server_ip=config_data.get('WG_SERVER_IP', PLACEHOLDER_HOST),
+            wg_server_port=number('WG_SERVER_PORT', '65338'),
+            wg_server_public_key=config_data.get('SERVER_PUB_KEY', ''),
+            wg_server_private_key=config_data.get('SERVER_PRIV_KEY', ''),
+            # SSH настройки для подключения к серверу
+            ssh_host=config_data.get('SSH_HOST', PLACEHOLDER_HOST),
+            ssh_port=number('SSH_PORT', '22'),
+            ssh_username=config_data.get('SSH_USERNAME', 'root'),
+            ssh_password=config_data.get('SSH_PASSWORD', 'your_password'),
+            ssh_key_path=config_data.get('SSH_KEY_PATH', None) or None,
+            # WireGuard настройки
+            wg_interface=config_data.get('WG_INTERFACE', 'wg0'),
+            wg_config_path=config_data.get('WG_CONFIG_PATH', '/etc/wireguard/wg0.conf'),
+            wg_clients_dir=config_data.get('WG_CLIENTS_DIR', '/etc/wireguard/clients'),
+            # Настройки клиентов
+            client_dns=config_data.get('CLIENT_DNS', '1.1.1.1, 1.0.0.1'),
+            client_allowed_ips=config_data.get('CLIENT_ALLOWED_IPS', '0.0.0.0/0,::/0'),
+            # Состояние бота (очередь развертывания и т.п.)
+            state_db_path=config_data.get('STATE_DB_PATH', 'wg_bot_state.db'),
+            deploy_workers=number('DEPLOY_WORKERS', '1'),
+            # Администраторы (id Telegram через запятую) и сверка состояния
+            admin_ids=id_list('ADMIN_IDS'),
+            reconcile_interval=number('RECONCILE_INTERVAL', '3600'),
+            reconcile_repair=flag('RECONCILE_REPAIR', 'no'),
+            # Ограничения исходящих сообщений (в секунду: всего и в один чат)
+            send_rate_global=number('SEND_RATE_GLOBAL', '25'),
+            send_rate_chat=number('SEND_RATE_CHAT', '1'),
+            # Сколько конфигураций может создать один пользователь (0 — без лимита)
+            user_quota=number('USER_QUOTA', '0'),
+            # Окно (сек), в котором истекшие временные конфигурации удаляются одной пачкой
+            expiry_window=number('EXPIRY_WINDOW', '60'),
+            # Режим active/standby: срок аренды лидерства, сек (0 — один экземпляр)
+            leader_lease_ttl=number('LEADER_LEASE_TTL', '0'),
+            # Адрес сервера Bot API (пусто — api.telegram.org)
+            bot_api_url=config_data.get('BOT_API_URL', '').rstrip('/'),
+            # Снимки WG_CONFIG_PATH и WG_CLIENTS_DIR перед изменениями (пусто — рядом с базой состояния)
+            snapshot_dir=config_data.get('SNAPSHOT_DIR', ''),
+            snapshot_keep=number('SNAPSHOT_KEEP', '50'),
+            # Журнал аудита (пусто — рядом с базой состояния)
+            audit_dir=config_data.get('AUDIT_DIR', ''),
+        )
+        if errors:
+            raise ConfigError("\n".join(errors))
+        return settings
+
+    def validate(self, ssh=False, require_token=True):
+        """Проверяет параметры, собирая все ошибки в одно исключение ConfigError"""
+        errors = []
+        if require_token and not self.bot_token:
+            errors.append("token: не задан токен Telegram бота")
+        if not (len(self.access_pin) == 6 and self.access_pin.isdigit()):
+            errors.append("ACCESS_PIN: PIN должен состоять из 6 цифр")
+        if not _is_host(self.wg_server_ip):
+            errors.append(f"WG_SERVER_IP: некорректный адрес сервера '{self.wg_server_ip}'")
+        errors += _check_port('WG_SERVER_PORT', self.wg_server_port)
+        errors += _check_key('SERVER_PUB_KEY', self.wg_server_public_key, required=True)
+        errors += _check_key('SERVER_PRIV_KEY', self.wg_server_private_key, required=False)
+        if not _INTERFACE_RE.match(self.wg_interface):
+            errors.append(f"WG_INTERFACE: некорректное имя интерфейса '{self.wg_interface}'")
+        for key, path in (('WG_CONFIG_PATH', self.wg_config_path), ('WG_CLIENTS_DIR', self.wg_clients_dir)):
+            if not path:
+                errors.append(f"{key}: путь не задан")
+        for network in _split_list(self.client_allowed_ips):
+            try:
+                ipaddress.ip_network(network, strict=False)
+            except ValueError:
+                errors.append(f"CLIENT_ALLOWED_IPS: некорректная подсеть '{network}'")
+        if not _split_list(self.client_allowed_ips):
+            errors.append("CLIENT_ALLOWED_IPS: список подсетей пуст")
+        for server in _split_list(self.client_dns):
+            if not _is_host(server):
+                errors.append(f"CLIENT_DNS: некорректный DNS сервер '{server}'")
+        if not self.state_db_path:
+            errors.append("STATE_DB_PATH: путь не задан")
+        if self.deploy_workers < 1:
+            errors.append("DEPLOY_WORKERS: нужен хотя бы один обработчик")
+        if self.reconcile_interval < 0:
+            errors.append("RECONCILE_INTERVAL: интервал не может быть отрицательным")
+        if not 1 <= self.send_rate_global <= 30:
+            errors.append("SEND_RATE_GLOBAL: допустимо от 1 до 30 сообщений в секунду")
+        if self.send_rate_chat < 1:
+            errors.append("SEND_RATE_CHAT: нужно хотя бы одно сообщение в секунду")
+        if self.user_quota < 0:
+            errors.append("USER_QUOTA: лимит не может быть отрицательным")
+        if self.expiry_window < 1:
+            errors.append("EXPIRY_WINDOW: окно должно быть не меньше секунды")
+        if self.leader_lease_ttl and self.leader_lease_ttl < 3:
+            errors.append("LEADER_LEASE_TTL: срок аренды должен быть 0 или не меньше 3 секунд")
+        if self.bot_api_url and not self.bot_api_url.startswith(('http://', 'https://')):
+            errors.append(f"BOT_API_URL: ожидается адрес http(s)://, получено '{self.bot_api_url}'")
+        if self.snapshot_keep < 0:
+            errors.append("SNAPSHOT_KEEP: число снимков не может быть отрицательным")
+        if ssh:
+            if not _is_host(self.ssh_host):
+                errors.append(f"SSH_HOST: некорректный адрес '{self.ssh_host}'")
+            errors += _check_port('SSH_PORT', self.ssh_port)
+            if not self.ssh_username:
+                errors.append("SSH_USERNAME: не задан пользователь")
+            if self.ssh_key_path and not os.path.isfile(self.ssh_key_path):
+                errors.append(f"SSH_KEY_PATH: файл ключа '{self.ssh_key_path}' не найден")
+        if errors:
+            raise ConfigError("\n".join(errors))
+        return self
+
+    @property
+    def snapshot_path(self):
+        """Каталог снимков: SNAPSHOT_DIR или wg_snapshots рядом с базой состояния"""
+        return self.snapshot_dir or os.path.join(os.path.dirname(os.path.abspath(self.state_db_path)), 'wg_snapshots')
+
+    @property
+    def audit_path(self):
+        """Каталог журнала аудита: AUDIT_DIR или wg_audit рядом с базой состояния"""
+        return self.audit_dir or os.path.join(os.path.dirname(os.path.abspath(self.state_db_path)), 'wg_audit')
+
+    @property
+    def endpoint(self):
+        """Endpoint сервера для клиентского конфига (IPv6 в квадратных скобках)"""
+        try:
+            if ipaddress.ip_address(self.wg_server_ip).version == 6:
+                return f"[{self.wg_server_ip}]:{self.wg_server_port}"
+        except ValueError:
+            pass
+        return f"{self.wg_server_ip}:{self.wg_server_port}"
+
+
+def _split_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _is_host(value):
+    if not value or value == PLACEHOLDER_HOST:
+        return False
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return bool(_HOSTNAME_RE.match(value))
+
+
+def _check_port(key, value):
+    if not 1 <= value <= 65535:
+        return [f"{key}: порт должен быть в диапазоне 1-65535, получено {value}"]
+    return []
+
+
+def _check_key(key, value, required):
+    if not value:
+        return [f"{key}: ключ не задан"] if required else []
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return [f"{key}: ключ должен быть в base64"]
+    if len(raw) != 32:
+        return [f"{key}: ключ должен занимать 32 байта, получено {len(raw)}"]
+    return []
+
 
 # Загрузка параметров из файла
-def load_config_from_file():
+def load_config_from_file(path=None):
+    path = path or CONFIG_FILE
     config = {}
     try:
-        with open('api_token.txt', 'r') as f:
+        with open(path, 'r') as f:
             for line in f:
                 line = line.strip()
                 if line and not line.startswith('#'):
@@ -12,36 +259,19 @@ def load_config_from_file():
                         key, value = line.split('=', 1)
                         config[key.strip()] = value.strip()
     except FileNotFoundError:
-        raise FileNotFoundError("Файл api_token.txt не найден!")
+        raise FileNotFoundError(f"Файл {path} не найден!")
     return config
 
-# Загружаем конфигурацию
-config_data = load_config_from_file()
-
-# Telegram Bot настройки
-BOT_TOKEN = config_data.get('token', '').replace('token = ', '')
-
-# PIN код для доступа (6 цифр)
-ACCESS_PIN = config_data.get('ACCESS_PIN', '123456')  # Измените на свой PIN
-
-# WireGuard сервер настройки
-WG_SERVER_IP = config_data.get('WG_SERVER_IP', 'YOUR_SERVER_IP')  # Внешний IP сервера
-WG_SERVER_PORT = int(config_data.get('WG_SERVER_PORT', '65338'))  # Порт WireGuard
-WG_SERVER_PUBLIC_KEY = config_data.get('SERVER_PUB_KEY', '')  # Публичный ключ сервера
-WG_SERVER_PRIVATE_KEY = config_data.get('SERVER_PRIV_KEY', '')  # Приватный ключ сервера
-
-# SSH настройки для подключения к серверу
-SSH_HOST = config_data.get('SSH_HOST', 'YOUR_SERVER_IP')
-SSH_PORT = int(config_data.get('SSH_PORT', '22'))
-SSH_USERNAME = config_data.get('SSH_USERNAME', 'root')  # или ваш пользователь
-SSH_PASSWORD = config_data.get('SSH_PASSWORD', 'your_password')  # или путь к SSH ключу
-SSH_KEY_PATH = config_data.get('SSH_KEY_PATH', None)  # Путь к SSH ключу, если используете
-
-# WireGuard настройки
-WG_INTERFACE = config_data.get('WG_INTERFACE', 'wg0')
-WG_CONFIG_PATH = config_data.get('WG_CONFIG_PATH', '/etc/wireguard/wg0.conf')
-WG_CLIENTS_DIR = config_data.get('WG_CLIENTS_DIR', '/etc/wireguard/clients')
+def load_settings(path=None, ssh=False, require_token=True):
+    """Читает и проверяет конфигурацию; вызывается один раз при запуске бота"""
+    global _current
+    settings = Settings.from_dict(load_config_from_file(path))
+    settings.validate(ssh=ssh, require_token=require_token)
+    _current = settings
+    return settings
 
-# Настройки клиентов
-CLIENT_DNS = config_data.get('CLIENT_DNS', '1.1.1.1, 1.0.0.1')
-CLIENT_ALLOWED_IPS = config_data.get('CLIENT_ALLOWED_IPS', '0.0.0.0/0,::/0') 
\ No newline at end of file
+def get_settings(ssh=False):
+    """Параметры, загруженные load_settings (при первом обращении загружаются и проверяются из CONFIG_FILE)"""
+    if _current is None:
+        load_settings(ssh=ssh)
+    return _current
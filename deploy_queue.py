@@ -0,0 +1,373 @@
+"""Очередь развертывания клиентов с журналом в SQLite (WAL).
+
+Задание фиксируется в базе вместе с ключами и выделенным адресом до того,
+как на сервере что-то меняется, поэтому пользователь получает конфигурацию
+сразу, а развертывание продолжается в фоне. Шаги задания идемпотентны:
+после падения процесса незавершенные задания повторяются при запуске с тем
+же адресом, и адреса не теряются.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+import storage
+from ownership import OwnershipIndex, QuotaExceeded
+
+logger = logging.getLogger(__name__)
+
+# Состояния задания; каждое фиксируется после успешного шага
+QUEUED = 'queued'                  # ключи и адрес выделены
+CLIENT_WRITTEN = 'client_written'  # файл клиента записан в WG_CLIENTS_DIR
+PEER_ADDED = 'peer_added'          # пир добавлен в WG_CONFIG_PATH
+DONE = 'done'                      # интерфейс синхронизирован
+FAILED = 'failed'                  # попытки исчерпаны; повторяется после перезапуска бота
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deploy_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    public_key TEXT NOT NULL,
+    client_ip TEXT NOT NULL,
+    client_ipv6 TEXT,
+    client_config TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS deploy_jobs_pending_name
+    ON deploy_jobs (client_name) WHERE state != 'done';
+CREATE INDEX IF NOT EXISTS deploy_jobs_state ON deploy_jobs (state);
+"""
+
+# Сколько хранить завершенные задания
+DONE_RETENTION = 7 * 24 * 3600
+# Как часто удалять завершенные задания старше DONE_RETENTION в работающем процессе
+PRUNE_INTERVAL = 3600
+
+
+class DeployQueue:
+    def __init__(self, wg_manager, db_path, workers=1, batch_size=50,
+                 retry_delay=1.0, max_retry_delay=60.0, max_attempts=10, snapshots=None, audit_log=None):
+        self.wg_manager = wg_manager
+        self.db = storage.open_db(db_path)
+        self.db.executescript(SCHEMA)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        # Одно соединение на все потоки
+        self.db_lock = threading.Lock()
+        # Выделение адресов должно видеть все незавершенные задания
+        self.allocation_lock = threading.Lock()
+        # Изменения WG_CONFIG_PATH и интерфейса выполняются по одному
+        self.server_lock = threading.RLock()
+        self._active = set()
+        # Когда можно повторить задание после ошибки: id -> time.monotonic()
+        self._retry_at = {}
+        # Вызывается с (имена клиентов, ошибка), когда задания переходят в FAILED (например, уведомить администраторов)
+        self.on_failed = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+        self._pruned_at = None
+        # Владельцы клиентов: имя закрепляется в той же транзакции, что и задание
+        self.owners = OwnershipIndex(self.db, self.db_lock)
+        # Снимки состояния перед изменениями сервера (None — отключены)
+        self.snapshots = snapshots
+        if snapshots is not None:
+            # Снимок хранит и владельцев со сроками, чтобы откат не делал временных клиентов постоянными
+            snapshots.owners = self.owners
+        # Журнал аудита (None — отключен)
+        self.audit_log = audit_log
+
+    def start(self):
+        """Запускает фоновые обработчики; незавершенные задания подхватываются сразу"""
+        self._prune_done()
+        with self.db_lock:
+            # Проваленные задания повторяются после перезапуска (например, когда администратор устранил причину)
+            retried = self.db.execute("UPDATE deploy_jobs SET state = ?, attempts = 0 WHERE state = ?",
+                                      (QUEUED, FAILED)).rowcount
+            pending = self.db.execute("SELECT COUNT(*) FROM deploy_jobs WHERE state != ?", (DONE,)).fetchone()[0]
+        if retried:
+            logger.info(f"Повтор проваленных заданий развертывания: {retried}")
+        if pending:
+            logger.info(f"Возобновление {pending} незавершенных заданий развертывания")
+        self._stopped.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"deploy-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=10):
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, client_name, user_id=None, quota=0, expires_at=None):
+        """Ставит создание клиента в очередь.
+
+        Возвращает (конфигурация, ошибка) сразу после фиксации задания;
+        изменения на сервере выполняются фоновыми обработчиками. Имя
+        закрепляется за user_id, quota ограничивает число его клиентов (0 — без лимита),
+        expires_at — срок действия временного клиента (unix time).
+        """
+        try:
+            private_key, public_key = self.wg_manager.generate_key_pair()
+            with self.allocation_lock:
+                client_ip, client_ipv6 = self.wg_manager.get_next_client_ip(reserved_ips=self.reserved_ips())
+                if not client_ip:
+                    return None, "Не удалось получить IP адрес"
+                client_config = self.wg_manager.create_client_config(
+                    client_name, private_key, public_key, client_ip, client_ipv6
+                )
+                now = time.time()
+                with self.db_lock, storage.transaction(self.db):
+                    self.owners.reserve(client_name, user_id, quota, expires_at)
+                    self.db.execute(
+                        "INSERT INTO deploy_jobs (client_name, state, public_key, client_ip, client_ipv6,"
+                        " client_config, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (client_name, QUEUED, public_key, client_ip, client_ipv6, client_config, now, now),
+                    )
+        except sqlite3.IntegrityError:
+            return None, f"Конфигурация с именем '{client_name}' уже существует"
+        except QuotaExceeded as e:
+            return None, str(e)
+        except Exception as e:
+            return None, f"Ошибка создания конфигурации: {e}"
+        self._wakeup.set()
+        return client_config, None
+
+    def reserved_ips(self):
+        """Адреса незавершенных заданий (их файлов клиентов еще может не быть)"""
+        with self.db_lock:
+            rows = self.db.execute("SELECT client_ip FROM deploy_jobs WHERE state != ?", (DONE,)).fetchall()
+        return [row['client_ip'] for row in rows]
+
+    def pending_names(self):
+        with self.db_lock:
+            rows = self.db.execute("SELECT client_name FROM deploy_jobs WHERE state != ?", (DONE,)).fetchall()
+        return {row['client_name'] for row in rows}
+
+    def is_pending(self, client_name):
+        with self.db_lock:
+            row = self.db.execute("SELECT 1 FROM deploy_jobs WHERE client_name = ? AND state != ?",
+                                  (client_name, DONE)).fetchone()
+        return row is not None
+
+    def get_pending_config(self, client_name):
+        """Конфигурация клиента, чье развертывание еще не завершено, или None"""
+        with self.db_lock:
+            row = self.db.execute("SELECT client_config FROM deploy_jobs WHERE client_name = ? AND state != ?",
+                                  (client_name, DONE)).fetchone()
+        return row['client_config'] if row else None
+
+    def snapshot(self, reason):
+        """Снимок WG_CONFIG_PATH и WG_CLIENTS_DIR перед изменением; вызывается под server_lock.
+
+        Ошибка снимка записывается в журнал и не останавливает изменение.
+        """
+        if self.snapshots is None:
+            return None
+        try:
+            return self.snapshots.take(reason)
+        except Exception as e:
+            logger.error(f"Не удалось сделать снимок ({reason}): {e}")
+            return None
+
+    def audit(self, event, user_id=None, client=None, **details):
+        """Событие в журнал аудита, если он включен"""
+        if self.audit_log is not None:
+            self.audit_log.record(event, user_id, client, **details)
+
+    def rollback(self, snapshot_id):
+        """Откатывает сервер и индекс владельцев к снимку; возвращает (id снимка до отката, записано, удалено файлов).
+
+        Сроки временных клиентов возвращаются вместе с ними: планировщику сроков
+        нужно перечитать их из базы (ExpiryScheduler.reload).
+        """
+        with self.server_lock:
+            # Клиенты, которых сейчас разворачивает очередь, остаются как есть
+            with self.db_lock:
+                jobs = self.db.execute(
+                    "SELECT client_name, state, public_key, client_ip FROM deploy_jobs WHERE state != ?", (DONE,)
+                ).fetchall()
+            pending = {job['client_name'] for job in jobs}
+            # Владельцы читаются до отката: после него старые снимки могут быть удалены
+            owners = self.snapshots.owners_at(snapshot_id)
+            result = self.snapshots.restore(snapshot_id, keep=pending)
+            # Уже добавленные пиры незавершенных заданий возвращаются в восстановленный конфиг
+            peers = [(job['client_name'], job['public_key'], job['client_ip'])
+                     for job in jobs if job['state'] in (CLIENT_WRITTEN, PEER_ADDED)]
+            if peers:
+                self.wg_manager.append_peers(peers)
+            self.wg_manager.sync_interface()
+            names = self.wg_manager.list_client_names()
+            if owners is None:
+                # Снимок сделан до того, как снимки стали хранить владельцев
+                added, removed = self.owners.sync(names, keep=pending, allow_empty=True)
+            else:
+                added, removed = self.owners.restore(owners, names, keep=pending)
+        if added or removed:
+            logger.info(f"Индекс владельцев после отката: добавлено {added}, удалено {removed}")
+        return result
+
+    def failed_jobs(self):
+        """[(имя клиента, последняя ошибка)] заданий, исчерпавших попытки"""
+        with self.db_lock:
+            rows = self.db.execute("SELECT client_name, last_error FROM deploy_jobs WHERE state = ? ORDER BY id",
+                                   (FAILED,)).fetchall()
+        return [(row['client_name'], row['last_error']) for row in rows]
+
+    def _in_progress(self):
+        with self.db_lock:
+            return self.db.execute("SELECT COUNT(*) FROM deploy_jobs WHERE state NOT IN (?, ?)",
+                                   (DONE, FAILED)).fetchone()[0]
+
+    def wait_idle(self, timeout=None, interval=0.05):
+        """Ждет завершения всех заданий, кроме проваленных (для бенчмарков и остановки)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._in_progress():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    def _claim(self):
+        """Берет пачку заданий; задания, ожидающие повтора после ошибки, пропускаются"""
+        now = time.monotonic()
+        with self.db_lock:
+            waiting = {job_id for job_id, retry_at in self._retry_at.items() if retry_at > now}
+            rows = self.db.execute(
+                "SELECT * FROM deploy_jobs WHERE state NOT IN (?, ?) ORDER BY id LIMIT ?",
+                (DONE, FAILED, self.batch_size + len(self._active) + len(waiting)),
+            ).fetchall()
+            jobs = [dict(row) for row in rows
+                    if row['id'] not in self._active and row['id'] not in waiting][:self.batch_size]
+            self._active.update(job['id'] for job in jobs)
+            for job in jobs:
+                self._retry_at.pop(job['id'], None)
+        return jobs
+
+    def _next_retry(self):
+        """Через сколько секунд появится задание, ожидающее повтора (или None)"""
+        with self.db_lock:
+            if not self._retry_at:
+                return None
+            return max(min(self._retry_at.values()) - time.monotonic(), 0)
+
+    def _prune_done(self):
+        """Удаляет завершенные задания старше DONE_RETENTION (при запуске и раз в PRUNE_INTERVAL)"""
+        with self.db_lock, storage.transaction(self.db):
+            self.db.execute("DELETE FROM deploy_jobs WHERE state = ? AND updated_at < ?",
+                            (DONE, time.time() - DONE_RETENTION))
+            # Задания, завершенные до очистки конфигураций при DONE, не должны хранить приватные ключи
+            self.db.execute("UPDATE deploy_jobs SET client_config = '' WHERE state = ? AND client_config != ''",
+                            (DONE,))
+            self._pruned_at = time.monotonic()
+
+    def _release(self, jobs):
+        with self.db_lock:
+            self._active.difference_update(job['id'] for job in jobs)
+
+    def _set_state(self, jobs, state):
+        now = time.time()
+        # Конфигурация с приватным ключом нужна только до развертывания: дальше она в WG_CLIENTS_DIR
+        clear_config = ", client_config = ''" if state == DONE else ""
+        with self.db_lock, storage.transaction(self.db):
+            self.db.executemany(
+                f"UPDATE deploy_jobs SET state = ?, last_error = NULL, updated_at = ?{clear_config} WHERE id = ?",
+                [(state, now, job['id']) for job in jobs],
+            )
+        for job in jobs:
+            job['state'] = state
+
+    def _record_error(self, jobs, error):
+        """Записывает неудачную попытку; задания, исчерпавшие max_attempts, переводятся в FAILED"""
+        now = time.time()
+        for job in jobs:
+            job['attempts'] += 1
+        failed = [job for job in jobs if job['attempts'] >= self.max_attempts]
+        retry = [job for job in jobs if job['attempts'] < self.max_attempts]
+        with self.db_lock, storage.transaction(self.db):
+            self.db.executemany(
+                "UPDATE deploy_jobs SET attempts = ?, last_error = ?, updated_at = ?, state = ? WHERE id = ?",
+                [(job['attempts'], str(error), now, FAILED if job in failed else job['state'], job['id'])
+                 for job in jobs],
+            )
+            # Повтор с экспоненциальной задержкой по числу попыток, не задерживая остальные задания
+            for job in retry:
+                delay = min(self.retry_delay * 2 ** (job['attempts'] - 1), self.max_retry_delay)
+                self._retry_at[job['id']] = time.monotonic() + delay
+        for job in failed:
+            job['state'] = FAILED
+            logger.error(f"Развертывание '{job['client_name']}' не удалось после {job['attempts']} попыток: {error}")
+            self.audit('deploy_failed', client=job['client_name'], error=str(error))
+        if failed and self.on_failed is not None:
+            try:
+                self.on_failed([job['client_name'] for job in failed], error)
+            except Exception as e:
+                logger.error(f"Не удалось сообщить о проваленном развертывании: {e}")
+
+    def _process(self, jobs):
+        """Выполняет оставшиеся шаги пачки заданий: файлы, пиры одной записью, одна синхронизация"""
+        if any(job['state'] in (QUEUED, CLIENT_WRITTEN) for job in jobs):
+            with self.server_lock:
+                self.snapshot("развертывание")
+        for job in jobs:
+            if job['state'] == QUEUED:
+                # Ошибка записи одного файла не останавливает остальные задания пачки
+                try:
+                    self.wg_manager.write_client_config(job['client_name'], job['client_config'])
+                except Exception as e:
+                    logger.error(f"Ошибка записи файла клиента '{job['client_name']}': {e}")
+                    self._record_error([job], e)
+                    continue
+                self._set_state([job], CLIENT_WRITTEN)
+
+        with self.server_lock:
+            to_append = [job for job in jobs if job['state'] == CLIENT_WRITTEN]
+            if to_append:
+                self.wg_manager.append_peers(
+                    [(job['client_name'], job['public_key'], job['client_ip']) for job in to_append]
+                )
+                self._set_state(to_append, PEER_ADDED)
+
+            to_sync = [job for job in jobs if job['state'] == PEER_ADDED]
+            if to_sync:
+                self.wg_manager.sync_interface()
+                self._set_state(to_sync, DONE)
+                for job in to_sync:
+                    self.audit('deploy', client=job['client_name'], ip=job['client_ip'])
+                logger.info(f"Развернуто клиентов: {len(to_sync)}")
+
+    def _worker(self):
+        while not self._stopped.is_set():
+            jobs = self._claim()
+            if not jobs:
+                if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+                    try:
+                        self._prune_done()
+                    except Exception as e:
+                        logger.error(f"Ошибка удаления завершенных заданий: {e}")
+                retry = self._next_retry()
+                self._wakeup.wait(timeout=5 if retry is None else min(retry, 5))
+                self._wakeup.clear()
+                continue
+            try:
+                self._process(jobs)
+            except Exception as e:
+                # Общий шаг пачки (конфиг сервера, синхронизация): ошибка засчитывается всем ее заданиям
+                # (задания с неудавшейся записью файла остались QUEUED, их ошибка уже записана)
+                unfinished = [job for job in jobs if job['state'] in (CLIENT_WRITTEN, PEER_ADDED)]
+                logger.error(f"Ошибка развертывания ({len(unfinished)} заданий): {e}")
+                if unfinished:
+                    self._record_error(unfinished, e)
+            finally:
+                self._release(jobs)
@@ -0,0 +1,132 @@
+"""Истечение срока действия временных конфигураций.
+
+Один фоновый поток и min-heap сроков: сколько бы ни было временных клиентов,
+ждет только ближайший срок. Сроки округляются вверх до границы окна
+(EXPIRY_WINDOW секунд), и все клиенты, истекшие к этой границе, удаляются
+одной пачкой: одна запись WG_CONFIG_PATH, одна команда удаления файлов и одна
+синхронизация интерфейса. Сроки хранятся в индексе владельцев, поэтому после
+перезапуска куча восстанавливается из базы.
+"""
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+
+from wireguard_manager import remove_peers
+
+logger = logging.getLogger(__name__)
+
+_TTL_RE = re.compile(r'^(\d+)([mhdw])$')
+_TTL_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_ttl(value):
+    """Срок вида 30m, 12h, 7d, 2w в секундах или None, если формат неверный"""
+    match = _TTL_RE.match(value.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * _TTL_UNITS[match.group(2)]
+
+
+class ExpiryScheduler:
+    def __init__(self, wg_manager, deploy_queue, window=60, retry_delay=60.0):
+        self.wg_manager = wg_manager
+        self.deploy_queue = deploy_queue
+        self.window = window
+        self.retry_delay = retry_delay
+        self._heap = []
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        """Загружает сроки из базы и запускает поток; просроченные за время простоя удаляются сразу"""
+        with self._condition:
+            self._heap = self.deploy_queue.owners.expiries()
+            heapq.heapify(self._heap)
+            self._stopped = False
+        if self._heap:
+            logger.info(f"Временных конфигураций: {len(self._heap)}")
+        self._thread = threading.Thread(target=self._run, name="expiry-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def reload(self):
+        """Перечитывает сроки из базы (после отката индекс владельцев меняется целиком)"""
+        with self._condition:
+            self._heap = self.deploy_queue.owners.expiries()
+            heapq.heapify(self._heap)
+            self._condition.notify()
+
+    def schedule(self, client_name, expires_at):
+        with self._condition:
+            heapq.heappush(self._heap, (expires_at, client_name))
+            # Поток пересчитывает ожидание, только если срок стал ближайшим
+            if self._heap[0] == (expires_at, client_name):
+                self._condition.notify()
+
+    def _deadline(self):
+        """Граница окна, к которой относится ближайший срок"""
+        return math.ceil(self._heap[0][0] / self.window) * self.window
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if self._heap:
+                        wait = self._deadline() - time.time()
+                        if wait <= 0:
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+                if self._stopped:
+                    return
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    heapq.heappop(self._heap)
+            try:
+                self.expire_due(now)
+            except Exception as e:
+                logger.error(f"Ошибка удаления временных конфигураций, повтор через {self.retry_delay:.0f} с: {e}")
+                self.schedule('', now + self.retry_delay)
+
+    def expire_due(self, now=None):
+        """Удаляет всех клиентов, чей срок истек к now, одним применением; возвращает их имена"""
+        now = time.time() if now is None else now
+        with self.deploy_queue.server_lock:
+            pending = self.deploy_queue.pending_names()
+            expired = self.deploy_queue.owners.expired(now)
+            names = [name for name in expired if name not in pending]
+            if len(names) < len(expired):
+                # Клиента, которого еще разворачивает очередь, удалим в следующем окне
+                self.schedule('', now + self.window)
+            if not names:
+                return []
+            self.deploy_queue.snapshot("истечение срока")
+            # Владельцы для журнала аудита: записи индекса удаляются ниже
+            owners = {name: self.deploy_queue.owners.owner_of(name) for name in names}
+            server_config, removed = remove_peers(self.wg_manager.read_server_config(), names)
+            if removed:
+                self.wg_manager.write_server_config(server_config)
+            # Без файла клиента сверка не вернет пир обратно
+            self.wg_manager.remove_client_configs(names)
+            # Синхронизация и при пустом removed: если прошлая попытка упала на ней,
+            # пиров уже нет в конфиге, но в интерфейсе они еще работают
+            self.wg_manager.sync_interface()
+            self.deploy_queue.owners.remove(names)
+        for name in names:
+            self.deploy_queue.audit('expire', owners[name], name)
+        logger.info(f"Истек срок действия конфигураций ({len(names)}): {', '.join(sorted(names))}")
+        return names
+
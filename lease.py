@@ -0,0 +1,96 @@
+"""Аренда лидерства для режима active/standby.
+
+Несколько экземпляров бота на одной машине работают с одной базой состояния
+(WAL не работает на сетевых файловых системах). Лидер (тот, кто держит
+аренду) опрашивает Telegram и развертывает клиентов, остальные ждут. Лидер продлевает аренду каждые ttl/3 секунд; если он упал или завис,
+аренда истекает через ttl секунд и ее забирает резервный экземпляр.
+Лидер, не сумевший продлить аренду до ее истечения, останавливается сам,
+чтобы два экземпляра не работали одновременно.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class LeaderLease:
+    def __init__(self, db_path, ttl=10, name='bot', holder=None):
+        self.db = storage.open_db(db_path)
+        self.db.executescript(SCHEMA)
+        self.ttl = ttl
+        self.name = name
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self.expires_at = 0.0
+        self.lost = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def try_acquire(self):
+        """Берет или продлевает аренду; False, если ее держит другой экземпляр"""
+        now = time.time()
+        with storage.transaction(self.db):
+            row = self.db.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (self.name,)).fetchone()
+            if row and row['holder'] != self.holder and row['expires_at'] > now:
+                return False
+            self.db.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at",
+                (self.name, self.holder, now + self.ttl),
+            )
+        self.expires_at = now + self.ttl
+        return True
+
+    def current_holder(self):
+        row = self.db.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (self.name,)).fetchone()
+        return row['holder'] if row and row['expires_at'] > time.time() else None
+
+    def wait(self, poll_interval=1.0):
+        """Блокирует, пока аренда не достанется этому экземпляру"""
+        while not self.try_acquire():
+            time.sleep(poll_interval)
+        logger.info(f"Аренда лидерства получена: {self.holder}")
+        return self
+
+    def keep_alive(self, on_lost):
+        """Продлевает аренду в фоне; on_lost вызывается, если продлить не удалось"""
+        self._thread = threading.Thread(target=self._renew, args=(on_lost,), name="leader-lease", daemon=True)
+        self._thread.start()
+        return self
+
+    def _renew(self, on_lost):
+        while not self._stopped.wait(self.ttl / 3):
+            try:
+                if self.try_acquire():
+                    continue
+                logger.error("Аренда лидерства перехвачена другим экземпляром")
+            except Exception as e:
+                # База временно занята: аренда еще действует, попробуем снова
+                if time.time() < self.expires_at - self.ttl / 3:
+                    logger.warning(f"Не удалось продлить аренду лидерства: {e}")
+                    continue
+                logger.error(f"Аренда лидерства истекает и не продлена: {e}")
+            self.lost = True
+            on_lost()
+            return
+
+    def release(self):
+        """Освобождает аренду, чтобы резервный экземпляр подхватил работу сразу"""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(self.ttl)
+            self._thread = None
+        if not self.lost:
+            self.db.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
@@ -0,0 +1,184 @@
+"""Индекс владельцев конфигураций в базе состояния.
+
+Для каждого клиента хранится id пользователя Telegram, который его создал.
+Индекс по (user_id, client_name) дает список клиентов пользователя за O(k),
+первичный ключ по имени — проверку занятости имени без обращения к файлам.
+Клиенты, созданные до появления индекса или вручную, попадают в него при
+синхронизации с WG_CLIENTS_DIR без владельца; их выдает только администратор,
+он же назначает им владельца (/owner). Для временных клиентов здесь же
+хранится срок действия (expires_at), по нему работает планировщик expiry.py.
+"""
+import logging
+import time
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS client_owners (
+    client_name TEXT PRIMARY KEY,
+    user_id INTEGER,
+    created_at REAL NOT NULL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS client_owners_user ON client_owners (user_id, client_name);
+"""
+
+EXPIRY_INDEX = """
+CREATE INDEX IF NOT EXISTS client_owners_expiry ON client_owners (expires_at) WHERE expires_at IS NOT NULL;
+"""
+
+
+class QuotaExceeded(Exception):
+    """Пользователь достиг лимита конфигураций"""
+
+    def __init__(self, quota):
+        super().__init__(f"Достигнут лимит конфигураций на пользователя: {quota}")
+        self.quota = quota
+
+
+class OwnershipIndex:
+    """Таблица client_owners; использует соединение и блокировку очереди развертывания"""
+
+    def __init__(self, db, db_lock):
+        self.db = db
+        self.db_lock = db_lock
+        self.db.executescript(SCHEMA)
+        columns = {row['name'] for row in self.db.execute("PRAGMA table_info(client_owners)")}
+        if 'expires_at' not in columns:
+            # База создана до появления временных конфигураций
+            self.db.execute("ALTER TABLE client_owners ADD COLUMN expires_at REAL")
+        self.db.executescript(EXPIRY_INDEX)
+
+    def reserve(self, client_name, user_id, quota=0, expires_at=None):
+        """Закрепляет имя за пользователем с проверкой лимита.
+
+        Вызывается внутри транзакции под db_lock (вместе с постановкой задания),
+        при занятом имени выбрасывает sqlite3.IntegrityError.
+        """
+        if quota and user_id is not None:
+            count = self.db.execute("SELECT COUNT(*) FROM client_owners WHERE user_id = ?", (user_id,)).fetchone()[0]
+            if count >= quota:
+                raise QuotaExceeded(quota)
+        self.db.execute("INSERT INTO client_owners (client_name, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                        (client_name, user_id, time.time(), expires_at))
+
+    def exists(self, client_name):
+        with self.db_lock:
+            row = self.db.execute("SELECT 1 FROM client_owners WHERE client_name = ?", (client_name,)).fetchone()
+        return row is not None
+
+    def owner_of(self, client_name):
+        """id создателя клиента или None (клиент без владельца или не найден)"""
+        with self.db_lock:
+            row = self.db.execute("SELECT user_id FROM client_owners WHERE client_name = ?", (client_name,)).fetchone()
+        return row['user_id'] if row else None
+
+    def clients_of(self, user_id):
+        """[(имя, время создания, срок действия или None, состояние незавершенного задания или None)] клиентов пользователя"""
+        with self.db_lock:
+            rows = self.db.execute(
+                "SELECT o.client_name, o.created_at, o.expires_at, j.state AS job_state FROM client_owners o"
+                " LEFT JOIN deploy_jobs j ON j.client_name = o.client_name AND j.state != 'done'"
+                " WHERE o.user_id = ? ORDER BY o.client_name",
+                (user_id,),
+            ).fetchall()
+        return [(row['client_name'], row['created_at'], row['expires_at'], row['job_state']) for row in rows]
+
+    def expiries(self):
+        """[(срок действия, имя)] всех временных клиентов"""
+        with self.db_lock:
+            rows = self.db.execute(
+                "SELECT expires_at, client_name FROM client_owners WHERE expires_at IS NOT NULL"
+            ).fetchall()
+        return [(row['expires_at'], row['client_name']) for row in rows]
+
+    def expired(self, now):
+        """Имена клиентов со сроком действия до now (по индексу)"""
+        with self.db_lock:
+            rows = self.db.execute(
+                "SELECT client_name FROM client_owners WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            ).fetchall()
+        return [row['client_name'] for row in rows]
+
+    def assign(self, client_name, user_id):
+        """Назначает владельца клиенту из индекса; False, если клиент не найден"""
+        with self.db_lock, storage.transaction(self.db):
+            updated = self.db.execute("UPDATE client_owners SET user_id = ? WHERE client_name = ?",
+                                      (user_id, client_name)).rowcount
+        return updated > 0
+
+    def remove(self, client_names):
+        with self.db_lock, storage.transaction(self.db):
+            self.db.executemany("DELETE FROM client_owners WHERE client_name = ?", [(n,) for n in client_names])
+
+    def entries(self):
+        """[(имя, user_id, время создания, срок)] всех клиентов по имени (для снимков)"""
+        with self.db_lock:
+            rows = self.db.execute(
+                "SELECT client_name, user_id, created_at, expires_at FROM client_owners ORDER BY client_name"
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def restore(self, entries, client_names, keep=()):
+        """Возвращает индекс к снимку после отката; возвращает (добавлено, удалено).
+
+        Клиентам из client_names (файлы после отката) возвращаются владелец и
+        срок из entries ({имя: (user_id, время создания, срок)}), клиенты без
+        записи в снимке добавляются без владельца. Остальные записи удаляются,
+        кроме keep и клиентов с незавершенным заданием развертывания.
+        """
+        names = set(client_names) - set(keep)
+        now = time.time()
+        with self.db_lock:
+            indexed = {row['client_name'] for row in self.db.execute("SELECT client_name FROM client_owners")}
+            stale = indexed - set(client_names) - set(keep)
+            with storage.transaction(self.db):
+                self.db.executemany(
+                    "INSERT INTO client_owners (client_name, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT(client_name) DO UPDATE SET user_id = excluded.user_id,"
+                    " created_at = excluded.created_at, expires_at = excluded.expires_at",
+                    [(name, *entries[name]) for name in names if name in entries],
+                )
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO client_owners (client_name, user_id, created_at) VALUES (?, NULL, ?)",
+                    [(name, now) for name in names if name not in entries],
+                )
+                removed = self.db.executemany(
+                    "DELETE FROM client_owners WHERE client_name = ? AND client_name NOT IN"
+                    " (SELECT client_name FROM deploy_jobs WHERE state != 'done')",
+                    [(name,) for name in stale],
+                ).rowcount
+        return len(names - indexed), max(removed, 0)
+
+    def sync(self, client_names, keep=(), allow_empty=False):
+        """Приводит индекс к списку файлов клиентов; возвращает (добавлено, удалено).
+
+        Имена из keep и клиенты с незавершенным заданием развертывания
+        (файла еще может не быть) не удаляются. Временные клиенты тоже не
+        удаляются: их запись снимет планировщик сроков. Пустой список при
+        непустом индексе (например, WG_CLIENTS_DIR не смонтирован) ничего не
+        удаляет, если не задан allow_empty.
+        """
+        names = set(client_names)
+        now = time.time()
+        with self.db_lock:
+            indexed = {row['client_name'] for row in self.db.execute("SELECT client_name FROM client_owners")}
+            added = names - indexed
+            stale = indexed - names - set(keep)
+            if not names and stale and not allow_empty:
+                logger.warning(f"Список файлов клиентов пуст, а в индексе владельцев {len(indexed)} клиентов: "
+                               f"индекс не очищается (проверьте WG_CLIENTS_DIR)")
+                stale = set()
+            with storage.transaction(self.db):
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO client_owners (client_name, user_id, created_at) VALUES (?, NULL, ?)",
+                    [(name, now) for name in added],
+                )
+                removed = self.db.executemany(
+                    "DELETE FROM client_owners WHERE client_name = ? AND expires_at IS NULL AND client_name NOT IN"
+                    " (SELECT client_name FROM deploy_jobs WHERE state != 'done')",
+                    [(name,) for name in stale],
+                ).rowcount
+        return len(added), max(removed, 0)
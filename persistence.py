@@ -0,0 +1,91 @@
+"""Хранение состояния диалогов (context.user_data) в базе состояния.
+
+Подключается к Application как persistence: PTB сохраняет изменившиеся
+user_data раз в update_interval секунд и при остановке, а при запуске
+загружает их обратно. Благодаря этому начатый диалог (ввод PIN, имени)
+продолжается после перезапуска или на резервном экземпляре.
+"""
+import json
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Сколько хранить незавершенные диалоги
+USER_DATA_RETENTION = 30 * 24 * 3600
+
+
+class SqlitePersistence(BasePersistence):
+    def __init__(self, db_path, update_interval=1):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = storage.open_db(db_path)
+        self.db.executescript(SCHEMA)
+
+    async def get_user_data(self):
+        self.db.execute("DELETE FROM user_data WHERE updated_at < ?", (time.time() - USER_DATA_RETENTION,))
+        return {row['user_id']: json.loads(row['data']) for row in self.db.execute("SELECT user_id, data FROM user_data")}
+
+    async def update_user_data(self, user_id, data):
+        if data:
+            self.db.execute(
+                "INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (user_id, json.dumps(data), time.time()),
+            )
+        else:
+            await self.drop_user_data(user_id)
+
+    async def drop_user_data(self, user_id):
+        self.db.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def flush(self):
+        pass
+
+    # Остальные виды данных бот не хранит
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
@@ -0,0 +1,269 @@
+"""Сверка трех источников состояния WireGuard.
+
+Источники: файлы клиентов (WG_CLIENTS_DIR/*.conf), блоки [Peer] в
+WG_CONFIG_PATH и работающий интерфейс (`wg show <iface> dump`). Для каждого
+строится словарь по имени/ключу, расхождения считаются разностями множеств
+за линейное время. Исправление выполняется одной атомарной записью
+серверного конфига и одной синхронизацией интерфейса.
+
+Файлы клиентов считаются эталоном: недостающие пиры добавляются, ключи
+исправляются по приватному ключу клиента. Пиры без файла клиента удаляются
+только при prune=True, пиры без комментария '# Client:' не трогаются.
+"""
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from wireguard_manager import parse_client_addresses, peer_block, public_key_from_private
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ServerPeer:
+    name: object
+    public_key: str
+    allowed_ips: frozenset
+    start: int        # первая строка блока (включая комментарий с именем)
+    end: int          # строка после блока
+    key_line: int
+
+
+@dataclass
+class ReconcileReport:
+    clients: int = 0
+    server_peers: int = 0
+    live_peers: object = None                       # None, если интерфейс недоступен
+    missing_peers: list = field(default_factory=list)    # есть файл клиента, нет пира в конфиге
+    orphan_peers: list = field(default_factory=list)     # есть пир с именем, нет файла клиента
+    unnamed_peers: int = 0                               # пиры без '# Client:' (не трогаем)
+    key_mismatches: list = field(default_factory=list)   # ключ в конфиге не совпадает с файлом
+    duplicate_ips: dict = field(default_factory=dict)    # IP -> имена клиентов/пиров
+    unreadable_clients: list = field(default_factory=list)
+    live_missing: int = 0                                # пир в конфиге, нет в интерфейсе
+    live_extra: int = 0                                  # пир в интерфейсе, нет в конфиге
+    live_mismatched: int = 0                             # AllowedIPs различаются
+    repaired: bool = False
+
+    @property
+    def config_drift(self):
+        return bool(self.missing_peers or self.key_mismatches or self.orphan_peers)
+
+    @property
+    def live_drift(self):
+        return bool(self.live_missing or self.live_extra or self.live_mismatched)
+
+    @property
+    def is_clean(self):
+        return not (self.config_drift or self.live_drift or self.duplicate_ips or self.unreadable_clients)
+
+    def summary(self):
+        lines = [
+            f"Клиентов: {self.clients}, пиров в конфиге: {self.server_peers}, "
+            f"в интерфейсе: {'недоступен' if self.live_peers is None else self.live_peers}"
+        ]
+        if self.is_clean:
+            lines.append("✅ Расхождений нет")
+            return "\n".join(lines)
+        if self.missing_peers:
+            lines.append(f"• Нет пира в конфиге сервера: {_names(self.missing_peers)}")
+        if self.key_mismatches:
+            lines.append(f"• Ключ не совпадает с файлом клиента: {_names(self.key_mismatches)}")
+        if self.orphan_peers:
+            lines.append(f"• Пир без файла клиента: {_names(self.orphan_peers)}")
+        if self.duplicate_ips:
+            dups = ", ".join(f"{ip} ({'/'.join(sorted(names))})" for ip, names in list(self.duplicate_ips.items())[:10])
+            lines.append(f"• Повторяющиеся IP: {dups}")
+        if self.unreadable_clients:
+            lines.append(f"• Не удалось разобрать файлы: {_names(self.unreadable_clients)}")
+        if self.live_drift:
+            lines.append(f"• Интерфейс расходится с конфигом: нет {self.live_missing}, "
+                         f"лишних {self.live_extra}, другие AllowedIPs {self.live_mismatched}")
+        if self.unnamed_peers:
+            lines.append(f"Пиров без имени (не проверяются): {self.unnamed_peers}")
+        if self.repaired:
+            lines.append("🔧 Исправлено: конфиг сервера перезаписан, интерфейс синхронизирован")
+        return "\n".join(lines)
+
+
+def _names(names, limit=20):
+    names = sorted(names)
+    text = ", ".join(names[:limit])
+    if len(names) > limit:
+        text += f" и еще {len(names) - limit}"
+    return text
+
+
+def parse_server_peers(server_config):
+    """Разбирает блоки [Peer] серверного конфига (с позициями строк для правки)"""
+    lines = server_config.split('\n')
+    peers = []
+    pending_name, pending_start = None, None
+    current = None
+
+    def close(index):
+        if current and current['public_key']:
+            peers.append(ServerPeer(current['name'], current['public_key'], frozenset(current['allowed_ips']),
+                                    current['start'], index, current['key_line']))
+
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith('# Client:'):
+            close(i)
+            current = None
+            pending_name, pending_start = stripped[len('# Client:'):].strip(), i
+        elif stripped.startswith('['):
+            close(i)
+            current = None
+            if stripped == '[Peer]':
+                current = {'name': pending_name, 'start': pending_start if pending_start is not None else i,
+                           'public_key': None, 'allowed_ips': [], 'key_line': None}
+            pending_name, pending_start = None, None
+        elif current is not None and '=' in stripped:
+            key, value = (part.strip() for part in stripped.split('=', 1))
+            if key == 'PublicKey':
+                current['public_key'], current['key_line'] = value, i
+            elif key == 'AllowedIPs':
+                current['allowed_ips'] += [ip.strip() for ip in value.split(',') if ip.strip()]
+    close(len(lines))
+    return peers
+
+
+def parse_live_peers(dump):
+    """{публичный ключ: AllowedIPs} из `wg show <iface> dump`"""
+    peers = {}
+    for line in dump.strip().split('\n'):
+        parts = line.split('\t')
+        # Первая строка описывает интерфейс (4 поля), строки пиров — 8 полей
+        if len(parts) >= 8:
+            allowed = parts[3]
+            peers[parts[0]] = frozenset() if allowed == '(none)' else frozenset(
+                ip.strip() for ip in allowed.split(',') if ip.strip())
+    return peers
+
+
+# Повторные сверки не пересчитывают публичные ключи неизменившихся клиентов
+_public_key = lru_cache(maxsize=65536)(public_key_from_private)
+
+
+def index_clients(client_configs, report):
+    """{имя: (публичный ключ, IPv4)} по файлам клиентов"""
+    clients = {}
+    for name, text in client_configs.items():
+        private_key = None
+        for line in text.split('\n'):
+            if line.startswith('PrivateKey'):
+                private_key = line.split('=', 1)[1].strip()
+                break
+        client_ip, _ = parse_client_addresses(text)
+        try:
+            clients[name] = (_public_key(private_key), client_ip)
+        except Exception:
+            report.unreadable_clients.append(name)
+    return clients
+
+
+def diff(client_configs, server_config, live_dump, exclude_names=()):
+    """Сравнивает источники; возвращает (отчет, пиры конфига, индекс клиентов)"""
+    report = ReconcileReport()
+    exclude = set(exclude_names)
+    clients = index_clients({n: t for n, t in client_configs.items() if n not in exclude}, report)
+    peers, excluded_keys = [], set()
+    for peer in parse_server_peers(server_config):
+        if peer.name in exclude:
+            excluded_keys.add(peer.public_key)
+        else:
+            peers.append(peer)
+    report.clients = len(clients)
+    report.server_peers = len(peers)
+
+    named = {}
+    for peer in peers:
+        if peer.name is None:
+            report.unnamed_peers += 1
+        else:
+            named[peer.name] = peer
+
+    report.missing_peers = [name for name in clients if name not in named]
+    report.orphan_peers = [name for name in named if name not in clients and name not in report.unreadable_clients]
+    report.key_mismatches = [name for name, (public_key, _) in clients.items()
+                             if name in named and named[name].public_key != public_key]
+
+    # Один IP не должен принадлежать нескольким клиентам или пирам
+    owners = defaultdict(set)
+    for name, (_, client_ip) in clients.items():
+        if client_ip:
+            owners[client_ip].add(name)
+    for peer in peers:
+        for ip in peer.allowed_ips:
+            owners[ip.split('/')[0]].add(peer.name or peer.public_key[:8])
+    report.duplicate_ips = {ip: names for ip, names in owners.items() if len(names) > 1}
+
+    if live_dump is not None:
+        live = parse_live_peers(live_dump)
+        configured = {peer.public_key: peer.allowed_ips for peer in peers}
+        report.live_peers = len(live)
+        report.live_missing = len(configured.keys() - live.keys())
+        report.live_extra = len(live.keys() - configured.keys() - excluded_keys)
+        report.live_mismatched = sum(1 for key in configured.keys() & live.keys() if configured[key] != live[key])
+    return report, peers, clients
+
+
+def repair_server_config(server_config, report, peers, clients, prune=False):
+    """Новый текст серверного конфига: исправленные ключи, недостающие пиры, (опц.) без сирот"""
+    lines = server_config.split('\n')
+    by_name = {peer.name: peer for peer in peers if peer.name is not None}
+    for name in report.key_mismatches:
+        lines[by_name[name].key_line] = f"PublicKey = {clients[name][0]}"
+    if prune and report.orphan_peers:
+        drop = set()
+        for name in report.orphan_peers:
+            peer = by_name[name]
+            drop.update(range(peer.start, peer.end))
+        lines = [line for i, line in enumerate(lines) if i not in drop]
+    text = '\n'.join(lines)
+    blocks = [peer_block(name, clients[name][0], clients[name][1])
+              for name in sorted(report.missing_peers) if clients[name][1]]
+    return text.rstrip('\n') + '\n' + ''.join(blocks) if blocks else text
+
+
+class Reconciler:
+    def __init__(self, wg_manager, deploy_queue=None):
+        self.wg_manager = wg_manager
+        self.deploy_queue = deploy_queue
+
+    def run(self, repair=False, prune=False):
+        """Сверяет состояние и при repair=True исправляет его одним применением"""
+        lock = self.deploy_queue.server_lock if self.deploy_queue else None
+        if lock:
+            lock.acquire()
+        try:
+            # Клиенты, которых сейчас разворачивает очередь, не считаются расхождением
+            pending = self.deploy_queue.pending_names() if self.deploy_queue else ()
+            client_configs = self.wg_manager.list_client_configs()
+            server_config = self.wg_manager.read_server_config()
+            live_dump = self.wg_manager.dump_interface()
+            report, peers, clients = diff(client_configs, server_config, live_dump, pending)
+            if self.deploy_queue:
+                # Индекс владельцев следует за файлами клиентов (созданными или удаленными вручную)
+                added, removed = self.deploy_queue.owners.sync(client_configs, keep=pending)
+                if added or removed:
+                    logger.info(f"Индекс владельцев: добавлено {added}, удалено {removed}")
+
+            changed = bool(report.missing_peers or report.key_mismatches or (prune and report.orphan_peers))
+            if repair and (changed or report.live_drift):
+                if changed:
+                    if self.deploy_queue:
+                        self.deploy_queue.snapshot("сверка")
+                    self.wg_manager.write_server_config(
+                        repair_server_config(server_config, report, peers, clients, prune=prune)
+                    )
+                self.wg_manager.sync_interface()
+                report.repaired = True
+        finally:
+            if lock:
+                lock.release()
+        if not report.is_clean:
+            logger.warning(f"Сверка WireGuard:\n{report.summary()}")
+        return report
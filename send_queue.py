@@ -0,0 +1,244 @@
+"""Планировщик исходящих запросов к Telegram с учетом ограничений флуда.
+
+Подключается к Application как rate limiter, поэтому через него проходят все
+reply_text/reply_document/edit_text обработчиков без изменения их кода.
+Запрос ждет токен из общего бюджета (SEND_RATE_GLOBAL сообщений в секунду)
+и из бюджета своего чата (SEND_RATE_CHAT), из ожидающих первым уходит запрос
+с более высоким приоритетом. При RetryAfter отправка приостанавливается на
+указанное Telegram время и запрос повторяется. Несколько правок одного
+сообщения, стоящих в очереди, схлопываются: отправляется только последняя.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета (меньше — раньше); 0 не передается PTB в rate_limit_args
+PRIORITY_CONFIG = 1   # выдача файлов конфигурации
+PRIORITY_REPLY = 2    # ответы на действия пользователя
+PRIORITY_INFO = 3     # уведомления и рассылки (отчеты администраторам и т.п.)
+
+# Приоритет по умолчанию для методов API
+ENDPOINT_PRIORITY = {
+    'sendDocument': PRIORITY_CONFIG,
+}
+
+EDIT_ENDPOINTS = ('editMessageText', 'editMessageReplyMarkup', 'editMessageCaption')
+
+# Сколько раз повторять запрос после RetryAfter
+MAX_RETRIES = 3
+
+# С какого числа запомненных чатов забывать неактивные
+PRUNE_THRESHOLD = 1000
+
+
+class _Bucket:
+    """Токены с пополнением rate в секунду и запасом burst"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд будет доступен токен"""
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.burst
+
+
+class SendScheduler(BaseRateLimiter):
+    def __init__(self, global_rate=25, chat_rate=1, chat_burst=3, max_retries=MAX_RETRIES):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._seq = itertools.count()
+        # chat_id -> куча ожидающих (приоритет, номер, future)
+        self._waiting = {}
+        self._buckets = {}
+        # Размер _buckets, при котором пора забыть неактивные чаты
+        self._prune_at = PRUNE_THRESHOLD
+        # Чаты с доступным токеном: (приоритет первого запроса, номер, chat_id),
+        # устаревшие записи пропускаются при извлечении
+        self._ready = []
+        # Чаты, ждущие пополнения своего бюджета: (время, chat_id)
+        self._cooling = []
+        self._cooling_set = set()
+        self._scheduled = {}
+        # (chat_id, message_id) -> future последней правки в очереди
+        self._pending_edits = {}
+        self._paused_until = 0.0
+        self._global = None
+        self._wakeup = None
+        self._task = None
+
+    async def initialize(self):
+        # PTB вызывает initialize дважды (Application и Updater): второй вызов не должен
+        # запускать еще один _dispatch, который shutdown уже не остановит
+        if self._task is not None:
+            return
+        self._global = _Bucket(self.global_rate, self.global_rate, time.monotonic())
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        # Запросы без чата (answerCallbackQuery и т.п.) не ограничиваются
+        if chat_id is None or self._task is None:
+            return await callback(*args, **kwargs)
+        priority = rate_limit_args or ENDPOINT_PRIORITY.get(endpoint, PRIORITY_REPLY)
+        edit_key = (chat_id, data.get('message_id')) if endpoint in EDIT_ENDPOINTS else None
+
+        for attempt in range(self.max_retries + 1):
+            future = self._enqueue(chat_id, priority)
+            if edit_key:
+                # Более старая правка того же сообщения больше не нужна
+                previous = self._pending_edits.get(edit_key)
+                if previous and not previous.done():
+                    previous.set_result(False)
+                self._pending_edits[edit_key] = future
+            try:
+                granted = await future
+            finally:
+                if edit_key and self._pending_edits.get(edit_key) is future:
+                    del self._pending_edits[edit_key]
+            if not granted:
+                return True
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Ограничение Telegram: пауза {e.retry_after} с перед повтором {endpoint}")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                self._wakeup.set()
+
+    def _enqueue(self, chat_id, priority):
+        future = asyncio.get_running_loop().create_future()
+        seq = next(self._seq)
+        waiting = self._waiting.setdefault(chat_id, [])
+        heapq.heappush(waiting, (priority, seq, future))
+        if chat_id not in self._cooling_set and waiting[0][1] == seq:
+            self._schedule(chat_id)
+        self._wakeup.set()
+        return future
+
+    def _schedule(self, chat_id):
+        """Ставит чат в очередь готовых по приоритету его первого запроса"""
+        waiting = self._waiting.get(chat_id)
+        if waiting:
+            priority, seq, _ = waiting[0]
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+            self._scheduled[chat_id] = seq
+
+    def _next_ready(self):
+        """Чат с самым приоритетным запросом или None"""
+        while self._ready:
+            _, seq, chat_id = heapq.heappop(self._ready)
+            if self._scheduled.get(chat_id) != seq:
+                continue  # запись устарела: чат поставлен заново
+            del self._scheduled[chat_id]
+            waiting = self._waiting.get(chat_id)
+            # Отмененные и замененные запросы не расходуют бюджет
+            while waiting and waiting[0][2].done():
+                heapq.heappop(waiting)
+            if waiting:
+                return chat_id
+            self._waiting.pop(chat_id, None)
+        return None
+
+    def _cool(self, chat_id, until):
+        heapq.heappush(self._cooling, (until, chat_id))
+        self._cooling_set.add(chat_id)
+
+    def _grant(self, now):
+        """Отправляет один запрос, если позволяют бюджеты; возвращает False, если отправлять нечего"""
+        chat_id = self._next_ready()
+        if chat_id is None:
+            return False
+        bucket = self._bucket(chat_id, now)
+        wait = bucket.wait_time(now)
+        if wait:
+            self._cool(chat_id, now + wait)
+            return True
+        _, _, future = heapq.heappop(self._waiting[chat_id])
+        future.set_result(True)
+        self._global.tokens -= 1
+        bucket.tokens -= 1
+        if not self._waiting[chat_id]:
+            del self._waiting[chat_id]
+        else:
+            wait = bucket.wait_time(now)
+            if wait:
+                self._cool(chat_id, now + wait)
+            else:
+                self._schedule(chat_id)
+        return True
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = _Bucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _prune(self, now):
+        """Забывает чаты без запросов с полным бюджетом"""
+        for chat_id in [c for c, b in self._buckets.items() if c not in self._waiting and b.is_full(now)]:
+            del self._buckets[chat_id]
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            while self._cooling and self._cooling[0][0] <= now:
+                _, chat_id = heapq.heappop(self._cooling)
+                self._cooling_set.discard(chat_id)
+                self._schedule(chat_id)
+
+            delay = None
+            if now < self._paused_until:
+                delay = self._paused_until - now
+            elif self._ready:
+                delay = self._global.wait_time(now)
+                if not delay and self._grant(now):
+                    # Отдаем управление, чтобы разрешенный запрос ушел
+                    await asyncio.sleep(0)
+                    continue
+                delay = delay or None
+            if delay is None and self._cooling:
+                delay = self._cooling[0][0] - now
+            if len(self._buckets) > self._prune_at:
+                # Под постоянной нагрузкой простоя может не быть, поэтому чистим по размеру;
+                # порог растет вместе с числом активных чатов, чтобы обход оставался редким
+                self._prune(now)
+                self._prune_at = max(PRUNE_THRESHOLD, 2 * len(self._buckets))
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
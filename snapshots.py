@@ -0,0 +1,297 @@
+"""Инкрементальные снимки состояния WireGuard: WG_CONFIG_PATH и WG_CLIENTS_DIR.
+
+Снимок делается перед каждым изменением сервера (пачка развертывания,
+удаление истекших, перевыпуск ключей, исправление сверкой, откат). Файлы
+хранятся как объекты, адресуемые по SHA-256 содержимого и сжатые zlib, в
+каталоге objects/: неизменившийся файл не записывается повторно. Список файлов
+снимка — дерево из объектов: 256 корзин {имя клиента: хеш} и корень
+{хеш конфига сервера, хеши корзин}. Изменение нескольких клиентов
+переписывает только их корзины, а снимок без изменений совпадает с
+предыдущим и не создается.
+
+Чтобы не читать 10 тысяч файлов клиентов на каждый снимок, в базе хранится
+индекс файлов с подписью stat (размер, время изменения); перечитываются только
+файлы с другой подписью. Файлы, измененные в последние секунды перед снимком,
+перечитываются всегда: время изменения может не отличаться при повторной
+записи в ту же секунду.
+
+Вместе с файлами снимок хранит индекс владельцев (владелец и срок действия
+каждого клиента), чтобы откат возвращал временных клиентов временными.
+
+Хранятся SNAPSHOT_KEEP последних снимков; объекты, на которые больше не
+ссылается ни один снимок, удаляются.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    reason TEXT NOT NULL,
+    root TEXT NOT NULL,
+    clients INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshot_files (
+    client_name TEXT PRIMARY KEY,
+    signature TEXT,
+    digest TEXT NOT NULL
+);
+"""
+
+BUCKETS = 256
+# Файлы моложе стольких секунд перечитываются всегда (по часам сервера WireGuard)
+RACY_WINDOW = 2
+# Начиная со скольких измененных файлов читать все конфигурации одной командой
+BULK_READ_THRESHOLD = 100
+# Сколько лишних снимков накапливать перед удалением старых (удаление обходит все объекты)
+PRUNE_SLACK = 10
+
+
+def bucket_of(client_name):
+    return zlib.crc32(client_name.encode()) % BUCKETS
+
+
+class SnapshotStore:
+    def __init__(self, wg_manager, db_path, directory, keep=50, owners=None):
+        self.wg_manager = wg_manager
+        # Индекс владельцев (ownership.OwnershipIndex); задает очередь развертывания
+        self.owners = owners
+        self.db = storage.open_db(db_path)
+        self.db.executescript(SCHEMA)
+        self.objects_dir = os.path.join(directory, 'objects')
+        is_new = not os.path.isdir(self.objects_dir)
+        os.makedirs(self.objects_dir, mode=0o700, exist_ok=True)
+        self.keep = keep
+        self._lock = threading.Lock()
+        # Индекс файлов клиентов на момент последнего снимка: имя -> (подпись stat, хеш)
+        self._files = {
+            row['client_name']: (row['signature'], row['digest'])
+            for row in self.db.execute("SELECT client_name, signature, digest FROM snapshot_files")
+        }
+        if is_new and self._files:
+            # Каталог объектов удален или перенесен: индекс ссылается на несуществующие объекты
+            self._files = {}
+        # Хеши конфига сервера и корзин текущего дерева (считаются при первом снимке)
+        self._server = None
+        self._bucket_digests = None
+
+    # --- объекты ---
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def _put(self, data):
+        """Сохраняет объект, если его еще нет; возвращает хеш"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            # В файлах клиентов приватные ключи
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(data))
+            os.replace(tmp_path, path)
+        return digest
+
+    def _get(self, digest):
+        with open(self._object_path(digest), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def _put_bucket(self, entries):
+        if not entries:
+            return None
+        return self._put(json.dumps(sorted(entries), separators=(',', ':')).encode())
+
+    def _read_tree(self, root):
+        """(хеш конфига сервера, {имя клиента: хеш}) снимка"""
+        tree = json.loads(self._get(root))
+        clients = {}
+        for bucket in tree['clients']:
+            if bucket:
+                clients.update(json.loads(self._get(bucket)))
+        return tree['server'], clients
+
+    # --- снимки ---
+
+    def take(self, reason):
+        """Снимает текущее состояние; возвращает id снимка (прежний, если ничего не изменилось)"""
+        with self._lock:
+            snapshot_id, created = self._take(reason)
+            if created:
+                self._prune()
+            return snapshot_id
+
+    def _take(self, reason):
+        """Снимок под self._lock; возвращает (id, создан ли новый снимок)"""
+        started = time.monotonic()
+        stats = self.wg_manager.stat_client_configs()
+        changed = [name for name, (signature, _) in stats.items()
+                   if name not in self._files or self._files[name][0] != signature
+                   or self._files[name][0] is None]
+        if len(changed) > max(BULK_READ_THRESHOLD, len(stats) // 4):
+            contents = self.wg_manager.list_client_configs()
+        else:
+            contents = self.wg_manager.read_client_configs(changed)
+
+        files = dict(self._files)
+        # Имена, чья запись в индексе изменилась
+        touched = [name for name in files if name not in stats]
+        for name in touched:
+            del files[name]
+        for name in changed:
+            if name not in contents:
+                # Файл удален между stat и чтением
+                if files.pop(name, None):
+                    touched.append(name)
+                continue
+            signature, age = stats[name]
+            # Недавно измененный файл мог измениться еще раз в ту же секунду: подпись не запоминаем
+            files[name] = (signature if age >= RACY_WINDOW else None,
+                           self._put(contents[name].encode()))
+            touched.append(name)
+        server = self._put(self.wg_manager.read_server_config().encode())
+
+        tree = {'server': server, 'clients': self._buckets(files, touched)}
+        if self.owners is not None:
+            tree['owners'] = self._put(json.dumps(self.owners.entries(), separators=(',', ':')).encode())
+        root = self._put(json.dumps(tree, separators=(',', ':')).encode())
+        with storage.transaction(self.db):
+            last = self.db.execute("SELECT id, root FROM snapshots ORDER BY id DESC LIMIT 1").fetchone()
+            if last and last['root'] == root:
+                snapshot_id = last['id']
+            else:
+                snapshot_id = self.db.execute(
+                    "INSERT INTO snapshots (created_at, reason, root, clients) VALUES (?, ?, ?, ?)",
+                    (time.time(), reason, root, len(files)),
+                ).lastrowid
+            self._save_index(files, touched)
+        self._files = files
+        self._server = server
+        created = snapshot_id != (last['id'] if last else None)
+        if created:
+            logger.info(f"Снимок #{snapshot_id} ({reason}): клиентов {len(files)}, "
+                        f"перечитано файлов {len(changed)}, {(time.monotonic() - started) * 1000:.0f} мс")
+        return snapshot_id, created
+
+    def _buckets(self, files, touched):
+        """Хеши корзин дерева; пересчитываются только корзины с изменившимися клиентами"""
+        if self._bucket_digests is None:
+            dirty = set(range(BUCKETS))
+        else:
+            dirty = {bucket_of(name) for name in touched
+                     if files.get(name, (None, None))[1] != self._files.get(name, (None, None))[1]}
+        if dirty:
+            grouped = {bucket: [] for bucket in dirty}
+            for name, (_, digest) in files.items():
+                bucket = bucket_of(name)
+                if bucket in grouped:
+                    grouped[bucket].append((name, digest))
+            digests = list(self._bucket_digests or [None] * BUCKETS)
+            for bucket, entries in grouped.items():
+                digests[bucket] = self._put_bucket(entries)
+            self._bucket_digests = digests
+        return self._bucket_digests
+
+    def _save_index(self, files, touched):
+        removed = [(name,) for name in touched if name not in files]
+        updated = [(name, *files[name]) for name in touched
+                   if name in files and self._files.get(name) != files[name]]
+        if removed:
+            self.db.executemany("DELETE FROM snapshot_files WHERE client_name = ?", removed)
+        if updated:
+            self.db.executemany(
+                "INSERT INTO snapshot_files (client_name, signature, digest) VALUES (?, ?, ?)"
+                " ON CONFLICT(client_name) DO UPDATE SET signature = excluded.signature, digest = excluded.digest",
+                updated,
+            )
+
+    def history(self, limit=10):
+        """Последние снимки: [(id, время, причина, число клиентов)]"""
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT id, created_at, reason, clients FROM snapshots ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [(row['id'], row['created_at'], row['reason'], row['clients']) for row in rows]
+
+    def owners_at(self, snapshot_id):
+        """Индекс владельцев снимка {имя: (user_id, время создания, срок)} или None, если его нет в снимке"""
+        with self._lock:
+            row = self.db.execute("SELECT root FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"Снимок #{snapshot_id} не найден")
+            tree = json.loads(self._get(row['root']))
+            if not tree.get('owners'):
+                return None
+            return {name: (user_id, created_at, expires_at)
+                    for name, user_id, created_at, expires_at in json.loads(self._get(tree['owners']))}
+
+    def restore(self, snapshot_id, keep=()):
+        """Возвращает WG_CONFIG_PATH и WG_CLIENTS_DIR к снимку (интерфейс синхронизирует вызывающий).
+
+        Перед откатом снимается текущее состояние, поэтому откат тоже можно
+        отменить. Переписываются только файлы, отличающиеся от снимка; файлы
+        клиентов из keep (еще разворачиваемых) не трогаются. Возвращает
+        (id снимка до отката, записано файлов, удалено файлов).
+        """
+        with self._lock:
+            row = self.db.execute("SELECT root FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"Снимок #{snapshot_id} не найден")
+            # Старые снимки удаляются после отката, чтобы не потерять объекты восстанавливаемого
+            before_id, created = self._take(f"откат к #{snapshot_id}")
+            server, clients = self._read_tree(row['root'])
+            to_write = {name: self._get(digest).decode() for name, digest in clients.items()
+                        if self._files.get(name, (None, None))[1] != digest and name not in keep}
+            to_remove = [name for name in self._files if name not in clients and name not in keep]
+            if server != self._server:
+                self.wg_manager.write_server_config(self._get(server).decode())
+            self.wg_manager.write_client_configs(to_write)
+            self.wg_manager.remove_client_configs(to_remove)
+            if created:
+                self._prune()
+        logger.warning(f"Откат к снимку #{snapshot_id}: записано файлов {len(to_write)}, удалено {len(to_remove)}")
+        return before_id, len(to_write), len(to_remove)
+
+    def _prune(self):
+        """Удаляет снимки старше SNAPSHOT_KEEP последних и объекты, на которые они одни ссылались"""
+        count = self.db.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+        if count <= self.keep + PRUNE_SLACK:
+            return
+        started = time.monotonic()
+        self.db.execute(
+            "DELETE FROM snapshots WHERE id NOT IN (SELECT id FROM snapshots ORDER BY id DESC LIMIT ?)", (self.keep,)
+        )
+        reachable = set()
+        for (root,) in self.db.execute("SELECT root FROM snapshots").fetchall():
+            if root in reachable:
+                continue
+            reachable.add(root)
+            tree = json.loads(self._get(root))
+            reachable.add(tree['server'])
+            if tree.get('owners'):
+                reachable.add(tree['owners'])
+            for bucket in tree['clients']:
+                if not bucket or bucket in reachable:
+                    continue
+                reachable.add(bucket)
+                reachable.update(digest for _, digest in json.loads(self._get(bucket)))
+        removed = 0
+        for prefix in os.listdir(self.objects_dir):
+            directory = os.path.join(self.objects_dir, prefix)
+            for name in os.listdir(directory):
+                if prefix + name not in reachable:
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+        logger.info(f"Удалено старых снимков: {count - self.keep}, объектов: {removed}, "
+                    f"{(time.monotonic() - started) * 1000:.0f} мс")
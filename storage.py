@@ -0,0 +1,39 @@
+import os
+import sqlite3
+
+
+def open_db(path):
+    """Открывает базу состояния бота в режиме WAL.
+
+    Соединение работает в autocommit: каждая одиночная команда фиксируется
+    сразу, для нескольких команд используйте явный BEGIN IMMEDIATE.
+    Соединение можно использовать из разных потоков под внешней блокировкой.
+    """
+    is_new = not os.path.exists(path)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    if is_new:
+        # В базе лежат приватные ключи клиентов
+        os.chmod(path, 0o600)
+    return conn
+
+
+class transaction:
+    """Контекстный менеджер для BEGIN IMMEDIATE ... COMMIT/ROLLBACK"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
@@ -1,75 +1,232 @@
+import base64
 import os
+import shlex
 import subprocess
-import tempfile
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import x25519
-from cryptography.hazmat.backends import default_backend
-import paramiko
-from config import *
+import time
+import config
+
+# paramiko и cryptography импортируются лениво внутри методов: в локальном
+# режиме SSH не нужен, а их загрузка заметно замедляет запуск бота
+
+class ClientConfigTemplate:
+    """Шаблон клиентского конфига, собранный один раз из настроек.
+
+    Статическая часть (DNS, ключ и endpoint сервера, AllowedIPs) форматируется
+    при создании, для каждого клиента подставляются только ключ и адреса.
+    """
+
+    def __init__(self, settings):
+        self.head = "[Interface]\nPrivateKey = "
+        self.tail = (
+            f"DNS = {settings.client_dns}\n"
+            f"\n"
+            f"[Peer]\n"
+            f"PublicKey = {settings.wg_server_public_key}\n"
+            f"Endpoint = {settings.endpoint}\n"
+            f"AllowedIPs = {settings.client_allowed_ips}\n"
+        )
+
+    def render(self, client_private_key, client_ip, client_ipv6=None):
+        if client_ipv6:
+            address = f"{client_ip}/32,{client_ipv6}/64"
+        else:
+            address = f"{client_ip}/32"
+        return f"{self.head}{client_private_key}\nAddress = {address}\n{self.tail}"
+
+def generate_key_pair():
+    """Генерирует пару ключей X25519 в base64 (приватный, публичный)"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import x25519
+
+    private_key = x25519.X25519PrivateKey.generate()
+    public_key = private_key.public_key()
+    
+    private_key_bytes = private_key.private_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PrivateFormat.Raw,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    
+    public_key_bytes = public_key.public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+    
+    # Конвертируем в base64 для WireGuard (44 символа)
+    private_key_b64 = base64.b64encode(private_key_bytes).decode('utf-8')
+    public_key_b64 = base64.b64encode(public_key_bytes).decode('utf-8')
+    
+    return private_key_b64, public_key_b64
+
+def public_key_from_private(private_key_b64):
+    """Публичный ключ WireGuard (base64) по приватному"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import x25519
+
+    private_key = x25519.X25519PrivateKey.from_private_bytes(base64.b64decode(private_key_b64))
+    public_key_bytes = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+    return base64.b64encode(public_key_bytes).decode('utf-8')
+
+def parse_client_addresses(client_config):
+    """Возвращает (IPv4, IPv6) из строки Address клиентского конфига"""
+    ipv4, ipv6 = None, None
+    for line in client_config.split('\n'):
+        if line.startswith('Address = '):
+            for ip in line.split('=', 1)[1].strip().split(','):
+                ip = ip.strip().split('/')[0]
+                if ':' in ip:
+                    ipv6 = ipv6 or ip
+                elif ip:
+                    ipv4 = ipv4 or ip
+    return ipv4, ipv6
+
+def collect_used_octets(client_configs, reserved_ips=()):
+    """Последние октеты занятых адресов 10.66.66.x из текста конфигов клиентов"""
+    used_octets = []
+    for line in client_configs.split('\n'):
+        if line.startswith('Address = '):
+            for ip in line.split('=')[1].strip().split(','):
+                ip = ip.strip().split('/')[0]
+                if ip.startswith('10.66.66.'):
+                    try:
+                        used_octets.append(int(ip.split('.')[-1]))
+                    except ValueError:
+                        pass
+    for ip in reserved_ips:
+        if ip.startswith('10.66.66.'):
+            used_octets.append(int(ip.split('.')[-1]))
+    return used_octets
+
+def next_client_ip(used_octets):
+    """Наименьший свободный адрес в 2..254: (IPv4, IPv6) или (None, None)"""
+    # Адреса, освобожденные удаленными и истекшими клиентами, выдаются повторно
+    used = set(used_octets)
+    next_octet = next((octet for octet in range(2, 255) if octet not in used), None)
+    if next_octet is None:
+        return None, None  # Нет свободных адресов
+    return f"10.66.66.{next_octet}", f"fd42:42:42:1::{next_octet}"
+
+# Разделитель файлов в выводе list_client_configs по SSH
+CLIENT_FILE_MARKER = '==> wg-client-file: '
+
+def split_client_configs(output):
+    """Разбирает склеенный вывод cat нескольких файлов клиентов в {имя: текст}"""
+    configs = {}
+    name, lines = None, []
+    for line in output.split('\n'):
+        if line.startswith(CLIENT_FILE_MARKER):
+            if name is not None:
+                configs[name] = '\n'.join(lines)
+            name, lines = line[len(CLIENT_FILE_MARKER):][:-len('.conf')], []
+        elif name is not None:
+            lines.append(line)
+    if name is not None:
+        configs[name] = '\n'.join(lines)
+    return configs
+
+def peer_block(client_name, client_public_key, client_ip):
+    """Блок [Peer] клиента для конфигурации сервера"""
+    return f"\n\n# Client: {client_name}\n[Peer]\nPublicKey = {client_public_key}\nAllowedIPs = {client_ip}/32\n"
+
+def peer_names(server_config):
+    """Имена клиентов из комментариев '# Client: <name>' серверного конфига"""
+    return {line.strip()[len('# Client:'):].strip()
+            for line in server_config.split('\n') if line.strip().startswith('# Client:')}
+
+def find_peer_key(server_config, client_name):
+    """PublicKey пира из блока '# Client: <name>' серверного конфига"""
+    in_block = False
+    for line in server_config.split('\n'):
+        stripped = line.strip()
+        if stripped.startswith('# Client:'):
+            in_block = stripped == f"# Client: {client_name}"
+        elif in_block and stripped.startswith('PublicKey'):
+            return stripped.split('=', 1)[1].strip()
+    return None
+
+def replace_peer_key(server_config, client_name, new_public_key):
+    """Заменяет PublicKey в блоке клиента; возвращает новый текст или None"""
+    lines = server_config.split('\n')
+    in_block = False
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith('# Client:'):
+            in_block = stripped == f"# Client: {client_name}"
+        elif in_block and stripped.startswith('PublicKey'):
+            lines[i] = f"PublicKey = {new_public_key}"
+            return '\n'.join(lines)
+    return None
+
+def remove_peers(server_config, client_names):
+    """Удаляет блоки '# Client: <name>' с их [Peer]; возвращает (новый текст, имена удаленных)"""
+    names = set(client_names)
+    kept, removed = [], set()
+    dropping = seen_peer = False
+    for line in server_config.split('\n'):
+        stripped = line.strip()
+        if stripped.startswith('# Client:'):
+            name = stripped[len('# Client:'):].strip()
+            dropping, seen_peer = name in names, False
+            if dropping:
+                removed.add(name)
+        elif dropping and stripped.startswith('['):
+            # Первая секция после комментария — пир клиента, следующая уже чужая
+            if seen_peer:
+                dropping = False
+            seen_peer = True
+        if not dropping:
+            kept.append(line)
+    return '\n'.join(kept), removed
+
+def write_file_atomic(path, content):
+    """Записывает файл через временный файл и rename, сохраняя права доступа"""
+    tmp_path = f"{path}.tmp"
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o600
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.chmod(tmp_path, mode)
+    os.replace(tmp_path, path)
 
 class WireGuardManager:
-    def __init__(self):
+    def __init__(self, settings=None):
+        self.settings = settings or config.get_settings(ssh=True)
+        self.template = ClientConfigTemplate(self.settings)
         self.ssh_client = None
-        
+
     def generate_key_pair(self):
         """Генерирует пару ключей для клиента"""
-        private_key = x25519.X25519PrivateKey.generate()
-        public_key = private_key.public_key()
-        
-        private_key_bytes = private_key.private_bytes(
-            encoding=serialization.Encoding.Raw,
-            format=serialization.PrivateFormat.Raw,
-            encryption_algorithm=serialization.NoEncryption()
-        )
-        
-        public_key_bytes = public_key.public_bytes(
-            encoding=serialization.Encoding.Raw,
-            format=serialization.PublicFormat.Raw
-        )
-        
-        # Конвертируем в base64 для WireGuard (44 символа)
-        import base64
-        private_key_b64 = base64.b64encode(private_key_bytes).decode('utf-8')
-        public_key_b64 = base64.b64encode(public_key_bytes).decode('utf-8')
-        
-        return private_key_b64, public_key_b64
+        return generate_key_pair()
     
     def create_client_config(self, client_name, client_private_key, client_public_key, client_ip, client_ipv6=None):
         """Создает конфигурацию клиента WireGuard"""
-        address_line = f"Address = {client_ip}/32"
-        if client_ipv6:
-            address_line += f",{client_ipv6}/64"
-        config = f"""[Interface]
-PrivateKey = {client_private_key}
-{address_line}
-DNS = {CLIENT_DNS}
-
-[Peer]
-PublicKey = {WG_SERVER_PUBLIC_KEY}
-Endpoint = {WG_SERVER_IP}:{WG_SERVER_PORT}
-AllowedIPs = {CLIENT_ALLOWED_IPS}
-"""
-        return config
+        return self.template.render(client_private_key, client_ip, client_ipv6)
     
     def connect_ssh(self):
         """Подключается к серверу по SSH"""
+        import paramiko
         try:
             self.ssh_client = paramiko.SSHClient()
             self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             
-            if SSH_KEY_PATH:
+            if self.settings.ssh_key_path:
                 self.ssh_client.connect(
-                    SSH_HOST, 
-                    port=SSH_PORT, 
-                    username=SSH_USERNAME,
-                    key_filename=SSH_KEY_PATH
+                    self.settings.ssh_host, 
+                    port=self.settings.ssh_port, 
+                    username=self.settings.ssh_username,
+                    key_filename=self.settings.ssh_key_path
                 )
             else:
                 self.ssh_client.connect(
-                    SSH_HOST, 
-                    port=SSH_PORT, 
-                    username=SSH_USERNAME,
-                    password=SSH_PASSWORD
+                    self.settings.ssh_host, 
+                    port=self.settings.ssh_port, 
+                    username=self.settings.ssh_username,
+                    password=self.settings.ssh_password
                 )
             return True
         except Exception as e:
@@ -81,6 +238,26 @@ AllowedIPs = {CLIENT_ALLOWED_IPS}
         if self.ssh_client:
             self.ssh_client.close()
     
+    def run_command(self, command):
+        """Выполняет команду на сервере, при ненулевом коде возврата бросает RuntimeError"""
+        stdin, stdout, stderr = self.ssh_client.exec_command(command)
+        output = stdout.read().decode()
+        if stdout.channel.recv_exit_status() != 0:
+            raise RuntimeError(f"{command}: {stderr.read().decode().strip()}")
+        return output
+
+    def sftp_write_atomic(self, sftp, path, content):
+        """Записывает удаленный файл через временный файл и rename, сохраняя права"""
+        tmp_path = f"{path}.tmp"
+        try:
+            mode = sftp.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o600
+        with sftp.open(tmp_path, 'w') as f:
+            f.write(content)
+        sftp.chmod(tmp_path, mode)
+        sftp.posix_rename(tmp_path, path)
+
     def check_client_name_exists(self, client_name):
         """Проверяет, существует ли уже конфигурация с таким именем"""
         if not self.connect_ssh():
@@ -88,7 +265,7 @@ AllowedIPs = {CLIENT_ALLOWED_IPS}
         try:
             sftp = self.ssh_client.open_sftp()
             try:
-                sftp.stat(f"{WG_CLIENTS_DIR}/{client_name}.conf")
+                sftp.stat(f"{self.settings.wg_clients_dir}/{client_name}.conf")
                 return True  # Файл существует
             except FileNotFoundError:
                 return False  # Файл не найден
@@ -100,60 +277,20 @@ AllowedIPs = {CLIENT_ALLOWED_IPS}
         finally:
             self.disconnect_ssh()
     
-    def get_next_client_ip(self):
-        """Получает следующий доступный IP для клиента и соответствующий IPv6"""
+    def get_next_client_ip(self, reserved_ips=()):
+        """Получает следующий доступный IP для клиента и соответствующий IPv6.
+
+        reserved_ips -- адреса, уже выделенные клиентам, чьих файлов еще нет.
+        """
         if not self.connect_ssh():
             return None, None
         try:
-            # Получаем список существующих файлов клиентов
-            stdin, stdout, stderr = self.ssh_client.exec_command(f"ls {WG_CLIENTS_DIR}/*.conf 2>/dev/null || echo ''")
-            client_files = stdout.read().decode().strip().split('\n')
-            
-            used_octets = []
-            used_ipv6 = []
-            
-            # Читаем каждый файл клиента и извлекаем IP-адреса
-            for client_file in client_files:
-                if client_file.strip():
-                    try:
-                        stdin, stdout, stderr = self.ssh_client.exec_command(f"cat {client_file}")
-                        client_config = stdout.read().decode()
-                        
-                        for line in client_config.split('\n'):
-                            if line.startswith('Address = '):
-                                ips = line.split('=')[1].strip().split(',')
-                                for ip in ips:
-                                    ip = ip.strip().split('/')[0]
-                                    if ip.startswith('10.66.66.'):
-                                        try:
-                                            octet = int(ip.split('.')[-1])
-                                            used_octets.append(octet)
-                                        except Exception:
-                                            pass
-                                    elif ip.startswith('fd42:42:42:1::'):
-                                        try:
-                                            n = int(ip.split('::')[-1])
-                                            used_ipv6.append(n)
-                                        except Exception:
-                                            pass
-                    except Exception as e:
-                        print(f"Ошибка чтения файла {client_file}: {e}")
-                        continue
-            
-            # Если нет ни одного, начинаем с 2
-            if not used_octets:
-                next_octet = 2
-            else:
-                next_octet = max(used_octets) + 1
-            
-            if next_octet > 254:
-                return None, None  # Нет свободных адресов
-            
-            next_ipv4 = f"10.66.66.{next_octet}"
-            next_ipv6 = f"fd42:42:42:1::{next_octet}"
-            
-            print(f"Debug: used_octets={used_octets}, next_octet={next_octet}")
-            return next_ipv4, next_ipv6
+            # Читаем все файлы клиентов одной командой вместо cat на каждый файл
+            stdin, stdout, stderr = self.ssh_client.exec_command(
+                f"cat {shlex.quote(self.settings.wg_clients_dir)}/*.conf 2>/dev/null"
+            )
+            used_octets = collect_used_octets(stdout.read().decode(), reserved_ips)
+            return next_client_ip(used_octets)
             
         except Exception as e:
             print(f"Ошибка получения IP: {e}")
@@ -161,46 +298,209 @@ AllowedIPs = {CLIENT_ALLOWED_IPS}
             self.disconnect_ssh()
         return None, None
     
-    def add_client_to_server(self, client_name, client_public_key, client_ip, client_private_key):
-        """Добавляет клиента в конфигурацию сервера"""
+    def write_client_config(self, client_name, client_config):
+        """Сохраняет конфигурацию клиента в WG_CLIENTS_DIR (повторный вызов безопасен)"""
         if not self.connect_ssh():
-            return False
-            
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                self.sftp_write_atomic(sftp, f"{self.settings.wg_clients_dir}/{client_name}.conf", client_config)
+            finally:
+                sftp.close()
+        finally:
+            self.disconnect_ssh()
+    
+    def append_peers(self, peers):
+        """Дописывает пиры [(имя, публичный ключ, IP)] в WG_CONFIG_PATH одной записью.
+
+        Клиенты, чей блок уже есть в конфигурации, пропускаются.
+        """
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                with sftp.open(self.settings.wg_config_path, 'r') as f:
+                    server_config = f.read().decode()
+                existing = peer_names(server_config)
+                blocks = [peer_block(name, public_key, client_ip)
+                          for name, public_key, client_ip in peers
+                          if name not in existing]
+                if blocks:
+                    with sftp.open(self.settings.wg_config_path, 'a') as f:
+                        f.write(''.join(blocks))
+            finally:
+                sftp.close()
+        finally:
+            self.disconnect_ssh()
+    
+    def remove_client_configs(self, client_names):
+        """Удаляет файлы клиентов одной командой (отсутствующие пропускаются)"""
+        if not client_names:
+            return
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            paths = " ".join(shlex.quote(f"{self.settings.wg_clients_dir}/{name}.conf") for name in client_names)
+            self.run_command(f"rm -f -- {paths}")
+        finally:
+            self.disconnect_ssh()
+    
+    def list_client_names(self):
+        """Имена всех клиентов по файлам в WG_CLIENTS_DIR"""
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                return [f[:-len('.conf')] for f in sftp.listdir(self.settings.wg_clients_dir) if f.endswith('.conf')]
+            except FileNotFoundError:
+                return []
+            finally:
+                sftp.close()
+        finally:
+            self.disconnect_ssh()
+    
+    def stat_client_configs(self):
+        """Подписи файлов клиентов {имя: (размер и время изменения, возраст файла в секундах)}"""
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            # Возраст считается по часам сервера: время изменения файлов задают они
+            now = int(self.run_command("date +%s").strip())
+            sftp = self.ssh_client.open_sftp()
+            try:
+                return {attr.filename[:-len('.conf')]: (f"{attr.st_size}:{attr.st_mtime}", now - attr.st_mtime)
+                        for attr in sftp.listdir_attr(self.settings.wg_clients_dir)
+                        if attr.filename.endswith('.conf')}
+            except FileNotFoundError:
+                return {}
+            finally:
+                sftp.close()
+        finally:
+            self.disconnect_ssh()
+    
+    def read_client_configs(self, client_names):
+        """Конфигурации указанных клиентов {имя: текст} за одно подключение (отсутствующие пропускаются)"""
+        configs = {}
+        if not client_names:
+            return configs
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                for name in client_names:
+                    try:
+                        with sftp.open(f"{self.settings.wg_clients_dir}/{name}.conf", 'r') as f:
+                            configs[name] = f.read().decode()
+                    except FileNotFoundError:
+                        pass
+            finally:
+                sftp.close()
+        finally:
+            self.disconnect_ssh()
+        return configs
+    
+    def write_client_configs(self, client_configs):
+        """Записывает несколько конфигураций клиентов {имя: текст} за одно подключение"""
+        if not client_configs:
+            return
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                for name, client_config in client_configs.items():
+                    self.sftp_write_atomic(sftp, f"{self.settings.wg_clients_dir}/{name}.conf", client_config)
+            finally:
+                sftp.close()
+        finally:
+            self.disconnect_ssh()
+    
+    def list_client_configs(self):
+        """Все конфигурации клиентов {имя: текст}, одной командой"""
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            output = self.run_command(
+                f"cd {shlex.quote(self.settings.wg_clients_dir)} && "
+                f"for f in *.conf; do [ -e \"$f\" ] || continue; echo \"{CLIENT_FILE_MARKER}$f\"; cat \"$f\"; echo; done"
+            )
+        finally:
+            self.disconnect_ssh()
+        return split_client_configs(output)
+    
+    def read_server_config(self):
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                with sftp.open(self.settings.wg_config_path, 'r') as f:
+                    return f.read().decode()
+            finally:
+                sftp.close()
+        finally:
+            self.disconnect_ssh()
+    
+    def write_server_config(self, server_config):
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                self.sftp_write_atomic(sftp, self.settings.wg_config_path, server_config)
+            finally:
+                sftp.close()
+        finally:
+            self.disconnect_ssh()
+    
+    def dump_interface(self):
+        """Вывод `wg show <iface> dump` или None, если интерфейс недоступен"""
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            return self.run_command(f"wg show {shlex.quote(self.settings.wg_interface)} dump")
+        except RuntimeError:
+            return None
+        finally:
+            self.disconnect_ssh()
+    
+    def sync_interface(self):
+        """Применяет WG_CONFIG_PATH к работающему интерфейсу без разрыва соединений"""
+        if not self.connect_ssh():
+            raise RuntimeError("Не удалось подключиться к серверу по SSH")
+        try:
+            interface = shlex.quote(self.settings.wg_interface)
+            self.run_command(f"wg syncconf {interface} <(wg-quick strip {interface})")
+        finally:
+            self.disconnect_ssh()
+    
+    def add_client_to_server(self, client_name, client_public_key, client_ip, client_private_key, client_ipv6=None):
+        """Добавляет клиента в конфигурацию сервера"""
         try:
             # Создаем конфигурацию клиента в директории clients
             client_config = self.create_client_config(
                 client_name, 
                 client_private_key, 
                 client_public_key, 
-                client_ip
+                client_ip,
+                client_ipv6
             )
-            
-            # Сохраняем конфигурацию клиента в файл
-            client_config_path = f"{WG_CLIENTS_DIR}/{client_name}.conf"
-            stdin, stdout, stderr = self.ssh_client.exec_command(f"echo '{client_config}' > {client_config_path}")
+            self.write_client_config(client_name, client_config)
             
             # Добавляем нового клиента в конфигурацию сервера
-            peer_config = f"""
-
-# Client: {client_name}
-[Peer]
-PublicKey = {client_public_key}
-AllowedIPs = {client_ip}/32
-"""
-            
-            # Добавляем в конец файла конфигурации сервера
-            stdin, stdout, stderr = self.ssh_client.exec_command(f"echo '{peer_config}' >> {WG_CONFIG_PATH}")
-            
-            # Перезапускаем WireGuard
-            stdin, stdout, stderr = self.ssh_client.exec_command(f"wg syncconf {WG_INTERFACE} <(wg-quick strip {WG_INTERFACE})")
+            self.append_peers([(client_name, client_public_key, client_ip)])
             
+            # Применяем конфигурацию WireGuard
+            self.sync_interface()
             return True
             
         except Exception as e:
             print(f"Ошибка добавления клиента: {e}")
             return False
-        finally:
-            self.disconnect_ssh()
     
     def create_and_deploy_config(self, client_name):
         """Создает конфигурацию клиента и разворачивает на сервере"""
@@ -216,74 +516,208 @@ AllowedIPs = {client_ip}/32
                 client_name, private_key, public_key, client_ip, client_ipv6
             )
             # Добавляем клиента на сервер
-            if not self.add_client_to_server(client_name, public_key, client_ip, private_key):
+            if not self.add_client_to_server(client_name, public_key, client_ip, private_key, client_ipv6):
                 return None, "Не удалось добавить клиента на сервер"
             return client_config, None
         except Exception as e:
             return None, f"Ошибка создания конфигурации: {e}" 
 
+    def get_client_config(self, client_name):
+        """Возвращает сохраненную конфигурацию клиента или None"""
+        if not self.connect_ssh():
+            return None
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                with sftp.open(f"{self.settings.wg_clients_dir}/{client_name}.conf", 'r') as f:
+                    return f.read().decode()
+            except FileNotFoundError:
+                return None
+            finally:
+                sftp.close()
+        except Exception as e:
+            print(f"Ошибка чтения конфигурации клиента: {e}")
+            return None
+        finally:
+            self.disconnect_ssh()
+
+    def rotate_client_key(self, client_name):
+        """Перевыпускает ключи клиента, сохраняя его адрес.
+
+        Публичный ключ пира заменяется на месте в WG_CONFIG_PATH и в
+        работающем интерфейсе (wg set), без поиска свободного IP и без
+        полной синхронизации конфигурации. Сначала ключ меняется в
+        интерфейсе одной командой; если после этого не удалась запись
+        файлов, прежний конфиг сервера и ключ в интерфейсе возвращаются.
+        """
+        if not self.connect_ssh():
+            return None, "Не удалось подключиться к серверу"
+        try:
+            sftp = self.ssh_client.open_sftp()
+            try:
+                client_config_path = f"{self.settings.wg_clients_dir}/{client_name}.conf"
+                try:
+                    with sftp.open(client_config_path, 'r') as f:
+                        old_client_config = f.read().decode()
+                except FileNotFoundError:
+                    return None, f"Конфигурация '{client_name}' не найдена"
+                with sftp.open(self.settings.wg_config_path, 'r') as f:
+                    server_config = f.read().decode()
+
+                client_ip, client_ipv6 = parse_client_addresses(old_client_config)
+                old_public_key = find_peer_key(server_config, client_name)
+                if not client_ip or not old_public_key:
+                    return None, f"Клиент '{client_name}' не найден в конфигурации сервера"
+
+                private_key, public_key = self.generate_key_pair()
+                client_config = self.create_client_config(
+                    client_name, private_key, public_key, client_ip, client_ipv6
+                )
+
+                # Меняем ключ в работающем интерфейсе одной командой: пир не пропадает между шагами
+                interface = shlex.quote(self.settings.wg_interface)
+                self.run_command(
+                    f"wg set {interface} peer {shlex.quote(old_public_key)} remove"
+                    f" peer {shlex.quote(public_key)} allowed-ips {client_ip}/32"
+                )
+                try:
+                    self.sftp_write_atomic(sftp, self.settings.wg_config_path,
+                                           replace_peer_key(server_config, client_name, public_key))
+                    self.sftp_write_atomic(sftp, client_config_path, client_config)
+                except Exception:
+                    # Клиент остается со старым ключом, который у него есть
+                    self.sftp_write_atomic(sftp, self.settings.wg_config_path, server_config)
+                    self.run_command(
+                        f"wg set {interface} peer {shlex.quote(public_key)} remove"
+                        f" peer {shlex.quote(old_public_key)} allowed-ips {client_ip}/32"
+                    )
+                    raise
+                return client_config, None
+            finally:
+                sftp.close()
+        except Exception as e:
+            return None, f"Ошибка перевыпуска ключей: {e}"
+        finally:
+            self.disconnect_ssh()
+
 class WireGuardManagerLocal:
-    def __init__(self):
-        pass
+    def __init__(self, settings=None):
+        self.settings = settings or config.get_settings()
+        self.template = ClientConfigTemplate(self.settings)
 
     def generate_key_pair(self):
-        return WireGuardManager().generate_key_pair()
+        return generate_key_pair()
 
     def create_client_config(self, client_name, client_private_key, client_public_key, client_ip, client_ipv6=None):
-        return WireGuardManager().create_client_config(client_name, client_private_key, client_public_key, client_ip, client_ipv6)
+        return self.template.render(client_private_key, client_ip, client_ipv6)
 
     def check_client_name_exists(self, client_name):
-        path = os.path.join(WG_CLIENTS_DIR, f"{client_name}.conf")
+        path = os.path.join(self.settings.wg_clients_dir, f"{client_name}.conf")
         return os.path.isfile(path)
 
-    def get_next_client_ip(self):
-        used_octets = []
-        used_ipv6 = []
-        if not os.path.isdir(WG_CLIENTS_DIR):
-            os.makedirs(WG_CLIENTS_DIR)
-        for fname in os.listdir(WG_CLIENTS_DIR):
+    def get_next_client_ip(self, reserved_ips=()):
+        if not os.path.isdir(self.settings.wg_clients_dir):
+            os.makedirs(self.settings.wg_clients_dir)
+        used_octets = collect_used_octets('', reserved_ips)
+        for fname in os.listdir(self.settings.wg_clients_dir):
             if fname.endswith('.conf'):
-                with open(os.path.join(WG_CLIENTS_DIR, fname), 'r') as f:
-                    for line in f:
-                        if line.startswith('Address = '):
-                            ips = line.split('=')[1].strip().split(',')
-                            for ip in ips:
-                                ip = ip.strip().split('/')[0]
-                                if ip.startswith('10.66.66.'):
-                                    try:
-                                        octet = int(ip.split('.')[-1])
-                                        used_octets.append(octet)
-                                    except Exception:
-                                        pass
-                                elif ip.startswith('fd42:42:42:1::'):
-                                    try:
-                                        n = int(ip.split('::')[-1])
-                                        used_ipv6.append(n)
-                                    except Exception:
-                                        pass
-        next_octet = max(used_octets) + 1 if used_octets else 2
-        if next_octet > 254:
-            return None, None
-        next_ipv4 = f"10.66.66.{next_octet}"
-        next_ipv6 = f"fd42:42:42:1::{next_octet}"
-        return next_ipv4, next_ipv6
+                with open(os.path.join(self.settings.wg_clients_dir, fname), 'r') as f:
+                    used_octets += collect_used_octets(f.read())
+        return next_client_ip(used_octets)
 
-    def add_client_to_server(self, client_name, client_public_key, client_ip, client_private_key):
-        # Создаем конфиг клиента
-        client_config = self.create_client_config(client_name, client_private_key, client_public_key, client_ip)
-        client_config_path = os.path.join(WG_CLIENTS_DIR, f"{client_name}.conf")
-        with open(client_config_path, 'w') as f:
-            f.write(client_config)
-        # Добавляем peer в серверный конфиг
-        peer_config = f"\n\n# Client: {client_name}\n[Peer]\nPublicKey = {client_public_key}\nAllowedIPs = {client_ip}/32\n"
-        with open(WG_CONFIG_PATH, 'a') as f:
-            f.write(peer_config)
+    def write_client_config(self, client_name, client_config):
+        write_file_atomic(os.path.join(self.settings.wg_clients_dir, f"{client_name}.conf"), client_config)
+
+    def append_peers(self, peers):
+        # Пропускаем клиентов, которые уже есть в серверном конфиге
+        with open(self.settings.wg_config_path, 'r') as f:
+            server_config = f.read()
+        existing = peer_names(server_config)
+        blocks = [peer_block(name, public_key, client_ip)
+                  for name, public_key, client_ip in peers
+                  if name not in existing]
+        if blocks:
+            with open(self.settings.wg_config_path, 'a') as f:
+                f.write(''.join(blocks))
+
+    def remove_client_configs(self, client_names):
+        for name in client_names:
+            try:
+                os.remove(os.path.join(self.settings.wg_clients_dir, f"{name}.conf"))
+            except FileNotFoundError:
+                pass
+
+    def list_client_names(self):
+        if not os.path.isdir(self.settings.wg_clients_dir):
+            return []
+        return [f[:-len('.conf')] for f in os.listdir(self.settings.wg_clients_dir) if f.endswith('.conf')]
+
+    def stat_client_configs(self):
+        stats = {}
+        try:
+            entries = os.scandir(self.settings.wg_clients_dir)
+        except FileNotFoundError:
+            return stats
+        now = time.time()
+        with entries:
+            for entry in entries:
+                if entry.name.endswith('.conf'):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    # Запись через rename меняет inode, даже если размер и время совпали
+                    stats[entry.name[:-len('.conf')]] = (f"{st.st_size}:{st.st_mtime_ns}:{st.st_ino}", now - st.st_mtime)
+        return stats
+
+    def read_client_configs(self, client_names):
+        configs = {}
+        for name in client_names:
+            client_config = self.get_client_config(name)
+            if client_config is not None:
+                configs[name] = client_config
+        return configs
+
+    def write_client_configs(self, client_configs):
+        for name, client_config in client_configs.items():
+            self.write_client_config(name, client_config)
+
+    def list_client_configs(self):
+        configs = {}
+        if not os.path.isdir(self.settings.wg_clients_dir):
+            return configs
+        for fname in os.listdir(self.settings.wg_clients_dir):
+            if fname.endswith('.conf'):
+                with open(os.path.join(self.settings.wg_clients_dir, fname), 'r') as f:
+                    configs[fname[:-len('.conf')]] = f.read()
+        return configs
+
+    def read_server_config(self):
+        with open(self.settings.wg_config_path, 'r') as f:
+            return f.read()
+
+    def write_server_config(self, server_config):
+        write_file_atomic(self.settings.wg_config_path, server_config)
+
+    def dump_interface(self):
+        result = subprocess.run(["wg", "show", self.settings.wg_interface, "dump"], capture_output=True, text=True)
+        return result.stdout if result.returncode == 0 else None
+
+    def sync_interface(self):
         # Перезапуск wg
         try:
-            subprocess.run(["wg-quick", "down", WG_INTERFACE], check=True)
+            subprocess.run(["wg-quick", "down", self.settings.wg_interface], check=True)
         except Exception:
             pass  # если не поднят, игнорируем
-        subprocess.run(["wg-quick", "up", WG_INTERFACE], check=True)
+        subprocess.run(["wg-quick", "up", self.settings.wg_interface], check=True)
+
+    def add_client_to_server(self, client_name, client_public_key, client_ip, client_private_key, client_ipv6=None):
+        # Создаем конфиг клиента
+        client_config = self.create_client_config(client_name, client_private_key, client_public_key, client_ip, client_ipv6)
+        self.write_client_config(client_name, client_config)
+        # Добавляем peer в серверный конфиг
+        self.append_peers([(client_name, client_public_key, client_ip)])
+        self.sync_interface()
         return True
 
     def create_and_deploy_config(self, client_name):
@@ -293,8 +727,48 @@ class WireGuardManagerLocal:
             if not client_ip:
                 return None, "Не удалось получить IP адрес"
             client_config = self.create_client_config(client_name, private_key, public_key, client_ip, client_ipv6)
-            if not self.add_client_to_server(client_name, public_key, client_ip, private_key):
+            if not self.add_client_to_server(client_name, public_key, client_ip, private_key, client_ipv6):
                 return None, "Не удалось добавить клиента на сервер"
             return client_config, None
         except Exception as e:
-            return None, f"Ошибка создания конфигурации: {e}" 
\ No newline at end of file
+            return None, f"Ошибка создания конфигурации: {e}"
+
+    def get_client_config(self, client_name):
+        path = os.path.join(self.settings.wg_clients_dir, f"{client_name}.conf")
+        try:
+            with open(path, 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def rotate_client_key(self, client_name):
+        try:
+            old_client_config = self.get_client_config(client_name)
+            if old_client_config is None:
+                return None, f"Конфигурация '{client_name}' не найдена"
+            with open(self.settings.wg_config_path, 'r') as f:
+                server_config = f.read()
+            client_ip, client_ipv6 = parse_client_addresses(old_client_config)
+            old_public_key = find_peer_key(server_config, client_name)
+            if not client_ip or not old_public_key:
+                return None, f"Клиент '{client_name}' не найден в конфигурации сервера"
+
+            private_key, public_key = self.generate_key_pair()
+            client_config = self.create_client_config(client_name, private_key, public_key, client_ip, client_ipv6)
+            # Меняем ключ в работающем интерфейсе без перезапуска, одной командой
+            interface = self.settings.wg_interface
+            subprocess.run(["wg", "set", interface, "peer", old_public_key, "remove",
+                            "peer", public_key, "allowed-ips", f"{client_ip}/32"], check=True)
+            try:
+                write_file_atomic(self.settings.wg_config_path,
+                                  replace_peer_key(server_config, client_name, public_key))
+                write_file_atomic(os.path.join(self.settings.wg_clients_dir, f"{client_name}.conf"), client_config)
+            except Exception:
+                # Клиент остается со старым ключом, который у него есть
+                write_file_atomic(self.settings.wg_config_path, server_config)
+                subprocess.run(["wg", "set", interface, "peer", public_key, "remove",
+                                "peer", old_public_key, "allowed-ips", f"{client_ip}/32"], check=True)
+                raise
+            return client_config, None
+        except Exception as e:
+            return None, f"Ошибка перевыпуска ключей: {e}" 
\ No newline at end of file